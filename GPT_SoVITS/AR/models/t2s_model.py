@@ -1,6 +1,7 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
 import math
+import time
 from typing import List, Optional
 
 import torch
@@ -10,12 +11,12 @@ from torchmetrics.classification import MulticlassAccuracy
 from tqdm import tqdm
 
 from AR.models.utils import (
+    T2SSampler,
     dpo_loss,
     get_batch_logps,
     make_pad_mask,
     make_pad_mask_left,
     make_reject_y,
-    sample,
     topk_sampling,
 )
 from AR.modules.embedding import SinePositionalEmbedding, TokenEmbedding
@@ -173,6 +174,48 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def process_prompt_ragged(
+        self,
+        x: torch.Tensor,
+        cu_seqlens: List[int],
+        attn_masks: List[torch.Tensor],
+        torch_sdpa: bool = True,
+    ):
+        """
+        无 padding 的打包序列 prefill。x 为 (1, N, D)，各序列首尾相接，第 i 条为 x[:, cu_seqlens[i]:cu_seqlens[i+1]]。
+        线性层与 MLP 对整个打包序列计算，注意力按序列分别计算，attn_masks[i] 为第 i 条序列的 (1, 1, L_i, L_i) mask。
+        """
+        q, k_cache, v_cache = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        attn_list: List[torch.Tensor] = []
+        for i in range(len(attn_masks)):
+            start = cu_seqlens[i]
+            end = cu_seqlens[i + 1]
+            seq_len = end - start
+            q_i = q[:, start:end].reshape(1, seq_len, self.num_heads, -1).transpose(1, 2)
+            k_i = k_cache[:, start:end].reshape(1, seq_len, self.num_heads, -1).transpose(1, 2)
+            v_i = v_cache[:, start:end].reshape(1, seq_len, self.num_heads, -1).transpose(1, 2)
+
+            if torch_sdpa:
+                attn_i = F.scaled_dot_product_attention(q_i, k_i, v_i, ~attn_masks[i])
+            else:
+                attn_i = scaled_dot_product_attention(q_i, k_i, v_i, attn_masks[i])
+            attn_list.append(attn_i.transpose(1, 2).reshape(1, seq_len, -1))
+
+        attn = F.linear(torch.cat(attn_list, dim=1), self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(x, [self.hidden_dim], self.norm_w1, self.norm_b1, self.norm_eps1)
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x, k_cache, v_cache
+
     def decode_next_token(
         self,
         x: torch.Tensor,
@@ -242,6 +285,21 @@ class T2STransformer:
             v_cache.append(v_cache_)
         return x, k_cache, v_cache
 
+    def process_prompt_ragged(
+        self,
+        x: torch.Tensor,
+        cu_seqlens: List[int],
+        attn_masks: List[torch.Tensor],
+        torch_sdpa: bool = True,
+    ):
+        k_cache: List[torch.Tensor] = []
+        v_cache: List[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            x, k_cache_, v_cache_ = self.blocks[i].process_prompt_ragged(x, cu_seqlens, attn_masks, torch_sdpa)
+            k_cache.append(k_cache_)
+            v_cache.append(v_cache_)
+        return x, k_cache, v_cache
+
     def decode_next_token(
         self,
         x: torch.Tensor,
@@ -256,6 +314,24 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def decode_next_token_partial(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        num_layers: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        """只经过前 num_layers 层，用作投机解码的草稿模型；只返回前 num_layers 层的 cache"""
+        new_k_cache: List[torch.Tensor] = []
+        new_v_cache: List[torch.Tensor] = []
+        for i in range(num_layers):
+            x, k_cache_, v_cache_ = self.blocks[i].decode_next_token(x, k_cache[i], v_cache[i], attn_mask, torch_sdpa)
+            new_k_cache.append(k_cache_)
+            new_v_cache.append(v_cache_)
+        return x, new_k_cache, new_v_cache
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -351,6 +427,7 @@ class Text2SemanticDecoder(nn.Module):
             blocks.append(block)
 
         self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        self.reset_speculative_stats()
 
     def make_input_data(self, x, x_lens, y, y_lens, bert_feature):
         x = self.ar_text_embedding(x)
@@ -580,69 +657,172 @@ class Text2SemanticDecoder(nn.Module):
         # 错位
         return targets[:, :-1], targets[:, 1:]
 
-    def infer_panel_batch_infer(
+    def build_prompt_kv(
         self,
-        x: List[torch.LongTensor],  #####全部文本token
-        x_lens: torch.LongTensor,
-        prompts: torch.LongTensor,  ####参考音频token
-        bert_feature: List[torch.LongTensor],
-        top_k: int = -100,
-        top_p: int = 100,
-        early_stop_num: int = -1,
-        temperature: float = 1.0,
-        repetition_penalty: float = 1.35,
-        **kwargs,
-    ):
-        if prompts is None:
-            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
-            return self.infer_panel_naive_batched(
-                x,
-                x_lens,
-                prompts,
-                bert_feature,
-                top_k=top_k,
-                top_p=top_p,
-                early_stop_num=early_stop_num,
-                temperature=temperature,
-                **kwargs,
-            )
-
-        max_len = kwargs.get("max_len", x_lens.max())
-        x_list = []
-        for x_item, bert_item in zip(x, bert_feature):
-            # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
-            x_item = self.ar_text_embedding(x_item.unsqueeze(0))
-            x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
-            x_item = self.ar_text_position(x_item).squeeze(0)
-            # x_item = F.pad(x_item,(0,0,0,max_len-x_item.shape[0]),value=0) if x_item.shape[0]<max_len else x_item  ### padding right
-            x_item = (
-                F.pad(x_item, (0, 0, max_len - x_item.shape[0], 0), value=0) if x_item.shape[0] < max_len else x_item
-            )  ### padding left
-            x_list.append(x_item)
-        x: torch.Tensor = torch.stack(x_list, dim=0)
-
-        # AR Decoder
-        y = prompts
+        prompt_phones: torch.LongTensor,
+        prompt_bert_feature: torch.Tensor,
+        prompt_semantic: torch.LongTensor,
+    ) -> dict:
+        """
+        预计算参考前缀的 kv cache，同一音色的所有句子共用。
+
+        原始输入顺序为 [参考音素 ; 目标文本音素 ; 参考语义 token]，参考部分会看到目标文本，无法直接复用。
+        这里把序列重排为 [参考音素 ; 参考语义 token[:-1]] | [目标文本音素 ; 参考语义 token[-1]]，
+        前半段作为前缀只在参考内部做注意力（音素双向、语义因果），后半段每句单独计算:
+        目标文本看全部音素、不看语义 token；最后一个参考语义 token 看全部内容，由它预测第一个生成 token。
+        位置编码与原始输入一致。与原始输入的差别只在于参考前缀不再看到目标文本，结果为近似。
+
+        Args:
+            prompt_phones: (1, P)
+            prompt_bert_feature: (1, 1024, P)
+            prompt_semantic: (1, Y)
+        """
+        x = self.ar_text_embedding(prompt_phones)
+        x = x + self.bert_proj(prompt_bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+        y_pos = self.ar_audio_position(self.ar_audio_embedding(prompt_semantic[:, :-1]))
+        xy_pos = torch.concat([x, y_pos], dim=1)
 
         x_len = x.shape[1]
-        stop = False
+        y_len = y_pos.shape[1]
+        src_len = x_len + y_len
+        x_attn_mask = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool, device=x.device),
+            (0, y_len),
+            value=True,
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=x.device), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        attn_mask = torch.concat([x_attn_mask, y_attn_mask], dim=0).view(1, 1, src_len, src_len)
+        _, k_cache, v_cache = self.t2s_transformer.process_prompt(
+            xy_pos, attn_mask.expand(1, self.num_head, -1, -1), None
+        )
+        return {
+            "phones_len": x_len,
+            "semantic_len": prompt_semantic.shape[1],
+            "k_cache": k_cache,
+            "v_cache": v_cache,
+        }
+
+    def _prefill_with_prompt_kv(self, x: torch.Tensor, x_lens: torch.LongTensor, y: torch.LongTensor, prompt_kv: dict):
+        """
+        构造从参考前缀 kv cache 继续计算的第一步输入，配合 decode_next_token 使用。
+
+        Args:
+            x: (bsz, T, D) 目标文本音素（已含位置编码，左侧 padding）
+            x_lens: (bsz,) 目标文本音素的实际长度
+            y: (bsz, Y) 参考语义 token
+        Returns:
+            xy_pos, attn_mask, k_cache, v_cache
+        """
+        bsz, text_len = x.shape[0], x.shape[1]
+        phones_len = prompt_kv["phones_len"]
+        cache_len = prompt_kv["k_cache"][0].shape[1]
+        q_len = text_len + 1
+
+        xy_pos = torch.concat([x, self._embed_semantic(y[:, -1:], y.shape[1] - 1)], dim=1)
+
+        # |  参考音素  | 参考语义[:-1] |  pad + 目标文本  | 参考语义[-1] |
+        attn_mask = torch.zeros(bsz, q_len, cache_len + q_len, dtype=torch.bool, device=x.device)
+        attn_mask[:, :text_len, phones_len:cache_len] = True
+        attn_mask[:, :text_len, -1] = True
+        text_padding_mask = make_pad_mask_left(x_lens, text_len).to(x.device)
+        attn_mask[:, :, cache_len : cache_len + text_len] |= text_padding_mask.unsqueeze(1)
+        attn_mask = attn_mask.unsqueeze(1).expand(-1, self.num_head, -1, -1)
+
+        k_cache = [k.expand(bsz, -1, -1) for k in prompt_kv["k_cache"]]
+        v_cache = [v.expand(bsz, -1, -1) for v in prompt_kv["v_cache"]]
+        return xy_pos, attn_mask, k_cache, v_cache
+
+    @staticmethod
+    def _prefix_causal_mask(x_len: int, y_len: int, device) -> torch.Tensor:
+        """单条 [x ; y] 序列的 (x_len + y_len, x_len + y_len) mask：x 内双向、不看 y，y 看全部 x 且内部因果。True 表示屏蔽"""
+        x_mask = F.pad(
+            torch.zeros(x_len, x_len, dtype=torch.bool, device=device),
+            (0, y_len),
+            value=True,
+        )
+        y_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=device), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        return torch.concat([x_mask, y_mask], dim=0)
 
-        k_cache = None
-        v_cache = None
-        ###################  first step ##########################
-        assert y is not None, "Error: Prompt free is not supported batch_infer!"
-        ref_free = False
+    def _prefill_ragged(self, x_list: List[torch.Tensor], y_pos: torch.Tensor):
+        """
+        无 padding 的 prefill：把各条 [x_i ; y] 首尾相接成一条打包序列，用累计长度 cu_seqlens 索引，
+        注意力按序列分别计算，mask 按 (x_len, y_len) 现场生成，不再构造 [bsz, num_head, src_len, src_len] 的 mask。
+        prefill 结束后再把 kv cache 按左侧 padding 排成 (bsz, src_len, D) 供逐 token 解码使用。
+
+        Args:
+            x_list: 每条为 (x_len_i, D)，已含位置编码，无 padding
+            y_pos: (bsz, Y, D) 参考语义 token（已含位置编码）
+        Returns:
+            xy_dec: (bsz, 1, D) 每条序列最后一个位置的输出
+            k_cache, v_cache: 每层 (bsz, src_len, D)
+            key_padding_mask: (bsz, 1, 1, src_len)，True 表示左侧 padding
+        """
+        bsz = len(x_list)
+        y_len = y_pos.shape[1]
+        device = y_pos.device
+
+        seq_lens = [x_item.shape[0] + y_len for x_item in x_list]
+        cu_seqlens = [0]
+        for seq_len in seq_lens:
+            cu_seqlens.append(cu_seqlens[-1] + seq_len)
+        packed = torch.concat(
+            [torch.concat([x_item, y_pos[i]], dim=0) for i, x_item in enumerate(x_list)], dim=0
+        ).unsqueeze(0)
+
+        mask_of_len = {}
+        attn_masks = []
+        for x_item in x_list:
+            x_len = x_item.shape[0]
+            if x_len not in mask_of_len:
+                mask_of_len[x_len] = self._prefix_causal_mask(x_len, y_len, device).view(1, 1, x_len + y_len, -1)
+            attn_masks.append(mask_of_len[x_len])
+
+        xy_dec, k_packed, v_packed = self.t2s_transformer.process_prompt_ragged(packed, cu_seqlens, attn_masks)
+        last_index = torch.LongTensor([end - 1 for end in cu_seqlens[1:]]).to(device)
+        xy_dec = xy_dec[0].index_select(0, last_index).unsqueeze(1)
+
+        # 打包序列中第 j 个位置写到左侧 padding 的 cache 的 dest_index[j] 处
+        src_len = max(seq_lens)
+        seq_lens_t = torch.LongTensor(seq_lens).to(device)
+        dest_index = torch.concat(
+            [torch.arange(src_len - seq_len, src_len, device=device) + i * src_len for i, seq_len in enumerate(seq_lens)]
+        )
+        k_cache = [
+            k.new_zeros(bsz * src_len, k.shape[-1]).index_copy_(0, dest_index, k[0]).view(bsz, src_len, -1)
+            for k in k_packed
+        ]
+        v_cache = [
+            v.new_zeros(bsz * src_len, v.shape[-1]).index_copy_(0, dest_index, v[0]).view(bsz, src_len, -1)
+            for v in v_packed
+        ]
+        key_padding_mask = torch.arange(src_len, device=device).unsqueeze(0) < (src_len - seq_lens_t).unsqueeze(1)
+        return xy_dec, k_cache, v_cache, key_padding_mask.view(bsz, 1, 1, src_len)
+
+    def _prefill_padded(self, x: torch.Tensor, x_lens: torch.LongTensor, y_pos: torch.Tensor, max_len: int):
+        """
+        左侧 padding 的 prefill 输入与 mask，供没有 process_prompt_ragged 的后端使用。
 
-        y_emb = self.ar_audio_embedding(y)
-        y_len = y_emb.shape[1]
-        prefix_len = y.shape[1]
-        y_lens = torch.LongTensor([y_emb.shape[1]] * y_emb.shape[0]).to(x.device)
-        y_pos = self.ar_audio_position(y_emb)
+        Args:
+            x: (bsz, max_len, D) 左侧 padding 的文本音素（已含位置编码）
+            y_pos: (bsz, Y, D) 参考语义 token（已含位置编码）
+        Returns:
+            xy_pos, attn_mask: (bsz, num_head, src_len, src_len)
+        """
+        bsz, x_len, y_len = x.shape[0], x.shape[1], y_pos.shape[1]
         xy_pos = torch.concat([x, y_pos], dim=1)
 
         ##### create mask #####
-        bsz = x.shape[0]
         src_len = x_len + y_len
+        y_lens = torch.LongTensor([y_len] * bsz).to(x.device)
         y_paddind_mask = make_pad_mask_left(y_lens, y_len)
         x_paddind_mask = make_pad_mask_left(x_lens, max_len)
 
@@ -693,27 +873,126 @@ class Text2SemanticDecoder(nn.Module):
         # [PAD, PAD, PAD, 1, 2, 3,   4, EOS, EOS],
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5, EOS],
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5,   6]]
+        return xy_pos, attn_mask
+
+    def infer_panel_batch_infer(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        if prompts is None:
+            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
+            return self.infer_panel_naive_batched(
+                x,
+                x_lens,
+                prompts,
+                bert_feature,
+                top_k=top_k,
+                top_p=top_p,
+                early_stop_num=early_stop_num,
+                temperature=temperature,
+                **kwargs,
+            )
+
+        t_start = time.perf_counter()
+        t_prefilled = None
+        max_len = kwargs.get("max_len", x_lens.max())
+        prompt_kv = kwargs.get("prompt_kv", None)
+        if prompt_kv is not None:
+            # 参考音素已在前缀 cache 中，只保留目标文本部分（位置编码仍按完整序列计算）
+            max_len = max_len - prompt_kv["phones_len"]
+            x_lens = x_lens - prompt_kv["phones_len"]
+        # 不带参考前缀 cache 时默认走无 padding 的打包 prefill；导出 / 量化后端没有该接口时回退到左侧 padding
+        ragged_prefill = (
+            kwargs.get("ragged_prefill", True)
+            and prompt_kv is None
+            and hasattr(self.t2s_transformer, "process_prompt_ragged")
+        )
+        x_list = []
+        for x_item, bert_item in zip(x, bert_feature):
+            # max_len = max(max_len, x_item.shape[0], bert_item.shape[1])
+            x_item = self.ar_text_embedding(x_item.unsqueeze(0))
+            x_item = x_item + self.bert_proj(bert_item.transpose(0, 1).unsqueeze(0))
+            x_item = self.ar_text_position(x_item).squeeze(0)
+            if prompt_kv is not None:
+                x_item = x_item[prompt_kv["phones_len"] :]
+            if ragged_prefill:
+                x_list.append(x_item)
+                continue
+            # x_item = F.pad(x_item,(0,0,0,max_len-x_item.shape[0]),value=0) if x_item.shape[0]<max_len else x_item  ### padding right
+            x_item = (
+                F.pad(x_item, (0, 0, max_len - x_item.shape[0], 0), value=0) if x_item.shape[0] < max_len else x_item
+            )  ### padding left
+            x_list.append(x_item)
+        bsz = len(x_list)
+
+        # AR Decoder
+        y = prompts
+        stop = False
+
+        k_cache = None
+        v_cache = None
+        ###################  first step ##########################
+        assert y is not None, "Error: Prompt free is not supported batch_infer!"
+        ref_free = False
+
+        y_emb = self.ar_audio_embedding(y)
+        y_len = y_emb.shape[1]
+        prefix_len = y.shape[1]
+        y_pos = self.ar_audio_position(y_emb)
+        if ragged_prefill:
+            xy_dec, k_cache, v_cache, key_padding_mask = self._prefill_ragged(x_list, y_pos)
+        elif prompt_kv is not None:
+            xy_pos, attn_mask, k_cache, v_cache = self._prefill_with_prompt_kv(
+                torch.stack(x_list, dim=0), x_lens, y, prompt_kv
+            )
+        else:
+            xy_pos, attn_mask = self._prefill_padded(torch.stack(x_list, dim=0), x_lens, y_pos, max_len)
 
         ###### decode #####
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
+        sampler = T2SSampler(
+            y, self.vocab_size, top_k, top_p, temperature, repetition_penalty, generator=kwargs.get("generator")
+        )
+        should_stop = kwargs.get("should_stop", None)
         for idx in tqdm(range(1500)):
+            if should_stop is not None and should_stop():
+                print("T2S Decoding stopped")
+                break
+            if idx == 1:
+                # 首步末尾的 EOS 判断已同步设备, 此前的耗时都算 prefill
+                t_prefilled = time.perf_counter()
             if idx == 0:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                if not ragged_prefill:
+                    if k_cache is None:
+                        xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                    else:
+                        xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(
+                            xy_pos, k_cache, v_cache, attn_mask
+                        )
+                    # 最后一行即各序列对 key 的 padding mask
+                    key_padding_mask = attn_mask[:, :1, -1:]
+                # 逐 token 解码的 mask 一次性预留到最大长度，每步只取切片，不再逐步 F.pad
+                step_mask = F.pad(key_padding_mask, (0, 1500), value=False)
             else:
+                attn_mask = step_mask[..., : k_cache[0].shape[1] + 1]
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
                 logits = logits[:, :-1]
-            else:
-                attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = sampler.sample(logits)
 
             y = torch.concat([y, samples], dim=1)
 
@@ -738,7 +1017,8 @@ class Text2SemanticDecoder(nn.Module):
             if reserved_idx_of_batch_for_y is not None:
                 # index = torch.LongTensor(batch_idx_map).to(y.device)
                 y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
-                attn_mask = torch.index_select(attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
+                step_mask = torch.index_select(step_mask, dim=0, index=reserved_idx_of_batch_for_y)
+                sampler.select(reserved_idx_of_batch_for_y)
                 if k_cache is not None:
                     for i in range(len(k_cache)):
                         k_cache[i] = torch.index_select(k_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
@@ -769,12 +1049,13 @@ class Text2SemanticDecoder(nn.Module):
             ].to(dtype=y_emb.dtype, device=y_emb.device)
 
         if None in idx_list:
-            for i in range(x.shape[0]):
+            for i in range(bsz):
                 if idx_list[i] is None:
                     idx_list[i] = 1500 - 1  ###如果没有生成到EOS，就用最大长度代替
+        self._record_timing(kwargs.get("timing"), t_start, t_prefilled, sum(idx_list))
 
         if ref_free:
-            return y_list, [0] * x.shape[0]
+            return y_list, [0] * bsz
         # print(idx_list)
         return y_list, idx_list
 
@@ -824,6 +1105,8 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs,
     ):
+        t_start = time.perf_counter()
+        t_prefilled = None
         x = self.ar_text_embedding(x)
         x = x + self.bert_proj(bert_feature.transpose(1, 2))
         x = self.ar_text_position(x)
@@ -874,12 +1157,27 @@ class Text2SemanticDecoder(nn.Module):
             .view(bsz, self.num_head, src_len, src_len)
             .to(device=x.device, dtype=torch.bool)
         )
+        sampler = T2SSampler(
+            y, self.vocab_size, top_k, top_p, temperature, repetition_penalty, generator=kwargs.get("generator")
+        )
+
+        prompt_kv = kwargs.get("prompt_kv", None)
+        if prompt_kv is not None and not ref_free:
+            x = x[:, prompt_kv["phones_len"] :]
+            x_lens = torch.LongTensor([x.shape[1]]).to(x.device)
+            xy_pos, xy_attn_mask, k_cache, v_cache = self._prefill_with_prompt_kv(x, x_lens, y, prompt_kv)
 
+        should_stop = kwargs.get("should_stop", None)
         for idx in tqdm(range(1500)):
-            if xy_attn_mask is not None:
+            if should_stop is not None and should_stop():
+                print("T2S Decoding stopped")
+                break
+            if idx == 1:
+                t_prefilled = time.perf_counter()
+            if xy_attn_mask is not None and k_cache is None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
             else:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
+                xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, xy_attn_mask)
 
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
@@ -888,9 +1186,7 @@ class Text2SemanticDecoder(nn.Module):
             if idx < 11:  ###至少预测出10个token不然不给停止（0.4s）
                 logits = logits[:, :-1]
 
-            samples = sample(
-                logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
-            )[0]
+            samples = sampler.sample(logits)
 
             y = torch.concat([y, samples], dim=1)
 
@@ -913,10 +1209,272 @@ class Text2SemanticDecoder(nn.Module):
                 :, y_len + idx
             ].to(dtype=y_emb.dtype, device=y_emb.device)
 
+        self._record_timing(kwargs.get("timing"), t_start, t_prefilled, idx)
         if ref_free:
             return y[:, :-1], 0
         return y[:, :-1], idx
 
+    @staticmethod
+    def _record_timing(timing: Optional[dict], start: float, prefilled: Optional[float], tokens: int):
+        """把首步 (prefill) 与逐 token 解码的耗时累加到调用方传入的 kwargs["timing"]"""
+        if timing is None:
+            return
+        end = time.perf_counter()
+        prefilled = prefilled if prefilled is not None else end
+        timing["prefill"] = timing.get("prefill", 0.0) + prefilled - start
+        timing["decode"] = timing.get("decode", 0.0) + end - prefilled
+        timing["tokens"] = timing.get("tokens", 0) + tokens
+
+    def reset_speculative_stats(self):
+        # rounds: 验证轮数; proposed/accepted: 草稿 token 数; forwards: 完整模型前向次数; tokens: 生成 token 数
+        self.speculative_stats = {"rounds": 0, "proposed": 0, "accepted": 0, "forwards": 0, "tokens": 0}
+
+    def _embed_semantic(self, tokens: torch.Tensor, start: int) -> torch.Tensor:
+        """语义 token (bsz, n) 的 embedding 加上从 start 开始的位置编码"""
+        y_emb = self.ar_audio_embedding(tokens)
+        return y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[
+            :, start : start + tokens.shape[1]
+        ].to(dtype=y_emb.dtype, device=y_emb.device)
+
+    @staticmethod
+    def _ngram_propose(history: List[int], k: int, max_ngram: int = 3) -> List[int]:
+        """在历史 token 中查找与末尾 n-gram 相同的最近一次出现，返回其后续最多 k 个 token"""
+        for n in range(min(max_ngram, len(history) - 1), 0, -1):
+            tail = history[-n:]
+            for start in range(len(history) - n - 1, -1, -1):
+                if history[start : start + n] == tail:
+                    return history[start + n : start + n + k]
+        return []
+
+    def infer_panel_speculative(
+        self,
+        x: torch.LongTensor,  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        speculative_k: int = 4,
+        speculative_draft: str = "layers",
+        draft_layers: int = 0,
+        **kwargs,
+    ):
+        """
+        投机解码版 infer_panel_naive（bsz=1），输出分布与逐 token 采样一致。
+        每轮由草稿提出最多 speculative_k 个 token，完整模型一次前向并行验证:
+            speculative_draft="layers"  同一模型的前 draft_layers 层（默认 1/4）作草稿，与完整模型共用这几层的 kv cache
+            speculative_draft="ngram"   在历史语义 token 中查找与末尾相同的 n-gram，取其后续 token 作草稿
+        按 speculative sampling 以 min(1, p/q) 接受草稿 token，拒绝时从 max(p - q, 0) 重新采样；
+        全部接受时再从最后一个位置额外采样一个 token。统计累加到 self.speculative_stats。
+        """
+        assert x.shape[0] == 1, "speculative decoding only supports batch size 1"
+        assert speculative_draft in ["layers", "ngram"]
+        t_start = time.perf_counter()
+        x = self.ar_text_embedding(x)
+        x = x + self.bert_proj(bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+
+        # AR Decoder
+        y = prompts
+
+        x_len = x.shape[1]
+        x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
+
+        ###################  first step ##########################
+        if y is not None:
+            y_emb = self.ar_audio_embedding(y)
+            y_len = y_emb.shape[1]
+            prefix_len = y.shape[1]
+            y_pos = self.ar_audio_position(y_emb)
+            xy_pos = torch.concat([x, y_pos], dim=1)
+            ref_free = False
+        else:
+            y_len = 0
+            prefix_len = 0
+            xy_pos = x
+            y = torch.zeros(x.shape[0], 0, dtype=torch.int, device=x.device)
+            ref_free = True
+
+        src_len = x_len + y_len
+        x_attn_mask_pad = F.pad(x_attn_mask, (0, y_len), value=True)
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = (
+            torch.concat([x_attn_mask_pad, y_attn_mask], dim=0)
+            .view(1, 1, src_len, src_len)
+            .expand(1, self.num_head, -1, -1)
+            .to(device=x.device, dtype=torch.bool)
+        )
+        sampler = T2SSampler(
+            y, self.vocab_size, top_k, top_p, temperature, repetition_penalty, generator=kwargs.get("generator")
+        )
+        draft_layers = draft_layers if draft_layers > 0 else max(1, self.num_layers // 4)
+        max_tokens = 1500
+        stats = {"rounds": 0, "proposed": 0, "accepted": 0, "forwards": 1, "tokens": 0}
+
+        prompt_kv = kwargs.get("prompt_kv", None)
+        if prompt_kv is not None and not ref_free:
+            x = x[:, prompt_kv["phones_len"] :]
+            x_lens = torch.LongTensor([x.shape[1]]).to(x.device)
+            xy_pos, xy_attn_mask, k_cache, v_cache = self._prefill_with_prompt_kv(x, x_lens, y, prompt_kv)
+            xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, xy_attn_mask)
+        else:
+            xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        logits = self.ar_predict_layer(xy_dec[:, -1])
+        history: List[int] = y[0].tolist()
+        t_prefilled = time.perf_counter()
+        new_tokens: List[int] = []
+        cache_len = k_cache[0].shape[1]
+        drafts = y[:, :0]
+        draft_probs: List[torch.Tensor] = []
+        stop = False
+        should_stop = kwargs.get("should_stop", None)
+        while True:
+            if should_stop is not None and should_stop():
+                print("T2S Decoding stopped")
+                break
+            ####### 验证草稿：logits 第 j 行是草稿第 j 个 token 位置上的目标分布 #######
+            accepted = 0
+            pending = None
+            for j in range(drafts.shape[1]):
+                step_logits = logits[j : j + 1]
+                p = sampler.dense_probs(step_logits)
+                token = drafts[:, j : j + 1]
+                q = draft_probs[j]
+                if sampler.uniform() * q[0, token].item() < p[0, token].item():
+                    accepted += 1
+                else:
+                    residual = (p - q).clamp_min(0)
+                    residual = residual if residual.sum() > 0 else p
+                    token = sampler.draw(residual / residual.sum())
+                    pending = token
+                sampler.mark(token)
+                new_tokens.append(token.item())
+                stop = self._speculative_stop(step_logits, new_tokens, early_stop_num, max_tokens)
+                if stop or pending is not None:
+                    break
+            if not stop and pending is None:
+                # 草稿全部接受（或没有草稿），从最后一个位置再采样一个 token
+                step_logits = logits[-1:]
+                if len(new_tokens) < 11:  ###至少预测出10个token不然不给停止（0.4s）
+                    step_logits = step_logits[:, :-1]
+                pending = sampler.sample(step_logits)
+                new_tokens.append(pending.item())
+                stop = self._speculative_stop(step_logits, new_tokens, early_stop_num, max_tokens)
+            stats["accepted"] += accepted
+            if stop:
+                break
+
+            # 丢弃未被接受的草稿在 kv cache 中的位置
+            if drafts.shape[1] > 0:
+                cache_len = cache_len + 1 + accepted
+                k_cache = [k[:, :cache_len] for k in k_cache]
+                v_cache = [v[:, :cache_len] for v in v_cache]
+            else:
+                cache_len = k_cache[0].shape[1]
+            history.extend(new_tokens[len(history) - prefix_len :])
+
+            ####### 草稿：pending 的下标为 n-1，草稿从下标 n 开始，前 11 个 token 不投机 #######
+            n = len(new_tokens)
+            k = min(speculative_k, max_tokens - n) if n >= 11 else 0
+            draft_probs = []
+            if k > 0 and speculative_draft == "layers":
+                draft_tokens = []
+                dk, dv = k_cache[:draft_layers], v_cache[:draft_layers]
+                token = pending
+                for j in range(k):
+                    h = self._embed_semantic(token, y_len + n - 1 + j)
+                    h, dk, dv = self.t2s_transformer.decode_next_token_partial(h, dk, dv, draft_layers)
+                    q = sampler.dense_probs(self.ar_predict_layer(h[:, -1]))
+                    token = sampler.draw(q)
+                    draft_tokens.append(token)
+                    draft_probs.append(q)
+                drafts = torch.concat(draft_tokens, dim=1).to(dtype=y.dtype) if draft_tokens else y[:, :0]
+            elif k > 0:
+                proposal = self._ngram_propose(history, k)
+                drafts = torch.tensor([proposal], dtype=y.dtype, device=y.device).view(1, -1)
+                for token in proposal:
+                    q = torch.zeros(1, self.vocab_size, device=logits.device)
+                    q[0, token] = 1.0
+                    draft_probs.append(q)
+            else:
+                drafts = y[:, :0]
+            stats["proposed"] += drafts.shape[1]
+
+            ####### 完整模型一次前向验证 pending + 草稿 #######
+            feed = torch.concat([pending.to(dtype=y.dtype), drafts], dim=1)
+            q_len = feed.shape[1]
+            attn_mask = None
+            if q_len > 1:
+                attn_mask = F.pad(
+                    torch.triu(torch.ones(q_len, q_len, dtype=torch.bool, device=x.device), diagonal=1),
+                    (cache_len, 0),
+                    value=False,
+                ).view(1, 1, q_len, cache_len + q_len)
+            xy_pos = self._embed_semantic(feed, y_len + n - 1)
+            xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
+            logits = self.ar_predict_layer(xy_dec[0])
+            stats["forwards"] += 1
+            stats["rounds"] += 1 if q_len > 1 else 0
+
+        stats["tokens"] = len(new_tokens)
+        for key, value in stats.items():
+            self.speculative_stats[key] += value
+        self._record_timing(kwargs.get("timing"), t_start, t_prefilled, len(new_tokens))
+        print(f"T2S Decoding EOS [{prefix_len} -> {prefix_len + len(new_tokens)}]")
+        y = torch.concat([y, torch.tensor([new_tokens], dtype=y.dtype, device=y.device)], dim=1)
+        if ref_free:
+            return y[:, :-1], 0
+        return y[:, :-1], len(new_tokens) - 1
+
+    def _speculative_stop(self, step_logits: torch.Tensor, new_tokens: List[int], early_stop_num: int, max_tokens: int):
+        """与 infer_panel_naive 相同的停止条件"""
+        if early_stop_num != -1 and len(new_tokens) > early_stop_num:
+            print("use early stop num:", early_stop_num)
+            return True
+        if torch.argmax(step_logits, dim=-1)[0] == self.EOS or new_tokens[-1] == self.EOS:
+            return True
+        return len(new_tokens) >= max_tokens
+
+    def infer_panel_speculative_batched(
+        self,
+        x: List[torch.LongTensor],  #####全部文本token
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,  ####参考音频token
+        bert_feature: List[torch.LongTensor],
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs,
+    ):
+        y_list = []
+        idx_list = []
+        for i in range(len(x)):
+            y, idx = self.infer_panel_speculative(
+                x[i].unsqueeze(0),
+                x_lens[i],
+                prompts[i].unsqueeze(0) if prompts is not None else None,
+                bert_feature[i].unsqueeze(0),
+                top_k,
+                top_p,
+                early_stop_num,
+                temperature,
+                repetition_penalty,
+                **kwargs,
+            )
+            y_list.append(y[0])
+            idx_list.append(idx)
+
+        return y_list, idx_list
+
     def infer_panel(
         self,
         x: torch.LongTensor,  #####全部文本token
@@ -139,8 +139,9 @@ from typing import Optional
 
 def multinomial_sample_one_no_sync(
     probs_sort,
+    generator: Optional[torch.Generator] = None,
 ):  # Does multinomial sampling without a cuda synchronization
-    q = torch.empty_like(probs_sort).exponential_(1)
+    q = torch.empty_like(probs_sort).exponential_(1, generator=generator)
     return torch.argmax(probs_sort / q, dim=-1, keepdim=True).to(dtype=torch.int)
 
 
@@ -199,6 +200,120 @@ def sample(
     return idx_next, probs
 
 
+def _per_row(value, bsz: int, device, dtype) -> torch.Tensor:
+    """标量或逐行参数统一为 (bsz, 1) 的张量"""
+    value = torch.as_tensor(value, dtype=dtype, device=device)
+    return value.reshape(-1, 1).expand(bsz, 1) if value.numel() == 1 else value.reshape(bsz, 1)
+
+
+class T2SSampler:
+    """
+    T2S 解码循环用的批量采样器，与 logits_to_probs + sample 的结果分布一致，但每步开销更低:
+        1. 维护每行已出现 token 的 bitmap，重复惩罚为 O(vocab)，不再随历史长度增长
+        2. 先取 top-k 再做 top-p，只对 k 个候选排序/累加，概率用全词表 logsumexp 归一化，
+           因此与对全词表排序后做 top-p 的结果相同
+        3. 只在 k 个候选上做 softmax 和采样
+    top_k / top_p / temperature / repetition_penalty 均可为标量或长度为 bsz 的逐行参数。
+    generator 不为 None 时所有随机数都取自它，采样结果只由其 seed 决定，与全局随机状态无关。
+    """
+
+    def __init__(
+        self,
+        y: torch.Tensor,
+        vocab_size: int,
+        top_k=-1,
+        top_p=1.0,
+        temperature=1.0,
+        repetition_penalty=1.0,
+        generator: Optional[torch.Generator] = None,
+    ):
+        bsz = y.shape[0]
+        device = y.device
+        self.vocab_size = vocab_size
+        self.generator = generator
+        self.presence = torch.zeros(bsz, vocab_size, dtype=torch.bool, device=device)
+        if y.shape[1] > 0:
+            self.presence.scatter_(1, y.long(), True)
+
+        top_k = _per_row(top_k, bsz, device, torch.long)
+        self.top_k = torch.where(top_k > 0, top_k, torch.full_like(top_k, vocab_size)).clamp_max(vocab_size)
+        self.top_p = _per_row(top_p, bsz, device, torch.float32)
+        self.temperature = _per_row(temperature, bsz, device, torch.float32).clamp_min(1e-5)
+        self.repetition_penalty = _per_row(repetition_penalty, bsz, device, torch.float32)
+        self._update_flags()
+
+    def _update_flags(self):
+        # 参数在解码过程中不变，提前算好各步骤是否需要执行，避免每步同步
+        self.max_top_k = int(self.top_k.max().item()) if self.top_k.numel() > 0 else self.vocab_size
+        self.use_top_p = bool((self.top_p < 1.0).any().item())
+        self.use_penalty = bool((self.repetition_penalty != 1.0).any().item())
+
+    def select(self, index: torch.Tensor):
+        """batch 中部分序列生成完毕后，只保留 index 对应的行"""
+        self.presence = torch.index_select(self.presence, 0, index)
+        self.top_k = torch.index_select(self.top_k, 0, index)
+        self.top_p = torch.index_select(self.top_p, 0, index)
+        self.temperature = torch.index_select(self.temperature, 0, index)
+        self.repetition_penalty = torch.index_select(self.repetition_penalty, 0, index)
+        self._update_flags()
+
+    def filter(self, logits: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            logits: (bsz, V)，V 可小于 vocab_size（前几步会去掉 EOS）
+        Returns:
+            probs: (bsz, k) 候选 token 的概率
+            indices: (bsz, k) 候选 token 的 id
+        """
+        logits = logits.float()
+        vocab = logits.shape[-1]
+        if self.use_penalty:
+            presence = self.presence[:, :vocab]
+            penalized = torch.where(logits < 0, logits * self.repetition_penalty, logits / self.repetition_penalty)
+            logits = torch.where(presence, penalized, logits)
+
+        k = min(self.max_top_k, vocab)
+        values, indices = torch.topk(logits, k)
+        keep = torch.arange(k, device=logits.device).unsqueeze(0) < self.top_k
+
+        if self.use_top_p:
+            # 与原实现一致：top-p 在温度缩放之前、基于全词表概率计算
+            cum_probs = torch.exp(values - torch.logsumexp(logits, dim=-1, keepdim=True)).cumsum(dim=-1)
+            remove = cum_probs > self.top_p
+            remove[:, 0] = False
+            keep = keep & ~remove
+
+        values = (values / self.temperature).masked_fill(~keep, -float("Inf"))
+        probs = torch.nn.functional.softmax(values, dim=-1)
+        return probs, indices
+
+    def dense_probs(self, logits: torch.Tensor) -> torch.Tensor:
+        """filter 的结果放回全词表，返回 (bsz, V) 的概率"""
+        probs, indices = self.filter(logits)
+        return torch.zeros(logits.shape, dtype=probs.dtype, device=probs.device).scatter_(1, indices, probs)
+
+    def mark(self, tokens: torch.Tensor):
+        """将 (bsz, n) 的 token 记为已出现"""
+        self.presence.scatter_(1, tokens.long(), True)
+
+    def draw(self, probs: torch.Tensor) -> torch.Tensor:
+        """按 (bsz, V) 的概率抽样，返回 (bsz, 1)"""
+        return multinomial_sample_one_no_sync(probs, self.generator)
+
+    def uniform(self) -> float:
+        """[0, 1) 均匀分布随机数"""
+        device = self.generator.device if self.generator is not None else "cpu"
+        return torch.rand(1, generator=self.generator, device=device).item()
+
+    def sample(self, logits: torch.Tensor) -> torch.Tensor:
+        """采样下一个 token 并更新 bitmap，返回 (bsz, 1) 的 int 张量"""
+        probs, indices = self.filter(logits)
+        choice = self.draw(probs)
+        samples = torch.gather(indices, 1, choice.long())
+        self.mark(samples)
+        return samples.to(dtype=torch.int)
+
+
 def dpo_loss(
     policy_chosen_logps: torch.FloatTensor,
     policy_rejected_logps: torch.FloatTensor,
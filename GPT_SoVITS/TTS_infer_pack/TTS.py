@@ -5,6 +5,7 @@ import random
 import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 import torchaudio
@@ -13,7 +14,7 @@ from tqdm import tqdm
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 import os
-from typing import List, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 import ffmpeg
 import librosa
@@ -28,13 +29,16 @@ from module.mel_processing import mel_spectrogram_torch, spectrogram_torch
 from module.models import SynthesizerTrn, SynthesizerTrnV3, Generator
 from peft import LoraConfig, get_peft_model
 from process_ckpt import get_sovits_version_from_path_fast, load_sovits_new
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoConfig, AutoModelForMaskedLM, AutoTokenizer
 
 from tools.audio_sr import AP_BWE
+from tools.metrics import model_load, observe_stage, observe_synthesis, observe_t2s, record_model_load
 from tools.i18n.i18n import I18nAuto, scan_language_list
 from tools.my_utils import load_audio
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.exported_models import BACKENDS, ExportedEncP, load_exported_models
+from TTS_infer_pack import quantization
 
 language = os.environ.get("language", "Auto")
 language = sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
@@ -146,6 +150,10 @@ class NO_PROMPT_ERROR(Exception):
     pass
 
 
+class INFERENCE_STOPPED(Exception):
+    pass
+
+
 # configs/tts_infer.yaml
 """
 custom:
@@ -290,6 +298,9 @@ class TTS_Config:
         version = configs.get("version", "v2").lower()
         assert version in ["v1", "v2", "v3", "v4"]
         self.default_configs[version] = configs.get(version, self.default_configs[version])
+        if "custom" not in configs and "t2s_weights_path" in configs:
+            # 扁平配置（如 ModelCache 传入的字典）直接作为 custom 使用
+            configs = {"custom": configs}
         self.configs: dict = configs.get("custom", deepcopy(self.default_configs[version]))
 
         self.device = self.configs.get("device", torch.device("cpu"))
@@ -298,9 +309,30 @@ class TTS_Config:
             self.device = torch.device("cpu")
 
         self.is_half = self.configs.get("is_half", False)
-        # if str(self.device) == "cpu" and self.is_half:
-        #     print(f"Warning: Half precision is not supported on CPU, set is_half to False.")
-        #     self.is_half = False
+        if str(self.device) == "cpu" and self.is_half:
+            print("Warning: Half precision is not supported on CPU, set is_half to False.")
+            self.is_half = False
+
+        # 推理后端: "torch" | "torchscript" | "onnx"，导出产物由 export_torch_script_v4.py 生成
+        self.inference_backend: str = self.configs.get("inference_backend", "torch")
+        if self.inference_backend not in BACKENDS:
+            print(f"Warning: Unknown inference_backend {self.inference_backend}, set to torch.")
+            self.inference_backend = "torch"
+        self.exported_models_dir: str = self.configs.get("exported_models_dir", "GPT_SoVITS/exported/v4")
+
+        # CPU int8 动态量化: "none" | "int8"，量化后的权重缓存在 quantized_cache_dir
+        self.quantization: str = self.configs.get("quantization", "none")
+        if self.quantization not in quantization.QUANTIZATION_MODES:
+            print(f"Warning: Unknown quantization {self.quantization}, set to none.")
+            self.quantization = "none"
+        if self.quantization != "none" and str(self.device) != "cpu":
+            print(f"Warning: {self.quantization} quantization is only supported on CPU, set quantization to none.")
+            self.quantization = "none"
+        self.quantized_cache_dir: str = self.configs.get("quantized_cache_dir", "GPT_SoVITS/pretrained_models/int8_cache")
+        if self.quantization != "none" and self.inference_backend != "torch":
+            # 导出图由 fp32 权重生成，替换后量化模块不再生效
+            print(f"Warning: {self.inference_backend} backend does not support {self.quantization} quantization, set inference_backend to torch.")
+            self.inference_backend = "torch"
 
         self.version = version
         self.t2s_weights_path = self.configs.get("t2s_weights_path", None)
@@ -365,6 +397,10 @@ class TTS_Config:
             "vits_weights_path": self.vits_weights_path,
             "bert_base_path": self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "inference_backend": self.inference_backend,
+            "exported_models_dir": self.exported_models_dir,
+            "quantization": self.quantization,
+            "quantized_cache_dir": self.quantized_cache_dir,
         }
         return self.config
 
@@ -391,11 +427,16 @@ class TTS_Config:
 
 
 class TTS:
-    def __init__(self, configs: Union[dict, str, TTS_Config]):
+    def __init__(self, configs: Union[dict, str, TTS_Config], shared: "TTS" = None):
+        """
+        shared: 已加载的另一个 TTS 实例，与其共用 BERT、CNHuBERT 和同版本的声码器，
+                同时加载多个说话人时不再重复占用这部分显存。
+        """
         if isinstance(configs, TTS_Config):
             self.configs = configs
         else:
             self.configs: TTS_Config = TTS_Config(configs)
+        self.shared: Optional["TTS"] = shared
 
         self.t2s_model: Text2SemanticLightningModule = None
         self.vits_model: Union[SynthesizerTrn, SynthesizerTrnV3] = None
@@ -403,6 +444,8 @@ class TTS:
         self.bert_model: AutoModelForMaskedLM = None
         self.cnhuhbert_model: CNHubert = None
         self.vocoder = None
+        self.exported_vocoder = None
+        self._replaced_modules = []  # [(对象, 属性名, 原 eager 模块)]，init_exported_models 切换后端时按此恢复
         self.sr_model: AP_BWE = None
         self.sr_model_not_exist: bool = False
 
@@ -430,21 +473,41 @@ class TTS:
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "t2s_prompt_kv": None,
         }
 
 
         self.stop_flag: bool = False
+        self.interrupted: bool = False  # 上一次 run 是否被 stop() / should_stop 中止
+        self._should_stop: Optional[Callable[[], bool]] = None
         self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
 
     def _init_models(
         self,
     ):
+        if self.shared is not None:
+            self.bert_tokenizer = self.shared.bert_tokenizer
+            self.bert_model = self.shared.bert_model
+            self.cnhuhbert_model = self.shared.cnhuhbert_model
+            self._init_synthesis_weights()
+            return
+        # BERT、CNHuBERT 与 T2S/VITS 互不依赖，并行加载以缩短启动时间
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="tts-load") as pool:
+            futures = [
+                pool.submit(self._init_synthesis_weights),
+                pool.submit(self.init_bert_weights, self.configs.bert_base_path),
+                pool.submit(self.init_cnhuhbert_weights, self.configs.cnhuhbert_base_path),
+            ]
+            for future in futures:
+                future.result()
+        # self.enable_half_precision(self.configs.is_half)
+
+    def _init_synthesis_weights(self):
+        # T2S 与 VITS 都会调用 init_exported_models 并修改 configs，在同一个线程中依次加载
         self.init_t2s_weights(self.configs.t2s_weights_path)
         self.init_vits_weights(self.configs.vits_weights_path)
-        self.init_bert_weights(self.configs.bert_base_path)
-        self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
-        # self.enable_half_precision(self.configs.is_half)
 
+    @model_load("cnhubert")
     def init_cnhuhbert_weights(self, base_path: str):
         print(f"Loading CNHuBERT weights from {base_path}")
         self.cnhuhbert_model = CNHubert(base_path)
@@ -453,15 +516,29 @@ class TTS:
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.cnhuhbert_model = self.cnhuhbert_model.half()
 
+    @model_load("bert")
     def init_bert_weights(self, base_path: str):
         print(f"Loading BERT weights from {base_path}")
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
-        self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
+        if self.configs.quantization == "int8":
+            self.bert_model = quantization.load_or_quantize(
+                "bert",
+                base_path,
+                self.configs.quantized_cache_dir,
+                lambda: AutoModelForMaskedLM.from_pretrained(base_path),
+                # 命中缓存时只需结构，不再读取 fp32 权重
+                lambda: AutoModelForMaskedLM.from_config(AutoConfig.from_pretrained(base_path)),
+            )
+        else:
+            self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
         self.bert_model = self.bert_model.eval()
         self.bert_model = self.bert_model.to(self.configs.device)
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.bert_model = self.bert_model.half()
+        if getattr(self, "text_preprocessor", None) is not None:
+            self.text_preprocessor.bert_model = self.bert_model
 
+    @model_load("vits")
     def init_vits_weights(self, weights_path: str):
         self.configs.vits_weights_path = weights_path
         version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(weights_path)
@@ -547,7 +624,17 @@ class TTS:
         self.vits_model = vits_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.vits_model = self.vits_model.half()
+        if self.configs.quantization == "int8" and self.configs.use_vocoder:
+            cfm = self.vits_model.cfm
+            cfm.estimator = quantization.load_or_quantize(
+                "dit",
+                weights_path,
+                self.configs.quantized_cache_dir,
+                lambda: cfm.estimator,
+            )
+        self.init_exported_models()
 
+    @model_load("t2s")
     def init_t2s_weights(self, weights_path: str):
         print(f"Loading Text2Semantic weights from {weights_path}")
         self.configs.t2s_weights_path = weights_path
@@ -563,15 +650,45 @@ class TTS:
         self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
             self.t2s_model = self.t2s_model.half()
+        if self.configs.quantization == "int8":
+            decoder = self.t2s_model.model
+            quantized = quantization.load_or_quantize(
+                "t2s", weights_path, self.configs.quantized_cache_dir, lambda: quantization.t2s_linear_modules(decoder)
+            )
+            quantization.apply_t2s(decoder, quantized)
+        self.init_exported_models()
+
+    def _reuse_shared_vocoder(self, class_name: str) -> bool:
+        """共用 shared 实例已加载的同类声码器，成功返回 True"""
+        shared = self.shared
+        if shared is None or shared.vocoder is None or shared.vocoder.__class__.__name__ != class_name:
+            return False
+        if self.vocoder is not shared.vocoder:
+            self._release_vocoder()
+        self.vocoder = shared.vocoder
+        self.vocoder_configs.update(shared.vocoder_configs)
+        return True
+
+    def _release_vocoder(self):
+        """释放当前声码器；与 shared 实例共用的声码器只解除引用"""
+        if self.vocoder is None:
+            return
+        if self.shared is not None and self.vocoder is self.shared.vocoder:
+            self.vocoder = None
+            return
+        self.vocoder.cpu()
+        del self.vocoder
+        self.vocoder = None
+        self.empty_cache()
 
     def init_vocoder(self, version: str):
+        load_start = time.perf_counter()
         if version == "v3":
             if self.vocoder is not None and self.vocoder.__class__.__name__ == "BigVGAN":
                 return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
+            if self._reuse_shared_vocoder("BigVGAN"):
+                return
+            self._release_vocoder()
                 
             self.vocoder = BigVGAN.from_pretrained(
                 "%s/GPT_SoVITS/pretrained_models/models--nvidia--bigvgan_v2_24khz_100band_256x" % (now_dir,),
@@ -589,10 +706,9 @@ class TTS:
         elif version == "v4":
             if self.vocoder is not None and self.vocoder.__class__.__name__ == "Generator":
                 return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
+            if self._reuse_shared_vocoder("Generator"):
+                return
+            self._release_vocoder()
 
             self.vocoder = Generator(
                         initial_channel=100,
@@ -622,12 +738,59 @@ class TTS:
             self.vocoder = self.vocoder.half().to(self.configs.device)
         else:
             self.vocoder = self.vocoder.to(self.configs.device)
+        record_model_load("vocoder", time.perf_counter() - load_start)
+
+    def init_exported_models(self):
+        """
+        按 configs.inference_backend 加载导出的 v4 推理图，替换 T2S 解码器、decode_encp、CFM estimator 与声码器。
+        每次调用先换回之前被替换的 eager 模块，切回 "torch" 后端即恢复 eager 推理。
+        仅支持 v4 + fp32 且未量化，其余情况或导出产物不匹配时保持 eager PyTorch。
+        导出图与 eager 的数值一致性在 export_torch_script_v4.py 导出时自动校验，加载时不再重复校验。
+        """
+        self._restore_eager_modules()
+        self.exported_vocoder = None
+        if self.configs.inference_backend == "torch" or self.t2s_model is None or self.vits_model is None:
+            return
+        if self.configs.version != "v4" or self.configs.is_half:
+            print("Exported inference only supports v4 fp32, fall back to eager PyTorch.")
+            return
+        if self.configs.quantization != "none":
+            print(f"Exported inference does not support {self.configs.quantization} quantization, fall back to eager PyTorch.")
+            return
+
+        models = load_exported_models(
+            self.configs.exported_models_dir,
+            self.configs.inference_backend,
+            self.configs.device,
+            self.configs.t2s_weights_path,
+            self.configs.vits_weights_path,
+        )
+        if models is None:
+            return
+
+        self._replace_module(self.t2s_model.model, "t2s_transformer", models["t2s"])
+        eager_decode_encp = type(self.vits_model).decode_encp.__get__(self.vits_model)
+        self._replace_module(self.vits_model, "decode_encp", ExportedEncP(models["encp"], eager_decode_encp))
+        self._replace_module(self.vits_model.cfm, "estimator", models["estimator"])
+        self.exported_vocoder = models["vocoder"]
+        print(f"Using {self.configs.inference_backend} inference backend from {self.configs.exported_models_dir}")
+
+    def _replace_module(self, owner, name: str, module):
+        self._replaced_modules.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, module)
+
+    def _restore_eager_modules(self):
+        """换回被导出图替换的 eager 模块（重新加载过权重的模型本身就是 eager，恢复旧对象无副作用）"""
+        while self._replaced_modules:
+            owner, name, module = self._replaced_modules.pop()
+            setattr(owner, name, module)
 
     def init_sr_model(self):
         if self.sr_model is not None:
             return
         try:
-            self.sr_model: AP_BWE = AP_BWE(self.configs.device, DictToAttrRecursive)
+            with model_load("sr"):
+                self.sr_model: AP_BWE = AP_BWE(self.configs.device, DictToAttrRecursive)
             self.sr_model_not_exist = False
         except FileNotFoundError:
             print(i18n("你没有下载超分模型的参数，因此不进行超分。如想超分请先参照教程把文件下载好"))
@@ -680,6 +843,13 @@ class TTS:
         self.configs.device = device
         if save:
             self.configs.save_configs()
+        if self.configs.quantization != "none" and str(device) != "cpu":
+            # int8 量化层只能在 CPU 上运行，切换设备时重新加载 fp32 权重
+            print(f"Warning: {self.configs.quantization} quantization is only supported on CPU, reload fp32 weights.")
+            self.configs.quantization = "none"
+            self.init_t2s_weights(self.configs.t2s_weights_path)
+            self.init_vits_weights(self.configs.vits_weights_path)
+            self.init_bert_weights(self.configs.bert_base_path)
         if self.t2s_model is not None:
             self.t2s_model = self.t2s_model.to(device)
         if self.vits_model is not None:
@@ -692,6 +862,7 @@ class TTS:
             self.vocoder = self.vocoder.to(device)
         if self.sr_model is not None:
             self.sr_model = self.sr_model.to(device)
+        self.init_exported_models()
 
     def set_ref_audio(self, ref_audio_path: str):
         """
@@ -913,13 +1084,18 @@ class TTS:
         Returns:
             list (List[torch.Tensor]): the data in the original order.
         """
-        length = len(sum(batch_index_list, []))
+        length = sum(len(index_list) for index_list in batch_index_list)
         _data = [None] * length
         for i, index_list in enumerate(batch_index_list):
             for j, index in enumerate(index_list):
                 _data[index] = data[i][j]
         return _data
 
+    def _sync_device(self):
+        """阶段计时前等待设备上已提交的计算完成, 否则 GPU 的异步耗时会计入下一个阶段"""
+        if str(self.configs.device).startswith("cuda"):
+            torch.cuda.synchronize(self.configs.device)
+
     def stop(
         self,
     ):
@@ -928,6 +1104,15 @@ class TTS:
         """
         self.stop_flag = True
 
+    def is_stopped(self) -> bool:
+        """stop() 或本次 run 传入的 should_stop 要求中止"""
+        return self.stop_flag or (self._should_stop is not None and self._should_stop())
+
+    def _check_stop(self):
+        """在 T2S 解码、CFM 采样与 vocoder 分块之间调用，要求中止时抛出 INFERENCE_STOPPED"""
+        if self.is_stopped():
+            raise INFERENCE_STOPPED()
+
     @torch.no_grad()
     def run(self, inputs: dict):
         """
@@ -957,12 +1142,19 @@ class TTS:
                     "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
                     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
                     "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                    "speculative_k": 0,           # int. number of draft tokens per T2S speculative decoding step, 0 to disable.
+                    "speculative_draft": "layers",  # str. draft source for speculative decoding, "layers" or "ngram".
+                    "reuse_prompt_kv": False,     # bool. reuse the T2S kv cache of the reference prefix across sentences (approximate).
+                    "should_stop": None,          # callable. polled during inference, returning True stops this run like stop().
+                    "placeholder_audio": True,    # bool. yield 1s of 16k silence when there is nothing to return, on stop or on error; False yields nothing (errors are only raised).
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
         """
         ########## variables initialization ###########
         self.stop_flag: bool = False
+        self.interrupted = False
+        self._should_stop = inputs.get("should_stop", None)
         text: str = inputs.get("text", "")
         text_lang: str = inputs.get("text_lang", "")
         ref_audio_path: str = inputs.get("ref_audio_path", "")
@@ -982,12 +1174,20 @@ class TTS:
         seed = inputs.get("seed", -1)
         seed = -1 if seed in ["", None] else seed
         actual_seed = set_seed(seed)
+        t2s_generator, cfm_generator = self.make_generators(actual_seed)
         parallel_infer = inputs.get("parallel_infer", True)
         repetition_penalty = inputs.get("repetition_penalty", 1.35)
         sample_steps = inputs.get("sample_steps", 32)
         super_sampling = inputs.get("super_sampling", False)
-
-        if parallel_infer:
+        speculative_k = inputs.get("speculative_k", 0)
+        speculative_draft = inputs.get("speculative_draft", "layers")
+        reuse_prompt_kv = inputs.get("reuse_prompt_kv", False)
+        placeholder_audio = inputs.get("placeholder_audio", True)
+
+        if speculative_k > 0:
+            print(f"T2S speculative decoding: k={speculative_k}, draft={speculative_draft}")
+            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_speculative_batched
+        elif parallel_infer:
             print(i18n("并行推理模式已开启"))
             self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
         else:
@@ -1074,7 +1274,8 @@ class TTS:
         if not return_fragment:
             data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
             if len(data) == 0:
-                yield 16000, np.zeros(int(16000), dtype=np.int16)
+                if placeholder_audio:
+                    yield 16000, np.zeros(int(16000), dtype=np.int16)
                 return
 
             batch_index_list: list = None
@@ -1125,17 +1326,23 @@ class TTS:
                 return batch[0]
 
         t2 = time.perf_counter()
+        observe_stage("ref", t1 - t0)
+        if not return_fragment:
+            observe_stage("g2p_bert", t2 - t1)
         try:
             print("############ 推理 ############")
             ###### inference ######
             t_34 = 0.0
             t_45 = 0.0
+            t_compute = t2 - t0  # 不含流式输出时等待调用方取走音频的时间
+            audio_seconds = 0.0
             audio = []
             output_sr = self.configs.sampling_rate if not self.configs.use_vocoder else self.vocoder_configs["sr"]
             for item in data:
                 t3 = time.perf_counter()
                 if return_fragment:
                     item = make_batch(item)
+                    observe_stage("g2p_bert", time.perf_counter() - t3)
                     if item is None:
                         continue
 
@@ -1156,6 +1363,9 @@ class TTS:
                         self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
                     )
 
+                prompt_kv = self.get_t2s_prompt_kv() if reuse_prompt_kv and prompt is not None else None
+                t2s_timing = {}
+
                 print(f"############ {i18n('预测语义Token')} ############")
                 pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
                     all_phoneme_ids,
@@ -1169,7 +1379,15 @@ class TTS:
                     early_stop_num=self.configs.hz * self.configs.max_sec,
                     max_len=max_len,
                     repetition_penalty=repetition_penalty,
+                    speculative_k=speculative_k,
+                    speculative_draft=speculative_draft,
+                    prompt_kv=prompt_kv,
+                    generator=t2s_generator,
+                    should_stop=self.is_stopped,
+                    timing=t2s_timing,
                 )
+                self._check_stop()
+                observe_t2s(t2s_timing)
                 t4 = time.perf_counter()
                 t_34 += t4 - t3
 
@@ -1219,6 +1437,7 @@ class TTS:
                     else:
                         # ## vits串行推理
                         for i, idx in enumerate(tqdm(idx_list)):
+                            self._check_stop()
                             phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
                             _pred_semantic = (
                                 pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
@@ -1227,21 +1446,33 @@ class TTS:
                                 _pred_semantic, phones, refer_audio_spec, speed=speed_factor
                             ).detach()[0, 0, :]
                             batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
+                    self._sync_device()
+                    observe_stage("vits", time.perf_counter() - t4)
                 else:
                     if parallel_infer:
                         print(f"{i18n('并行合成中')}...")
                         audio_fragments = self.using_vocoder_synthesis_batched_infer(
-                            idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
+                            idx_list,
+                            pred_semantic_list,
+                            batch_phones,
+                            speed=speed_factor,
+                            sample_steps=sample_steps,
+                            generator=cfm_generator,
                         )
                         batch_audio_fragment.extend(audio_fragments)
                     else:
                         for i, idx in enumerate(tqdm(idx_list)):
+                            self._check_stop()
                             phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
                             _pred_semantic = (
                                 pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
                             )  # .unsqueeze(0)#mq要多unsqueeze一次
                             audio_fragment = self.using_vocoder_synthesis(
-                                _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
+                                _pred_semantic,
+                                phones,
+                                speed=speed_factor,
+                                sample_steps=sample_steps,
+                                generator=cfm_generator,
                             )
                             batch_audio_fragment.append(audio_fragment)
 
@@ -1249,7 +1480,7 @@ class TTS:
                 t_45 += t5 - t4
                 if return_fragment:
                     print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t4 - t3, t5 - t4))
-                    yield self.audio_postprocess(
+                    fragment_sr, fragment = self.audio_postprocess(
                         [batch_audio_fragment],
                         output_sr,
                         None,
@@ -1258,19 +1489,24 @@ class TTS:
                         fragment_interval,
                         super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
                     )
+                    t_compute += time.perf_counter() - t3
+                    audio_seconds += fragment.shape[0] / fragment_sr
+                    yield fragment_sr, fragment
                 else:
                     audio.append(batch_audio_fragment)
 
                 if self.stop_flag:
-                    yield 16000, np.zeros(int(16000), dtype=np.int16)
+                    if placeholder_audio:
+                        yield 16000, np.zeros(int(16000), dtype=np.int16)
                     return
 
             if not return_fragment:
                 print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t_34, t_45))
                 if len(audio) == 0:
-                    yield 16000, np.zeros(int(16000), dtype=np.int16)
+                    if placeholder_audio:
+                        yield 16000, np.zeros(int(16000), dtype=np.int16)
                     return
-                yield self.audio_postprocess(
+                output_sr, output = self.audio_postprocess(
                     audio,
                     output_sr,
                     batch_index_list,
@@ -1279,11 +1515,22 @@ class TTS:
                     fragment_interval,
                     super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
                 )
+                observe_synthesis(time.perf_counter() - t0, output.shape[0] / output_sr)
+                yield output_sr, output
+            else:
+                observe_synthesis(t_compute, audio_seconds)
 
+        except INFERENCE_STOPPED:
+            # 被中止时模型状态完好，不需要像出错时那样重新加载
+            print(i18n("推理已中止"))
+            self.interrupted = True
+            if placeholder_audio:
+                yield 16000, np.zeros(int(16000), dtype=np.int16)
         except Exception as e:
             traceback.print_exc()
             # 必须返回一个空音频, 否则会导致显存不释放。
-            yield 16000, np.zeros(int(16000), dtype=np.int16)
+            if placeholder_audio:
+                yield 16000, np.zeros(int(16000), dtype=np.int16)
             # 重置模型, 否则会导致显存释放不完全。
             del self.t2s_model
             del self.vits_model
@@ -1293,8 +1540,46 @@ class TTS:
             self.init_vits_weights(self.configs.vits_weights_path)
             raise e
         finally:
+            self._should_stop = None
             self.empty_cache()
 
+    def make_generators(self, seed: int) -> Tuple[torch.Generator, torch.Generator]:
+        """
+        T2S 采样与 CFM 噪声各自独立的随机数生成器。
+        两者只由 seed 决定，不受全局随机状态、其他线程或先前合成消耗的随机数影响，
+        因此同一 seed 在并行、断点续跑或缓存命中时都与顺序合成的结果一致。
+        """
+        device = torch.device(self.configs.device)
+        t2s_generator = torch.Generator(device=device).manual_seed(seed)
+        cfm_generator = torch.Generator(device=device).manual_seed((seed + 0x9E3779B97F4A7C15) % 2**64)
+        return t2s_generator, cfm_generator
+
+    def get_t2s_prompt_kv(self):
+        """
+        参考前缀（参考文本音素 + 参考语义 token）的 T2S kv cache，同一音色只计算一次，
+        参考音频、参考文本、T2S 模型或设备/精度变化时重新计算。
+        """
+        key = (
+            self.prompt_cache["ref_audio_path"],
+            self.prompt_cache["prompt_text"],
+            self.prompt_cache["prompt_lang"],
+            self.configs.t2s_weights_path,
+            id(self.t2s_model),
+            str(self.configs.device),
+            self.precision,
+        )
+        cached = self.prompt_cache["t2s_prompt_kv"]
+        if cached is not None and cached["key"] == key:
+            return cached
+
+        prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
+        prompt_bert = self.prompt_cache["bert_features"].unsqueeze(0).to(dtype=self.precision, device=self.configs.device)
+        prompt_semantic = self.prompt_cache["prompt_semantic"].unsqueeze(0).to(self.configs.device)
+        prompt_kv = self.t2s_model.model.build_prompt_kv(prompt_phones, prompt_bert, prompt_semantic)
+        prompt_kv["key"] = key
+        self.prompt_cache["t2s_prompt_kv"] = prompt_kv
+        return prompt_kv
+
     def empty_cache(self):
         try:
             gc.collect()  # 触发gc的垃圾回收。避免内存一直增长。
@@ -1315,41 +1600,51 @@ class TTS:
         fragment_interval: float = 0.3,
         super_sampling: bool = False,
     ) -> Tuple[int, np.ndarray]:
-        zero_wav = torch.zeros(
-            int(self.configs.sampling_rate * fragment_interval), dtype=self.precision, device=self.configs.device
-        )
-
-        for i, batch in enumerate(audio):
-            for j, audio_fragment in enumerate(batch):
-                max_audio = torch.abs(audio_fragment).max()  # 简单防止16bit爆音
-                if max_audio > 1:
-                    audio_fragment /= max_audio
-                audio_fragment: torch.Tensor = torch.cat([audio_fragment, zero_wav], dim=0)
-                audio[i][j] = audio_fragment
-
+        interval_len = int(self.configs.sampling_rate * fragment_interval)
+        fragments = [audio_fragment for batch in audio for audio_fragment in batch]
         if split_bucket:
-            audio = self.recovery_order(audio, batch_index_list)
+            positions = [index for index_list in batch_index_list for index in index_list]
         else:
-            # audio = [item for batch in audio for item in batch]
-            audio = sum(audio, [])
-
-        audio = torch.cat(audio, dim=0)
+            positions = list(range(len(fragments)))
+
+        # 根据各片段长度预先计算输出偏移, 一次性分配输出缓冲区, 片段直接写入对应位置, 避免反复拼接整段音频
+        frag_lens = [0] * len(fragments)
+        for pos, audio_fragment in zip(positions, fragments):
+            frag_lens[pos] = audio_fragment.shape[0]
+        offsets = [0] * len(fragments)
+        total_len = 0
+        for i, frag_len in enumerate(frag_lens):
+            offsets[i] = total_len
+            total_len += frag_len + interval_len
+
+        output = torch.zeros(total_len, dtype=torch.float32, device=self.configs.device)
+        for pos, audio_fragment in zip(positions, fragments):
+            if frag_lens[pos] == 0:
+                continue
+            segment = output[offsets[pos] : offsets[pos] + frag_lens[pos]]
+            segment.copy_(audio_fragment)
+            max_audio = torch.linalg.vector_norm(segment, ord=float("inf"))  # 简单防止16bit爆音
+            if max_audio > 1:
+                segment.div_(max_audio)
 
         if super_sampling:
             print(f"############ {i18n('音频超采样')} ############")
             t1 = time.perf_counter()
             self.init_sr_model()
             if not self.sr_model_not_exist:
-                audio, sr = self.sr_model(audio.unsqueeze(0), sr)
+                audio, sr = self.sr_model(output.unsqueeze(0), sr)
                 max_audio = np.abs(audio).max()
                 if max_audio > 1:
                     audio /= max_audio
-            t2 = time.perf_counter()
-            print(f"超采样用时：{t2 - t1:.3f}s")
-        else:
-            audio = audio.cpu().numpy()
+                np.multiply(audio, 32768, out=audio)
+                np.clip(audio, -32768, 32767, out=audio)
+                t2 = time.perf_counter()
+                print(f"超采样用时：{t2 - t1:.3f}s")
+                observe_stage("sr", t2 - t1)
+                return sr, audio.astype(np.int16)
 
-        audio = (audio * 32768).astype(np.int16)
+        output.mul_(32768).clamp_(-32768, 32767)
+        audio = output.to(torch.int16).cpu().numpy()
 
         # try:
         #     if speed_factor != 1.0:
@@ -1360,8 +1655,14 @@ class TTS:
         return sr, audio
 
     def using_vocoder_synthesis(
-        self, semantic_tokens: torch.Tensor, phones: torch.Tensor, speed: float = 1.0, sample_steps: int = 32
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        speed: float = 1.0,
+        sample_steps: int = 32,
+        generator: Optional[torch.Generator] = None,
     ):
+        t_start = time.perf_counter()
         prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
         prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
         refer_audio_spec = self.prompt_cache["refer_spec"][0].to(dtype=self.precision, device=self.configs.device)
@@ -1400,11 +1701,18 @@ class TTS:
             fea_todo_chunk = fea_todo[:, :, idx : idx + chunk_len]
             if fea_todo_chunk.shape[-1] == 0:
                 break
+            self._check_stop()
             idx += chunk_len
             fea = torch.cat([fea_ref, fea_todo_chunk], 2).transpose(2, 1)
 
             cfm_res = self.vits_model.cfm.inference(
-                fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+                fea,
+                torch.LongTensor([fea.size(1)]).to(fea.device),
+                mel2,
+                sample_steps,
+                inference_cfg_rate=0,
+                generator=generator,
+                should_stop=self.is_stopped,
             )
             cfm_res = cfm_res[:, :, mel2.shape[2] :]
 
@@ -1412,12 +1720,19 @@ class TTS:
             fea_ref = fea_todo_chunk[:, :, -T_min:]
 
             cfm_resss.append(cfm_res)
+        self._check_stop()
         cfm_res = torch.cat(cfm_resss, 2)
         cfm_res = denorm_spec(cfm_res)
+        self._sync_device()
+        t_cfm = time.perf_counter()
+        observe_stage("cfm", t_cfm - t_start)
 
+        vocoder = self.vocoder if self.exported_vocoder is None else self.exported_vocoder
         with torch.inference_mode():
-            wav_gen = self.vocoder(cfm_res)
+            wav_gen = vocoder(cfm_res)
             audio = wav_gen[0][0]  # .cpu().detach().numpy()
+        self._sync_device()
+        observe_stage("vocoder", time.perf_counter() - t_cfm)
 
         return audio
 
@@ -1428,7 +1743,9 @@ class TTS:
         batch_phones: List[torch.Tensor],
         speed: float = 1.0,
         sample_steps: int = 32,
+        generator: Optional[torch.Generator] = None,
     ) -> List[torch.Tensor]:
+        t_start = time.perf_counter()
         prompt_semantic_tokens = self.prompt_cache["prompt_semantic"].unsqueeze(0).unsqueeze(0).to(self.configs.device)
         prompt_phones = torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device)
         refer_audio_spec = self.prompt_cache["refer_spec"][0].to(dtype=self.precision, device=self.configs.device)
@@ -1500,18 +1817,31 @@ class TTS:
         fea_ref = fea_ref.repeat(bs, 1, 1)
         fea = torch.cat([fea_ref, feat_chunks], 2).transpose(2, 1)
         pred_spec = self.vits_model.cfm.inference(
-            fea, torch.LongTensor([fea.size(1)]).to(fea.device), mel2, sample_steps, inference_cfg_rate=0
+            fea,
+            torch.LongTensor([fea.size(1)]).to(fea.device),
+            mel2,
+            sample_steps,
+            inference_cfg_rate=0,
+            generator=generator,
+            should_stop=self.is_stopped,
         )
+        self._check_stop()
         pred_spec = pred_spec[:, :, -chunk_len:]
         dd = pred_spec.shape[1]
         pred_spec = pred_spec.permute(1, 0, 2).contiguous().view(dd, -1).unsqueeze(0)
         # pred_spec = pred_spec[..., :-padding_len]
 
         pred_spec = denorm_spec(pred_spec)
+        self._sync_device()
+        t_cfm = time.perf_counter()
+        observe_stage("cfm", t_cfm - t_start)
 
+        vocoder = self.vocoder if self.exported_vocoder is None else self.exported_vocoder
         with torch.no_grad():
-            wav_gen = self.vocoder(pred_spec)
+            wav_gen = vocoder(pred_spec)
             audio = wav_gen[0][0]  # .cpu().detach().numpy()
+        self._sync_device()
+        observe_stage("vocoder", time.perf_counter() - t_cfm)
 
         audio_fragments = []
         upsample_rate = self.vocoder_configs["upsample_rate"]
@@ -0,0 +1,421 @@
+"""
+v4 推理链路（T2S 解码器、decode_encp、CFM estimator、v4 声码器）的导出包装与运行时加载。
+
+导出由 GPT_SoVITS/export_torch_script_v4.py 完成，产物目录结构:
+    t2s_transformer.pt      TorchScript (script)
+    encp.pt                 TorchScript (trace, 仅 speed == 1)
+    estimator.pt            TorchScript (trace)
+    vocoder.pt              TorchScript (trace)
+    estimator.onnx          ONNX (可选)
+    vocoder.onnx            ONNX (可选)
+    manifest.json           导出时的模型信息，加载时按权重文件的大小与 sha256 校验是否匹配
+
+TTS_Config.inference_backend:
+    "torch"        全部使用 eager PyTorch（默认）
+    "torchscript"  四个组件全部使用 TorchScript
+    "onnx"         estimator / 声码器使用 onnxruntime CPU EP，T2S 与 decode_encp 仍使用 TorchScript
+"""
+
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from module import commons
+
+MANIFEST_NAME = "manifest.json"
+TORCHSCRIPT_FILES = {
+    "t2s": "t2s_transformer.pt",
+    "encp": "encp.pt",
+    "estimator": "estimator.pt",
+    "vocoder": "vocoder.pt",
+}
+ONNX_FILES = {
+    "estimator": "estimator.onnx",
+    "vocoder": "vocoder.onnx",
+}
+BACKENDS = ["torch", "torchscript", "onnx"]
+
+
+# ---------------------------------------------------------------------------
+# 导出用的包装模块
+# ---------------------------------------------------------------------------
+
+
+def _copy_linear(weight: torch.Tensor, bias: torch.Tensor) -> nn.Linear:
+    linear = nn.Linear(weight.shape[1], weight.shape[0], device=weight.device, dtype=weight.dtype)
+    linear.weight.data.copy_(weight.detach())
+    linear.bias.data.copy_(bias.detach())
+    return linear
+
+
+class T2SBlockExport(nn.Module):
+    """
+    与 AR.models.t2s_model.T2SBlock 计算一致的 nn.Module 版本，便于 torch.jit.script。
+    线性层使用 nn.Linear，因此也可直接交给 torch.ao.quantization.quantize_dynamic 做 int8 量化。
+    """
+
+    def __init__(self, num_heads: int, hidden_dim: int, layer):
+        super().__init__()
+        self.num_heads: int = num_heads
+        self.hidden_dim: int = hidden_dim
+        self.qkv = _copy_linear(layer.self_attn.in_proj_weight, layer.self_attn.in_proj_bias)
+        self.out_proj = _copy_linear(layer.self_attn.out_proj.weight, layer.self_attn.out_proj.bias)
+        self.linear1 = _copy_linear(layer.linear1.weight, layer.linear1.bias)
+        self.linear2 = _copy_linear(layer.linear2.weight, layer.linear2.bias)
+        self.register_buffer("norm_w1", layer.norm1.weight.detach().clone())
+        self.register_buffer("norm_b1", layer.norm1.bias.detach().clone())
+        self.register_buffer("norm_w2", layer.norm2.weight.detach().clone())
+        self.register_buffer("norm_b2", layer.norm2.bias.detach().clone())
+        self.norm_eps1: float = float(layer.norm1.eps)
+        self.norm_eps2: float = float(layer.norm2.eps)
+
+    def _attention(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, attn_mask: Optional[torch.Tensor]):
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = k.shape[1]
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k.view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        v = v.view(batch_size, kv_len, self.num_heads, -1).transpose(1, 2)
+        if attn_mask is None:
+            attn = F.scaled_dot_product_attention(q, k, v)
+        else:
+            attn = F.scaled_dot_product_attention(q, k, v, ~attn_mask)
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        return self.out_proj(attn)
+
+    def _feed_forward(self, x: torch.Tensor, attn: torch.Tensor):
+        x = x + attn
+        x = F.layer_norm(x, [self.hidden_dim], self.norm_w1, self.norm_b1, self.norm_eps1)
+        x = x + self.linear2(F.relu(self.linear1(x)))
+        x = F.layer_norm(x, [self.hidden_dim], self.norm_w2, self.norm_b2, self.norm_eps2)
+        return x
+
+    @torch.jit.export
+    def process_prompt(self, x: torch.Tensor, attn_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        q, k, v = self.qkv(x).chunk(3, dim=-1)
+        x = self._feed_forward(x, self._attention(q, k, v, attn_mask))
+        return x, k, v
+
+    @torch.jit.export
+    def decode_next_token(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        attn_mask: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        q, k, v = self.qkv(x).chunk(3, dim=-1)
+        k_cache = torch.cat([k_cache, k], dim=1)
+        v_cache = torch.cat([v_cache, v], dim=1)
+        x = self._feed_forward(x, self._attention(q, k_cache, v_cache, attn_mask))
+        return x, k_cache, v_cache
+
+    def forward(self, x: torch.Tensor, attn_mask: torch.Tensor):
+        return self.process_prompt(x, attn_mask)
+
+
+class T2STransformerExport(nn.Module):
+    """Text2SemanticDecoder.t2s_transformer 的可 script 版本，接口与 T2STransformer 相同"""
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.blocks = nn.ModuleList(
+            [T2SBlockExport(decoder.num_head, decoder.model_dim, layer) for layer in decoder.h.layers]
+        )
+
+    @torch.jit.export
+    def process_prompt(
+        self, x: torch.Tensor, attn_mask: torch.Tensor
+    ) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+        k_cache: List[torch.Tensor] = []
+        v_cache: List[torch.Tensor] = []
+        for block in self.blocks:
+            x, k, v = block.process_prompt(x, attn_mask)
+            k_cache.append(k)
+            v_cache.append(v)
+        return x, k_cache, v_cache
+
+    @torch.jit.export
+    def decode_next_token(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        attn_mask: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+        new_k_cache: List[torch.Tensor] = []
+        new_v_cache: List[torch.Tensor] = []
+        i = 0
+        for block in self.blocks:
+            x, k, v = block.decode_next_token(x, k_cache[i], v_cache[i], attn_mask)
+            new_k_cache.append(k)
+            new_v_cache.append(v)
+            i += 1
+        return x, new_k_cache, new_v_cache
+
+    @torch.jit.export
+    def decode_next_token_partial(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        num_layers: int,
+        attn_mask: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+        new_k_cache: List[torch.Tensor] = []
+        new_v_cache: List[torch.Tensor] = []
+        i = 0
+        for block in self.blocks:
+            if i < num_layers:
+                x, k, v = block.decode_next_token(x, k_cache[i], v_cache[i], attn_mask)
+                new_k_cache.append(k)
+                new_v_cache.append(v)
+            i += 1
+        return x, new_k_cache, new_v_cache
+
+    def forward(self, x: torch.Tensor, attn_mask: torch.Tensor):
+        return self.process_prompt(x, attn_mask)
+
+
+@torch.jit.script_if_tracing
+def scaled_length(x: torch.Tensor, dim: int, scale: float) -> torch.Tensor:
+    return torch.tensor([int(x.size(dim) * scale)], dtype=torch.long, device=x.device)
+
+
+class EncPExport(nn.Module):
+    """SynthesizerTrnV3.decode_encp 在 ge 已知、speed == 1 时的可 trace 版本"""
+
+    def __init__(self, vits_model):
+        super().__init__()
+        self.quantizer = vits_model.quantizer
+        self.enc_p = vits_model.enc_p
+        self.bridge = vits_model.bridge
+        self.wns1 = vits_model.wns1
+        self.semantic_frame_rate = vits_model.semantic_frame_rate
+        self.fea_scale = 1.875 if vits_model.version == "v3" else 2.0
+        self.len_scale = 3.875 if vits_model.version == "v3" else 4.0
+
+    def forward(self, codes: torch.Tensor, text: torch.Tensor, ge: torch.Tensor):
+        y_lengths = scaled_length(codes, 2, 2.0)
+        y_lengths1 = scaled_length(codes, 2, self.len_scale)
+        text_lengths = scaled_length(text, -1, 1.0)
+
+        quantized = self.quantizer.decode(codes)
+        if self.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(quantized, scale_factor=2, mode="nearest")
+        x, m_p, logs_p, y_mask = self.enc_p(quantized, y_lengths, text, text_lengths, ge, 1)
+        fea = self.bridge(x)
+        fea = F.interpolate(fea, scale_factor=self.fea_scale, mode="nearest")
+        fea, y_mask_ = self.wns1(fea, y_lengths1, ge)
+        return fea
+
+
+class EstimatorExport(nn.Module):
+    """CFM.estimator (DiT) 在无 CFG 时的可 trace 版本，rope 按输入长度动态计算"""
+
+    def __init__(self, dit):
+        super().__init__()
+        self.dit = dit
+
+    def forward(
+        self,
+        x0: torch.Tensor,
+        cond0: torch.Tensor,
+        x_lens: torch.Tensor,
+        time: torch.Tensor,
+        dt_base_bootstrap: torch.Tensor,
+        text0: torch.Tensor,
+    ):
+        dit = self.dit
+        x = x0.transpose(2, 1)
+        cond = cond0.transpose(2, 1)
+        text = text0.transpose(2, 1)
+        mask = commons.sequence_mask(x_lens, max_length=x.size(1)).to(x.device)
+
+        t = dit.time_embed(time) + dit.d_embed(dt_base_bootstrap)
+        text_embed = dit.text_embed(text, x.shape[1])
+        x = dit.input_embed(x, cond, text_embed)
+        rope, _ = dit.rotary_embed(torch.arange(x.shape[1], device=x.device))
+
+        if dit.long_skip_connection is not None:
+            residual = x
+        for block in dit.transformer_blocks:
+            x = block(x, t, mask=mask, rope=(rope, 1.0))
+        if dit.long_skip_connection is not None:
+            x = dit.long_skip_connection(torch.cat((x, residual), dim=-1))
+
+        x = dit.norm_out(x, t)
+        return dit.proj_out(x)
+
+
+# ---------------------------------------------------------------------------
+# 运行时适配器：接口与被替换的 eager 组件保持一致
+# ---------------------------------------------------------------------------
+
+
+def _onnx_run(session, inputs: dict, like: torch.Tensor) -> torch.Tensor:
+    feeds = {name: value.detach().cpu().numpy() for name, value in inputs.items()}
+    feeds = {
+        name: value.astype("float32") if value.dtype.kind == "f" else value.astype("int64")
+        for name, value in feeds.items()
+    }
+    output = session.run(None, feeds)[0]
+    return torch.from_numpy(output).to(dtype=like.dtype, device=like.device)
+
+
+class ExportedT2STransformer:
+    """替换 Text2SemanticDecoder.t2s_transformer"""
+
+    def __init__(self, module):
+        self.module = module
+
+    def process_prompt(self, x, attn_mask, padding_mask=None, torch_sdpa=True):
+        return self.module.process_prompt(x, attn_mask)
+
+    def decode_next_token(self, x, k_cache, v_cache, attn_mask=None, torch_sdpa=True):
+        return self.module.decode_next_token(x, k_cache, v_cache, attn_mask)
+
+    def decode_next_token_partial(self, x, k_cache, v_cache, num_layers, attn_mask=None, torch_sdpa=True):
+        return self.module.decode_next_token_partial(x, k_cache, v_cache, num_layers, attn_mask)
+
+
+class ExportedEncP:
+    """替换 vits_model.decode_encp；ge 未给出或 speed != 1 时回退到 eager 实现"""
+
+    def __init__(self, module, eager_decode_encp):
+        self.module = module
+        self.eager_decode_encp = eager_decode_encp
+
+    def __call__(self, codes, text, refer, ge=None, speed=1):
+        if ge is None or speed != 1:
+            return self.eager_decode_encp(codes, text, refer, ge, speed)
+        return self.module(codes, text, ge), ge
+
+
+class ExportedEstimator(nn.Module):
+    """
+    替换 vits_model.cfm.estimator。
+    classifier-free guidance 的负样本一路由 CFM 再调用一次本图得到：DiT 的 drop_audio_cond / drop_text
+    只是把 prompt_x / mu 置零，这里在图外置零后照常推理，结果与 eager 一致。
+    """
+
+    def __init__(self, module=None, session=None):
+        super().__init__()
+        self.module = module
+        self.session = session
+
+    def forward(
+        self, x, prompt_x, x_lens, t, d, mu, use_grad_ckpt=False, drop_audio_cond=False, drop_text=False
+    ):
+        if drop_audio_cond:
+            prompt_x = torch.zeros_like(prompt_x)
+        if drop_text:
+            mu = torch.zeros_like(mu)
+        if self.session is not None:
+            # 批量路径只传入一个长度，ONNX 图要求与 batch 维一致
+            x_lens = x_lens.expand(x.shape[0])
+            inputs = {"x": x, "prompt_x": prompt_x, "x_lens": x_lens, "t": t, "d": d, "mu": mu}
+            return _onnx_run(self.session, inputs, x)
+        return self.module(x, prompt_x, x_lens, t, d, mu)
+
+
+class ExportedVocoder(nn.Module):
+    """替换 TTS.vocoder（v4 Generator）"""
+
+    def __init__(self, module=None, session=None):
+        super().__init__()
+        self.module = module
+        self.session = session
+
+    def forward(self, x):
+        if self.session is not None:
+            return _onnx_run(self.session, {"mel": x}, x)
+        return self.module(x)
+
+
+def weights_fingerprint(path: str, with_hash: bool = True) -> dict:
+    """权重文件的标识：文件名、大小与 sha256（同名的重新训练权重也能区分）"""
+    fingerprint = {"name": os.path.basename(path), "size": os.path.getsize(path)}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+
+def _weights_match(path: str, exported) -> bool:
+    if not isinstance(exported, dict) or "sha256" not in exported:
+        return False  # 旧版 manifest 只记录了文件名，需要重新导出
+    quick = weights_fingerprint(path, with_hash=False)
+    if (quick["name"], quick["size"]) != (exported.get("name"), exported.get("size")):
+        return False
+    return weights_fingerprint(path)["sha256"] == exported["sha256"]
+
+
+def read_manifest(export_dir: str) -> Optional[dict]:
+    manifest_path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_exported_models(
+    export_dir: str,
+    backend: str,
+    device,
+    t2s_weights_path: str,
+    vits_weights_path: str,
+) -> Optional[dict]:
+    """
+    加载导出产物。目录不存在、manifest 与当前权重不匹配时返回 None，由调用方回退到 eager。
+
+    Returns:
+        {"t2s": ExportedT2STransformer, "encp": module, "estimator": ExportedEstimator, "vocoder": ExportedVocoder}
+    """
+    assert backend in BACKENDS
+    if export_dir in [None, ""] or not os.path.isdir(export_dir):
+        print(f"Exported models dir not found: {export_dir}, fall back to eager PyTorch.")
+        return None
+    manifest = read_manifest(export_dir)
+    if manifest is None:
+        print(f"{MANIFEST_NAME} not found in {export_dir}, fall back to eager PyTorch.")
+        return None
+    for path, key in ((t2s_weights_path, "t2s_weights"), (vits_weights_path, "vits_weights")):
+        exported = manifest.get(key)
+        if not _weights_match(path, exported):
+            print(f"Exported models {exported} do not match loaded weights {path}, fall back to eager PyTorch.")
+            return None
+
+    def jit_load(name):
+        return torch.jit.load(os.path.join(export_dir, TORCHSCRIPT_FILES[name]), map_location=device).eval()
+
+    models = {
+        "t2s": jit_load("t2s"),
+        "encp": jit_load("encp"),
+    }
+    if backend == "onnx":
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        # 多进程合成时由 cpu_threads.apply_worker_threads 设置，避免各进程按全部核心开线程
+        options.intra_op_num_threads = int(os.environ.get("GPT_SOVITS_ORT_THREADS", 0))
+        providers = ["CPUExecutionProvider"]
+        for name in ONNX_FILES:
+            models[name] = onnxruntime.InferenceSession(
+                os.path.join(export_dir, ONNX_FILES[name]), sess_options=options, providers=providers
+            )
+        models["estimator"] = ExportedEstimator(session=models["estimator"])
+        models["vocoder"] = ExportedVocoder(session=models["vocoder"])
+    else:
+        models["estimator"] = ExportedEstimator(module=jit_load("estimator"))
+        models["vocoder"] = ExportedVocoder(module=jit_load("vocoder"))
+    models["t2s"] = ExportedT2STransformer(models["t2s"])
+    return models
@@ -0,0 +1,124 @@
+"""
+CPU 推理的 int8 动态量化。
+
+TTS_Config.quantization = "int8" 时:
+    T2S      T2SBlock 的 qkv / out_proj / MLP 线性层与 ar_predict_layer
+    CFM      f5_tts DiT 中的全部 nn.Linear
+    BERT     chinese-roberta 中的全部 nn.Linear
+权重为 int8、激活在运行时动态量化，仅支持 CPU。
+量化后的 state_dict 按源权重的 sha256 缓存到 quantized_cache_dir，以 weights_only=True 读取，
+载入到线性层已替换为动态 int8 层的同结构模块中，无需重新量化。
+BERT 命中缓存时只按 config 构建结构，不再加载 fp32 权重；T2S / DiT 的线性层与其余参数在同一个检查点里，
+fp32 检查点仍需读取，缓存省去的是量化本身。
+"""
+
+import hashlib
+import os
+from typing import Callable, Optional
+
+import torch
+from torch import nn
+from torch.ao.nn.quantized import dynamic as nnqd
+from torch.ao.quantization import quantize_dynamic
+
+from TTS_infer_pack.exported_models import ExportedT2STransformer, T2STransformerExport, weights_fingerprint
+
+QUANTIZATION_MODES = ["none", "int8"]
+# 缓存内容或量化方式变化时递增，旧缓存自然失效
+CACHE_VERSION = 2
+
+
+def _source_signature(source_path: str) -> str:
+    """源权重的签名：各文件的名称、大小与 sha256（同 exported_models.weights_fingerprint）及 torch 版本"""
+    source_path = os.path.abspath(source_path)
+    if os.path.isdir(source_path):
+        files = sorted(os.path.join(source_path, name) for name in os.listdir(source_path))
+    else:
+        files = [source_path]
+    items = [f"v{CACHE_VERSION}", torch.__version__]
+    for file in files:
+        if os.path.isfile(file):
+            fingerprint = weights_fingerprint(file)
+            items.append(f"{fingerprint['name']}:{fingerprint['size']}:{fingerprint['sha256']}")
+    return hashlib.sha1("|".join(items).encode("utf-8")).hexdigest()[:16]
+
+
+def load_or_quantize(
+    name: str,
+    source_path: str,
+    cache_dir: str,
+    build: Callable[[], nn.Module],
+    build_structure: Optional[Callable[[], nn.Module]] = None,
+) -> nn.Module:
+    """
+    读取 source_path 对应的量化缓存，不存在时量化 build() 的结果并缓存其 state_dict。
+
+    Args:
+        name: 组件名，用于缓存文件名（t2s / dit / bert）
+        source_path: 源权重文件或目录
+        cache_dir: 缓存目录
+        build: 返回待量化的 fp32 模块
+        build_structure: 命中缓存时用于构建结构的函数（权重可以是随机值），默认为 build
+    """
+    cache_path = os.path.join(
+        cache_dir, f"{name}_{os.path.splitext(os.path.basename(source_path))[0]}_{_source_signature(source_path)}.pt"
+    )
+    state_dict = None
+    if os.path.exists(cache_path):
+        try:
+            state_dict = torch.load(cache_path, map_location="cpu", weights_only=True)
+        except Exception as e:
+            print(f"Failed to load int8 cache {cache_path}: {e}, re-quantizing.")
+
+    if state_dict is not None:
+        print(f"Loading int8 {name} from {cache_path}")
+        module = _dynamic_int8_structure((build_structure or build)().float().cpu().eval())
+        module.load_state_dict(state_dict)
+        return module
+
+    print(f"Quantizing {name} to int8 ...")
+    module = quantize_linear_int8(build())
+    os.makedirs(cache_dir, exist_ok=True)
+    torch.save(module.state_dict(), cache_path)
+    return module
+
+
+def quantize_linear_int8(module: nn.Module) -> nn.Module:
+    """将 module 中全部 nn.Linear 原地替换为动态 int8 线性层"""
+    return quantize_dynamic(module.float().cpu().eval(), {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _dynamic_int8_structure(module: nn.Module) -> nn.Module:
+    """
+    与 quantize_linear_int8 得到相同结构，但不计算量化参数：nn.Linear 原地换成同形状的空动态 int8 层，
+    随后由缓存的 state_dict 填充。与 quantize_dynamic 一样只匹配类型恰为 nn.Linear 的层。
+    """
+    for child_name, child in module.named_children():
+        if type(child) is nn.Linear:
+            setattr(
+                module,
+                child_name,
+                nnqd.Linear(child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8),
+            )
+        else:
+            _dynamic_int8_structure(child)
+    return module
+
+
+def t2s_linear_modules(decoder) -> nn.ModuleDict:
+    """
+    Text2SemanticDecoder 推理用到的、需要量化的线性层。
+    t2s_transformer 是持有原始权重引用的 script class，无法直接量化，
+    因此先重建为 T2STransformerExport，量化后由 apply_t2s 装回。
+    """
+    return nn.ModuleDict(
+        {
+            "t2s_transformer": T2STransformerExport(decoder),
+            "ar_predict_layer": decoder.ar_predict_layer,
+        }
+    )
+
+
+def apply_t2s(decoder, quantized: nn.ModuleDict):
+    decoder.t2s_transformer = ExportedT2STransformer(quantized["t2s_transformer"])
+    decoder.ar_predict_layer = quantized["ar_predict_layer"]
@@ -0,0 +1,239 @@
+"""
+导出 v4 推理链路（T2S 解码器、decode_encp、CFM estimator、v4 声码器）为 TorchScript / ONNX，
+供 TTS_Config.inference_backend = "torchscript" / "onnx" 使用。
+
+用法（在项目根目录运行）:
+    python GPT_SoVITS/export_torch_script_v4.py --gpt_path <gpt.ckpt> --sovits_path <sovits.pth> -o GPT_SoVITS/exported/v4 --onnx
+    python GPT_SoVITS/export_torch_script_v4.py --gpt_path <gpt.ckpt> --sovits_path <sovits.pth> -o GPT_SoVITS/exported/v4 --verify
+
+导出完成后自动在多个长度上与 eager 组件比较数值（含 classifier-free guidance 的负样本一路），
+超出容差时以非零状态退出；--verify 只对已有导出产物做同样的校验。项目没有单元测试覆盖这一校验。
+"""
+
+import argparse
+import json
+import os
+import sys
+
+now_dir = os.getcwd()
+sys.path.append(now_dir)
+sys.path.append("%s/GPT_SoVITS" % (now_dir))
+
+import torch
+
+from TTS_infer_pack.TTS import TTS
+from TTS_infer_pack.exported_models import (
+    MANIFEST_NAME,
+    ONNX_FILES,
+    TORCHSCRIPT_FILES,
+    EncPExport,
+    EstimatorExport,
+    T2STransformerExport,
+    load_exported_models,
+    weights_fingerprint,
+)
+
+# 校验时使用的语义 token 帧数（25hz），覆盖短句到单个声码器分块以上的长度
+VERIFY_FRAMES = [25, 120, 300]
+
+
+def build_tts(gpt_path: str, sovits_path: str, device: str) -> TTS:
+    return TTS(
+        {
+            "device": device,
+            "is_half": False,
+            "version": "v4",
+            "t2s_weights_path": gpt_path,
+            "vits_weights_path": sovits_path,
+            "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+            "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+            "inference_backend": "torch",
+        }
+    )
+
+
+@torch.no_grad()
+def example_inputs(tts: TTS, frames: int) -> dict:
+    """按语义 token 帧数构造各组件的示例输入"""
+    device = tts.configs.device
+    decoder = tts.t2s_model.model
+    vits = tts.vits_model
+
+    # T2S: 提示阶段的 xy_pos 与因果 mask（True 表示屏蔽）
+    t2s_len = frames + frames // 2
+    xy_pos = torch.randn(1, t2s_len, decoder.model_dim, device=device)
+    causal = torch.triu(torch.ones(t2s_len, t2s_len, dtype=torch.bool, device=device), diagonal=1)
+    attn_mask = causal.view(1, 1, t2s_len, t2s_len).expand(1, decoder.num_head, -1, -1)
+    next_pos = torch.randn(1, 1, decoder.model_dim, device=device)
+
+    # decode_encp
+    codes = torch.randint(0, 1024, (1, 1, frames), device=device)
+    text = torch.randint(1, 300, (1, max(frames // 2, 1)), device=device)
+    refer = torch.randn(1, tts.configs.filter_length // 2 + 1, 200, device=device)
+    _, ge = vits.decode_encp(codes, text, refer)
+
+    # CFM estimator: mu 为 decode_encp 的输出
+    mu = vits.decode_encp(codes, text, refer, ge)[0]
+    T = mu.shape[-1]
+    x = torch.randn(1, 100, T, device=device)
+    prompt_x = torch.zeros_like(x)
+    prompt_x[..., : T // 4] = torch.randn(1, 100, T // 4, device=device)
+    x_lens = torch.LongTensor([T]).to(device)
+    t = torch.rand(1, device=device)
+    d = torch.full((1,), 1 / 8, device=device)
+
+    mel = torch.randn(1, 100, T, device=device)
+    return {
+        "t2s": (xy_pos, attn_mask, next_pos),
+        "encp": (codes, text, ge, refer),
+        "estimator": (x, prompt_x, x_lens, t, d, mu),
+        "vocoder": (mel,),
+    }
+
+
+@torch.no_grad()
+def export(tts: TTS, output_dir: str, onnx: bool, frames: int = 120):
+    os.makedirs(output_dir, exist_ok=True)
+    inputs = example_inputs(tts, frames)
+
+    print("Exporting T2S transformer ...")
+    t2s = torch.jit.script(T2STransformerExport(tts.t2s_model.model).eval())
+    t2s.save(os.path.join(output_dir, TORCHSCRIPT_FILES["t2s"]))
+
+    print("Exporting decode_encp ...")
+    codes, text, ge, _ = inputs["encp"]
+    encp = torch.jit.trace(EncPExport(tts.vits_model).eval(), (codes, text, ge), check_trace=False)
+    encp.save(os.path.join(output_dir, TORCHSCRIPT_FILES["encp"]))
+
+    print("Exporting CFM estimator ...")
+    estimator_module = EstimatorExport(tts.vits_model.cfm.estimator).eval()
+    estimator = torch.jit.trace(estimator_module, inputs["estimator"], check_trace=False)
+    estimator.save(os.path.join(output_dir, TORCHSCRIPT_FILES["estimator"]))
+
+    print("Exporting vocoder ...")
+    vocoder = torch.jit.trace(tts.vocoder, inputs["vocoder"], check_trace=False)
+    vocoder.save(os.path.join(output_dir, TORCHSCRIPT_FILES["vocoder"]))
+
+    if onnx:
+        print("Exporting ONNX estimator / vocoder ...")
+        torch.onnx.export(
+            estimator_module,
+            inputs["estimator"],
+            os.path.join(output_dir, ONNX_FILES["estimator"]),
+            input_names=["x", "prompt_x", "x_lens", "t", "d", "mu"],
+            output_names=["v_pred"],
+            dynamic_axes={
+                "x": {0: "batch", 2: "frames"},
+                "prompt_x": {0: "batch", 2: "frames"},
+                "x_lens": {0: "batch"},
+                "t": {0: "batch"},
+                "d": {0: "batch"},
+                "mu": {0: "batch", 2: "frames"},
+                "v_pred": {0: "batch", 1: "frames"},
+            },
+            opset_version=17,
+        )
+        torch.onnx.export(
+            tts.vocoder,
+            inputs["vocoder"],
+            os.path.join(output_dir, ONNX_FILES["vocoder"]),
+            input_names=["mel"],
+            output_names=["wav"],
+            dynamic_axes={"mel": {0: "batch", 2: "frames"}, "wav": {0: "batch", 2: "samples"}},
+            opset_version=17,
+        )
+
+    manifest = {
+        "version": "v4",
+        "t2s_weights": weights_fingerprint(tts.configs.t2s_weights_path),
+        "vits_weights": weights_fingerprint(tts.configs.vits_weights_path),
+        "onnx": onnx,
+        "torch_version": torch.__version__,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Exported to {output_dir}")
+
+
+def max_abs_diff(a, b) -> float:
+    if isinstance(a, (list, tuple)):
+        return max(max_abs_diff(x, y) for x, y in zip(a, b))
+    return (a.float() - b.float()).abs().max().item()
+
+
+@torch.no_grad()
+def verify(tts: TTS, output_dir: str, backend: str) -> bool:
+    """在多个长度上比较导出组件与 eager 组件的输出，打印最大绝对误差"""
+    models = load_exported_models(
+        output_dir, backend, tts.configs.device, tts.configs.t2s_weights_path, tts.configs.vits_weights_path
+    )
+    if models is None:
+        return False
+
+    decoder = tts.t2s_model.model
+    vits = tts.vits_model
+    tolerance = {"t2s": 1e-3, "encp": 1e-3, "estimator": 1e-2, "estimator_cfg": 1e-2, "vocoder": 1e-2}
+    ok = True
+    print(f"{'frames':<8}{'component':<14}{'max_abs_diff':>14}")
+    for frames in VERIFY_FRAMES:
+        inputs = example_inputs(tts, frames)
+        results = {}
+
+        xy_pos, attn_mask, next_pos = inputs["t2s"]
+        eager = decoder.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+        exported = models["t2s"].process_prompt(xy_pos, attn_mask)
+        eager_next = decoder.t2s_transformer.decode_next_token(next_pos, eager[1], eager[2])
+        exported_next = models["t2s"].decode_next_token(next_pos, exported[1], exported[2])
+        results["t2s"] = max(max_abs_diff(eager, exported), max_abs_diff(eager_next, exported_next))
+
+        codes, text, ge, refer = inputs["encp"]
+        results["encp"] = max_abs_diff(vits.decode_encp(codes, text, refer, ge)[0], models["encp"](codes, text, ge))
+
+        x, prompt_x, x_lens, t, d, mu = inputs["estimator"]
+        results["estimator"] = max_abs_diff(
+            vits.cfm.estimator(x, prompt_x, x_lens, t, d, mu), models["estimator"](x, prompt_x, x_lens, t, d, mu)
+        )
+        cfg = dict(drop_audio_cond=True, drop_text=True)
+        results["estimator_cfg"] = max_abs_diff(
+            vits.cfm.estimator(x, prompt_x, x_lens, t, d, mu, **cfg),
+            models["estimator"](x, prompt_x, x_lens, t, d, mu, **cfg),
+        )
+
+        (mel,) = inputs["vocoder"]
+        results["vocoder"] = max_abs_diff(tts.vocoder(mel), models["vocoder"](mel))
+
+        for name, diff in results.items():
+            passed = diff <= tolerance[name]
+            ok = ok and passed
+            print(f"{frames:<8}{name:<14}{diff:>14.6f}{'' if passed else '  FAIL'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export GPT-SoVITS v4 inference graph")
+    parser.add_argument("--gpt_path", type=str, required=True, help="GPT 模型路径")
+    parser.add_argument("--sovits_path", type=str, required=True, help="SoVITS v4 模型路径")
+    parser.add_argument("-o", "--output_dir", type=str, default="GPT_SoVITS/exported/v4", help="导出目录")
+    parser.add_argument("--device", type=str, default="cpu", help="导出设备")
+    parser.add_argument("--onnx", action="store_true", help="同时导出 estimator / 声码器的 ONNX")
+    parser.add_argument("--verify", action="store_true", help="只校验已导出的模型与 eager 的数值一致性")
+    parser.add_argument(
+        "--backend", type=str, default="torchscript", choices=["torchscript", "onnx"], help="校验使用的后端"
+    )
+    args = parser.parse_args()
+
+    tts = build_tts(args.gpt_path, args.sovits_path, args.device)
+    if tts.configs.version != "v4":
+        raise SystemExit(f"Only v4 models can be exported, got {tts.configs.version}")
+
+    if not args.verify:
+        export(tts, args.output_dir, args.onnx)
+    backends = [args.backend] if args.verify else ["torchscript"] + (["onnx"] if args.onnx else [])
+    for backend in backends:
+        print(f"Verifying {backend} ...")
+        if not verify(tts, args.output_dir, backend):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
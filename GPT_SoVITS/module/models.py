@@ -993,10 +993,12 @@ class CFM(torch.nn.Module):
         self.criterion = torch.nn.MSELoss()
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, n_timesteps, temperature=1.0, inference_cfg_rate=0):
-        """Forward diffusion"""
+    def inference(
+        self, mu, x_lens, prompt, n_timesteps, temperature=1.0, inference_cfg_rate=0, generator=None, should_stop=None
+    ):
+        """Forward diffusion; should_stop() 为真时提前返回（结果不完整，由调用方丢弃）"""
         B, T = mu.size(0), mu.size(1)
-        x = torch.randn([B, self.in_channels, T], device=mu.device, dtype=mu.dtype) * temperature
+        x = torch.randn([B, self.in_channels, T], device=mu.device, dtype=mu.dtype, generator=generator) * temperature
         prompt_len = prompt.size(-1)
         prompt_x = torch.zeros_like(x, dtype=mu.dtype)
         prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
@@ -1005,6 +1007,8 @@ class CFM(torch.nn.Module):
         t = 0
         d = 1 / n_timesteps
         for j in range(n_timesteps):
+            if should_stop is not None and should_stop():
+                break
             t_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * t
             d_tensor = torch.ones(x.shape[0], device=x.device, dtype=mu.dtype) * d
             # v_pred = model(x, t_tensor, d_tensor, **extra_args)
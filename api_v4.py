@@ -19,13 +19,28 @@
 `-fp` - `覆盖 config.py 使用全精度`
 `-hp` - `覆盖 config.py 使用半精度`
 `-sm` - `流式返回模式, 默认不启用, "close","c", "normal","n", "keepalive","k"`
-·-mt` - `返回的音频编码格式, 流式默认ogg, 非流式默认wav, "wav", "ogg", "aac"`
+·-mt` - `返回的音频编码格式, 流式默认ogg, 非流式默认wav, "wav", "ogg", "opus", "aac", "mp3"; 每个响应一个常驻编码器,
+        流式 wav 先发送长度未定的文件头再直接发送 PCM, 浏览器可以边收边播`
 ·-st` - `返回的音频数据类型, 默认int16, "int16", "int32"`
 ·-cp` - `文本切分符号设定, 默认为空, 以",.，。"字符串的方式传入`
 
 `-hb` - `cnhubert路径`
 `-b` - `bert路径`
 
+`-e` - `推理引擎, 默认"tts": 与图形界面共用 TTS_infer_pack.TTS / ModelCache (支持 v4 48k、parallel_infer、分桶);
+        "legacy": 本文件中的逐句推理实现 (-bw 微批处理仅对其生效)`
+`-bs` - `tts 引擎每批推理的句子数, 默认1`
+
+`-w` - `合成工作线程数, 默认1`
+`-mq` - `排队请求数上限, 超出时返回 429, 默认8`
+`-to` - `单个请求的超时秒数上限, 默认300, 0 表示不限; 请求中的 timeout 参数只能在此之内缩短, 0 或不给时使用上限`
+`-bw` - `跨请求微批处理的等待窗口(毫秒), 默认0不启用; 需配合 -w 大于1`
+`-mb` - `微批处理的最大 batch, 默认8`
+`-rc` - `参考音频特征缓存条数, 默认16, 0 表示不缓存`
+`-spk` - `说话人配置 json 路径, 格式见下文 "多说话人"`
+`-mm` - `说话人模型显存/内存预算(MB), 默认0不限; 超出时卸载最久未用且空闲的说话人`
+`-nw` - `跳过启动时的预热合成; 默认在模型加载完成后用默认参考音频合成一句, 之后才就绪`
+
 ## 调用:
 
 ### 推理
@@ -95,6 +110,42 @@ POST:
 RESP:
 成功: 直接返回 wav 音频流， http code 200
 失败: 返回包含错误信息的 json, http code 400
+排队已满: 返回 json, http code 429, 可按 Retry-After 头稍后重试
+超时: 返回 json, http code 504（已开始返回音频时直接结束音频流）
+
+
+### 多说话人
+
+推理请求中用 `spk` 指定说话人, 不指定时使用 "default" (即 -s/-g 指定的模型)。
+说话人在首次请求时加载, 超出 -mm 预算时卸载最久未用且空闲的说话人; BERT、CNHuBERT、BigVGAN 所有说话人共用。
+不同说话人可以同时合成, 同一说话人的请求依次执行 (启用 -bw 微批处理时同一说话人的请求会合并 T2S 推理, 不再加锁)。
+请求未给参考音频时, 优先使用说话人配置中的参考音频, 其次使用默认参考音频。
+
+说话人配置 (-spk):
+```json
+{
+    "narrator": {
+        "gpt_path": "GPT_weights/narrator.ckpt",
+        "sovits_path": "SoVITS_weights/narrator.pth",
+        "refer_wav_path": "refs/narrator.wav",
+        "prompt_text": "一二三。",
+        "prompt_language": "zh"
+    }
+}
+```
+
+endpoint: `/speakers`
+GET: 查看已注册的说话人与加载状态
+
+endpoint: `/set_model`
+传入 `spk` 时注册或替换该说话人, 不影响其他说话人; 不传时替换 "default"
+```json
+{
+    "spk": "narrator",
+    "gpt_model_path": "GPT_weights/narrator.ckpt",
+    "sovits_model_path": "SoVITS_weights/narrator.pth"
+}
+```
 
 
 ### 更换默认参考音频
@@ -119,6 +170,35 @@ RESP:
 失败: json, 400
 
 
+### WebSocket 流式合成
+
+endpoint: `/ws`
+
+客户端边输入文本边发送, 服务端按标点凑齐一句就开始合成, 音频以二进制帧返回, 适合实时朗读与对话。
+一个连接内所有句子的音频拼接为一个连续的音频流 (默认 wav: 只发一次文件头, 之后是 PCM)。
+
+客户端 -> 服务端 (json 文本帧):
+1. 第一帧为参数, 除 text 外与推理接口相同, 均可省略; 另有:
+   `format` 音频格式 ("wav", "ogg", "opus", "aac", "mp3", 默认 "wav"),
+   `window` 流控窗口, 大于0时最多只领先客户端确认 (ack) 这么多句, 默认0不等待确认
+```json
+{"spk": "default", "text_language": "zh", "cut_punc": "。！？", "format": "wav", "window": 2}
+```
+2. `{"text": "一段文本"}` 追加文本, 凑齐整句 (以 cut_punc 或 。！？；…!?; 结尾) 即开始合成
+3. `{"event": "flush"}` 把缓冲区中不完整的句子也合成
+4. `{"event": "ack", "seq": 3}` 确认已播放到第 3 句 (window 大于0时使用)
+5. `{"event": "end"}` 合成完剩余文本后结束
+
+服务端 -> 客户端:
+- `{"event": "sentence", "seq": 1, "text": "..."}` 开始发送一句的音频, 随后是若干二进制音频帧
+- `{"event": "sentence_end", "seq": 1}`
+- `{"event": "error", "seq": 1, "code": 429, "message": "..."}` 该句合成失败, 连接继续 (超时的句子在其合成线程停止后才开始下一句)
+- `{"event": "error", "code": 400, "message": "..."}` 第一帧参数无效, 服务端随后关闭连接
+- `{"event": "end"}` 全部结束, 服务端随后关闭连接
+
+待合成的句子排队过多时服务端暂停读取客户端消息, 由 TCP 反压限制客户端发送速度。
+
+
 ### 命令控制
 
 endpoint: `/control`
@@ -138,12 +218,74 @@ POST:
 
 RESP: 无
 
+
+### 参考音频特征缓存
+
+参考音频的 HuBERT 语义、频谱、梅尔谱 (v3) 以及参考文本的音素与 BERT 特征按
+(说话人, 模型, 参考音频路径及其修改时间/大小, 参考文本, 语种) 缓存, 同一参考音频的后续请求不再重复提取。
+两种引擎共用此缓存: tts 引擎在调用 TTS.run 前把缓存的特征填入 TTS 实例的 prompt_cache。
+更换模型时自动清空。
+
+endpoint: `/ref_cache`
+
+GET: 查看命中率与缓存条目
+    `http://127.0.0.1:9880/ref_cache`
+POST: 清空缓存或移除指定参考音频的条目
+```json
+{
+    "command": "evict",
+    "refer_wav_path": "123.wav"
+}
+```
+command: "clear" 清空, "evict" 移除 refer_wav_path 对应的条目
+
+RESP: json, http code 200; 参数错误 400
+
+
+### 健康检查
+
+启动时 BERT、CNHuBERT、说话人模型与 BigVGAN 在后台并行加载, 随后合成一句预热 (需要默认参考音频或
+"default" 说话人配置了参考音频, 否则跳过), 完成前推理、WebSocket 与 /set_model 接口返回 503。
+各阶段耗时在启动完成时写入日志。
+
+endpoint: `/healthz`
+GET: 存活探针, 进程正常时返回 200; 启动失败时返回 503
+
+endpoint: `/ready`
+GET: 就绪探针, 预热完成后返回 200, 之前返回 503; json 中包含当前阶段与各阶段耗时
+```json
+{"ready": true, "phase": "ready", "timings": {"init": 9.8, "bert": 3.1, "cnhubert": 1.2, "speaker:default": 4.5, "load": 4.6, "warmup": 2.3, "total": 16.7}}
+```
+
+
+### 指标
+
+endpoint: `/metrics`
+
+GET: Prometheus 文本格式的指标, 可直接配置为 Prometheus 的抓取目标
+- `tts_stage_seconds{stage}` 各阶段耗时直方图: ref (参考音频处理), g2p_bert, t2s_prefill, t2s_decode,
+  vits, cfm, vocoder, sr (超分), encode (响应编码)
+- `tts_t2s_decode_tokens_per_second` T2S 解码吞吐, `tts_real_time_factor` 实时率 (合成耗时 / 音频时长)
+- `tts_requests_total{endpoint,code}` 请求数, `tts_requests_in_flight` 排队与执行中的请求数
+- `tts_cache_hits_total{cache}` / `tts_cache_misses_total{cache}` / `tts_cache_hit_ratio{cache}`
+  参考音频特征缓存 (ref) 与模型缓存 (model) 的命中情况
+- `tts_model_loads_total{kind}` / `tts_model_load_seconds{kind}` 模型加载次数与耗时
+
 """
 
 import argparse
+import asyncio
 import os
+import json
 import re
 import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+startup_begin = time.perf_counter()  # 启动耗时从这里开始计, 包含导入 torch 等依赖
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
@@ -151,27 +293,27 @@ sys.path.append("%s/GPT_SoVITS" % (now_dir))
 
 import signal
 from text.LangSegmenter import LangSegmenter
-from time import time as ttime
 import torch
 import torchaudio
 import librosa
-import soundfile as sf
-from fastapi import FastAPI, Request, Query
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 import uvicorn
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 import numpy as np
 from feature_extractor import cnhubert
-from io import BytesIO
 from module.models import SynthesizerTrn, SynthesizerTrnV3
 from peft import LoraConfig, get_peft_model
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from text import cleaned_text_to_sequence
 from text.cleaner import clean_text
 from module.mel_processing import spectrogram_torch
+from TTS_infer_pack.text_segmentation_method import splits as tts_splits
 import config as global_config
+from tools.stream_encoder import CONTENT_TYPES, STREAM_FORMATS, create_encoder, pcm_view, wav_header
+from tools.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tools.metrics import REGISTRY, model_load, observe_stage, observe_synthesis, observe_t2s
 import logging
-import subprocess
 
 
 class DefaultRefer:
@@ -198,7 +340,20 @@ def is_full(*items):  # 任意一项为空返回False
     return True
 
 
+bigvgan_model = None
+bigvgan_lock = threading.Lock()
+
+
 def init_bigvgan():
+    # 所有 v3 说话人共用一个 BigVGAN, 只加载一次
+    with bigvgan_lock:
+        if bigvgan_model is not None:
+            return
+        load_bigvgan()
+
+
+@model_load("bigvgan")
+def load_bigvgan():
     global bigvgan_model
     from BigVGAN import bigvgan
 
@@ -225,6 +380,12 @@ def resample(audio_tensor, sr0):
     return resample_transform_dict[sr0](audio_tensor)
 
 
+def sync_device():
+    # 阶段计时前等待 GPU 上已提交的计算完成, 否则异步执行的耗时会计入下一个阶段
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
 from module.mel_processing import mel_spectrogram_torch
 
 spec_min = -12
@@ -263,7 +424,8 @@ def audio_sr(audio, sr):
         from tools.audio_sr import AP_BWE
 
         try:
-            sr_model = AP_BWE(device, DictToAttrRecursive)
+            with model_load("sr"):
+                sr_model = AP_BWE(device, DictToAttrRecursive)
         except FileNotFoundError:
             logger.info("你没有下载超分模型的参数，因此不进行超分。如想超分请先参照教程把文件下载")
             return audio.cpu().detach().numpy(), sr
@@ -271,18 +433,165 @@ def audio_sr(audio, sr):
 
 
 class Speaker:
-    def __init__(self, name, gpt, sovits, phones=None, bert=None, prompt=None):
+    def __init__(self, name, gpt, sovits, phones=None, bert=None, prompt=None, tts=None):
         self.name = name
         self.sovits = sovits
         self.gpt = gpt
         self.phones = phones
         self.bert = bert
         self.prompt = prompt
+        self.tts = tts  # tts 引擎下的 TTS_infer_pack.TTS 实例, legacy 引擎为 None
+        self.model_paths = None  # (gpt_path, sovits_path)
+        self.lock = threading.Lock()  # 同一说话人的合成依次执行
+        self.users = 0  # 正在使用的请求数, 大于0时不会被卸载
+        self.last_used = time.monotonic()
+        models = (tts.t2s_model, tts.vits_model) if tts is not None else (gpt.t2s_model, sovits.vq_model)
+        self.nbytes = sum(p.numel() * p.element_size() for model in models for p in model.parameters())
+
+
+def load_speaker(name, gpt_path, sovits_path):
+    if engine == "legacy":
+        # GPT 与 SoVITS 权重互不依赖, 同时加载
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="load-speaker") as pool:
+            gpt = pool.submit(get_gpt_weights, gpt_path)
+            sovits = pool.submit(get_sovits_weights, sovits_path)
+            speaker = Speaker(name=name, gpt=gpt.result(), sovits=sovits.result())
+    else:
+        # ModelCache 不是线程安全的, 加载与移除串行进行
+        with model_cache_lock:
+            tts = model_cache.get_model(gpt_path, sovits_path)
+        if tts is None:
+            raise RuntimeError(f"模型加载失败: {gpt_path}, {sovits_path}")
+        speaker = Speaker(name=name, gpt=None, sovits=None, tts=tts)
+    speaker.model_paths = (gpt_path, sovits_path)
+    return speaker
 
 
+# 已加载的说话人
 speaker_list = {}
 
 
+class SpeakerRegistry:
+    """
+    说话人注册表: 记录各说话人的模型路径与参考音频, 首次使用时加载。
+    已加载模型的参数总量超过预算时, 卸载最久未用且没有请求在使用的说话人。
+    """
+
+    def __init__(self, budget_mb=0):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.specs = {}  # name -> {"gpt_path", "sovits_path", "refer_wav_path", "prompt_text", "prompt_language"}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def register(self, name, gpt_path, sovits_path, refer_wav_path="", prompt_text="", prompt_language=""):
+        """注册或替换说话人; 替换时已加载的旧模型在当前请求结束后释放"""
+        spec = {
+            "gpt_path": gpt_path,
+            "sovits_path": sovits_path,
+            "refer_wav_path": refer_wav_path or "",
+            "prompt_text": prompt_text or "",
+            "prompt_language": prompt_language or "",
+        }
+        with self._lock:
+            old = self.specs.get(name)
+            self.specs[name] = spec
+            if old is not None and (old["gpt_path"], old["sovits_path"]) != (gpt_path, sovits_path):
+                self._unload(name)
+
+    def load_file(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            speakers = json.load(f)
+        for name, spec in speakers.items():
+            self.register(
+                name,
+                spec["gpt_path"],
+                spec["sovits_path"],
+                spec.get("refer_wav_path"),
+                spec.get("prompt_text"),
+                spec.get("prompt_language"),
+            )
+        logger.info(f"已注册说话人: {', '.join(speakers)}")
+
+    def refer_of(self, name):
+        spec = self.specs.get(name)
+        if spec is None or not is_full(spec["refer_wav_path"], spec["prompt_text"], spec["prompt_language"]):
+            return None
+        return spec["refer_wav_path"], spec["prompt_text"], spec["prompt_language"]
+
+    def acquire(self, name):
+        """取得已加载的说话人并标记为使用中, 用完须调用 release"""
+        with self._lock:
+            if name not in self.specs:
+                raise KeyError(f"未注册的说话人: {name}")
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        # 加载较慢, 只按说话人加锁, 不阻塞其他说话人的请求
+        with load_lock:
+            with self._lock:
+                speaker = speaker_list.get(name)
+                spec = self.specs[name]
+            if speaker is None:
+                logger.info(f"加载说话人: {name}")
+                with model_load("speaker"):
+                    speaker = load_speaker(name, spec["gpt_path"], spec["sovits_path"])
+            with self._lock:
+                if speaker.tts is not None:
+                    # ModelCache 对同一组权重只有一个 TTS 实例, 共用它的说话人也共用一把锁
+                    for other in speaker_list.values():
+                        if other is not speaker and other.tts is speaker.tts:
+                            speaker.lock = other.lock
+                            break
+                if self.specs.get(name) is spec:
+                    speaker_list[name] = speaker
+                speaker.users += 1
+                speaker.last_used = time.monotonic()
+                self._enforce_budget()
+        return speaker
+
+    def release(self, speaker):
+        with self._lock:
+            speaker.users -= 1
+            speaker.last_used = time.monotonic()
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        # 调用方持有 self._lock
+        if self.budget <= 0:
+            return
+        while sum(s.nbytes for s in speaker_list.values()) > self.budget:
+            idle = [s for s in speaker_list.values() if s.users == 0]
+            if not idle:
+                break
+            self._unload(min(idle, key=lambda s: s.last_used).name)
+
+    def _unload(self, name):
+        # 调用方持有 self._lock; 正在使用旧模型的请求持有引用, 结束后才真正释放
+        speaker = speaker_list.pop(name, None)
+        if speaker is None:
+            return
+        if speaker.tts is not None and all(other.tts is not speaker.tts for other in speaker_list.values()):
+            with model_cache_lock:
+                model_cache.remove(*speaker.model_paths)
+        ref_cache.evict_speaker(name)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logger.info(f"卸载说话人: {name}")
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "gpt_path": spec["gpt_path"],
+                    "sovits_path": spec["sovits_path"],
+                    "loaded": name in speaker_list,
+                    "in_use": speaker_list[name].users if name in speaker_list else 0,
+                    "size_mb": round(speaker_list[name].nbytes / 1024 / 1024, 1) if name in speaker_list else None,
+                    "has_refer": self.refer_of(name) is not None,
+                }
+                for name, spec in self.specs.items()
+            ]
+
+
 class Sovits:
     def __init__(self, vq_model, hps):
         self.vq_model = vq_model
@@ -390,14 +699,18 @@ def get_gpt_weights(gpt_path):
     return gpt
 
 
-def change_gpt_sovits_weights(gpt_path, sovits_path):
+def change_gpt_sovits_weights(gpt_path, sovits_path, spk="default"):
+    spk = spk or "default"
+    old = speaker_registry.specs.get(spk)
+    refer = {key: old[key] for key in ("refer_wav_path", "prompt_text", "prompt_language")} if old else {}
     try:
-        gpt = get_gpt_weights(gpt_path)
-        sovits = get_sovits_weights(sovits_path)
+        speaker_registry.register(spk, gpt_path, sovits_path, **refer)
+        speaker_registry.release(speaker_registry.acquire(spk))  # 立即加载, 路径有误时直接报错
     except Exception as e:
+        if old is not None:
+            speaker_registry.register(spk, **old)
         return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
 
-    speaker_list["default"] = Speaker(name="default", gpt=gpt, sovits=sovits)
     return JSONResponse({"code": 0, "message": "Success"}, status_code=200)
 
 
@@ -552,125 +865,59 @@ def get_spepc(hps, filename):
     return spec
 
 
-def pack_audio(audio_bytes, data, rate):
-    if media_type == "ogg":
-        audio_bytes = pack_ogg(audio_bytes, data, rate)
-    elif media_type == "aac":
-        audio_bytes = pack_aac(audio_bytes, data, rate)
-    else:
-        # wav无法流式, 先暂存raw
-        audio_bytes = pack_raw(audio_bytes, data, rate)
-
-    return audio_bytes
-
-
-def pack_ogg(audio_bytes, data, rate):
-    # Author: AkagawaTsurunaki
-    # Issue:
-    #   Stack overflow probabilistically occurs
-    #   when the function `sf_writef_short` of `libsndfile_64bit.dll` is called
-    #   using the Python library `soundfile`
-    # Note:
-    #   This is an issue related to `libsndfile`, not this project itself.
-    #   It happens when you generate a large audio tensor (about 499804 frames in my PC)
-    #   and try to convert it to an ogg file.
-    # Related:
-    #   https://github.com/RVC-Boss/GPT-SoVITS/issues/1199
-    #   https://github.com/libsndfile/libsndfile/issues/1023
-    #   https://github.com/bastibe/python-soundfile/issues/396
-    # Suggestion:
-    #   Or split the whole audio data into smaller audio segment to avoid stack overflow?
-
-    def handle_pack_ogg():
-        with sf.SoundFile(audio_bytes, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-            audio_file.write(data)
-
-    import threading
-
-    # See: https://docs.python.org/3/library/threading.html
-    # The stack size of this thread is at least 32768
-    # If stack overflow error still occurs, just modify the `stack_size`.
-    # stack_size = n * 4096, where n should be a positive integer.
-    # Here we chose n = 4096.
-    stack_size = 4096 * 4096
-    try:
-        threading.stack_size(stack_size)
-        pack_ogg_thread = threading.Thread(target=handle_pack_ogg)
-        pack_ogg_thread.start()
-        pack_ogg_thread.join()
-    except RuntimeError as e:
-        # If changing the thread stack size is unsupported, a RuntimeError is raised.
-        print("RuntimeError: {}".format(e))
-        print("Changing the thread stack size is unsupported.")
-    except ValueError as e:
-        # If the specified stack size is invalid, a ValueError is raised and the stack size is unmodified.
-        print("ValueError: {}".format(e))
-        print("The specified stack size is invalid.")
-
-    return audio_bytes
-
-
-def pack_raw(audio_bytes, data, rate):
-    audio_bytes.write(data.tobytes())
-
-    return audio_bytes
-
-
-def pack_wav(audio_bytes, rate):
-    if is_int32:
-        data = np.frombuffer(audio_bytes.getvalue(), dtype=np.int32)
-        wav_bytes = BytesIO()
-        sf.write(wav_bytes, data, rate, format="WAV", subtype="PCM_32")
-    else:
-        data = np.frombuffer(audio_bytes.getvalue(), dtype=np.int16)
-        wav_bytes = BytesIO()
-        sf.write(wav_bytes, data, rate, format="WAV")
-    return wav_bytes
-
-
-def pack_aac(audio_bytes, data, rate):
-    if is_int32:
-        pcm = "s32le"
-        bit_rate = "256k"
-    else:
-        pcm = "s16le"
-        bit_rate = "128k"
-    process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            pcm,  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            bit_rate,  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, _ = process.communicate(input=data.tobytes())
-    audio_bytes.write(out)
-
-    return audio_bytes
-
-
-def read_clean_buffer(audio_bytes):
-    audio_chunk = audio_bytes.getvalue()
-    audio_bytes.truncate(0)
-    audio_bytes.seek(0)
-
-    return audio_bytes, audio_chunk
+class ResponseAudio:
+    """
+    一个响应的音频输出。
+    流式模式下每个响应一个常驻编码器 (wav 为长度未定的文件头 + 原样 PCM), 各块拼接即为完整的音频流;
+    非流式模式下在 close 时一次返回, wav 此时长度已知, 写入准确的文件头后直接输出各段 PCM 缓冲区。
+    write 与 close 返回可以发送的数据块列表。
+    """
+
+    def __init__(self, stream, fmt=None):
+        self.stream = stream
+        self.fmt = fmt or media_type
+        self.encoder = None
+        self.parts = []
+        self.sample_rate = None
+        self.dtype = np.int32 if is_int32 else np.int16
+        self.closed = False
+
+    def write(self, data, rate):
+        """写入一段 PCM"""
+        self.sample_rate = rate
+        if not self.stream and self.fmt == "wav":
+            self.parts.append(data)
+            return []
+        start = time.perf_counter()
+        if self.encoder is None:
+            self.encoder = create_encoder(self.fmt, rate, self.dtype)
+        chunk = self.encoder.write(data)
+        observe_stage("encode", time.perf_counter() - start)
+        if not self.stream:
+            self.parts.append(chunk)
+            return []
+        return [chunk] if len(chunk) else []
+
+    def close(self, default_rate=None):
+        self.closed = True
+        rate = self.sample_rate or default_rate
+        if not self.stream and self.fmt == "wav":
+            data_size = sum(part.nbytes for part in self.parts)
+            return [wav_header(rate, self.dtype, data_size)] + [pcm_view(part) for part in self.parts]
+        start = time.perf_counter()
+        if self.encoder is None:
+            # 没有合成出任何音频时也返回一个合法的空音频
+            self.encoder = create_encoder(self.fmt, rate, self.dtype)
+        tail = self.encoder.close()
+        observe_stage("encode", time.perf_counter() - start)
+        if not self.stream:
+            return [b"".join(self.parts) + tail]
+        return [tail] if len(tail) else []
+
+    def abort(self):
+        if not self.closed and self.encoder is not None:
+            self.encoder.abort()
+        self.closed = True
 
 
 def cut_text(text, punc):
@@ -712,37 +959,242 @@ splits = {
 }
 
 
-def get_tts_wav(
-    ref_wav_path,
-    prompt_text,
-    prompt_language,
-    text,
-    text_language,
-    top_k=15,
-    top_p=0.6,
-    temperature=0.6,
-    speed=1,
-    inp_refs=None,
-    sample_steps=32,
-    if_sr=False,
-    spk="default",
-):
-    infer_sovits = speaker_list[spk].sovits
-    vq_model = infer_sovits.vq_model
-    hps = infer_sovits.hps
-    version = vq_model.version
+class _BatchJob:
+    def __init__(self, context, phones, bert, should_stop=None):
+        self.context = context
+        self.phones = phones  # 参考 + 目标音素
+        self.bert = bert  # (1024, len(phones))
+        self.should_stop = should_stop
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class T2SBatcher:
+    """
+    跨请求的 T2S 微批处理。
+    各工作线程逐句提交, 说话人、参考音频与采样参数相同的句子在 window 内凑成一批,
+    一起走 infer_panel_batch_infer。
+    vits 解码与 v3 的 CFM 分块解码仍在各自的工作线程中逐句进行: 各句的 speed 与参考可能不同,
+    拼接后一次 decode 会让句子之间互相影响 (enc_p 按 speed 对整段插值)。
+    请求超时或断开时, 排队中的句子直接移出队列; 已在批中的句子等整批的请求都取消后才中止解码。
+    """
+
+    cancel_poll = 0.1  # 等待结果时检查 should_stop 的间隔 (秒)
+
+    def __init__(self, window_ms, max_batch):
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._cond = threading.Condition()
+        self._queues = {}  # key -> [_BatchJob]
+        self.batches = 0
+        self.sentences = 0
+        self._thread = threading.Thread(target=self._loop, name="t2s-batcher", daemon=True)
+        self._thread.start()
+
+    def run(self, key, context, phones, bert, should_stop=None):
+        """提交一句并等待结果, 返回 pred_semantic (1, 1, T); 请求被取消 (should_stop() 为 True) 时返回 None"""
+        job = _BatchJob(context, phones, bert, should_stop)
+        with self._cond:
+            self._queues.setdefault(key, []).append(job)
+            self._cond.notify_all()
+        while not job.done.wait(self.cancel_poll):
+            if should_stop is not None and should_stop() and self._withdraw(key, job):
+                return None
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _withdraw(self, key, job):
+        """把尚未进入批次的句子移出队列, 已进入批次时返回 False"""
+        with self._cond:
+            jobs = self._queues.get(key)
+            if jobs is None or job not in jobs:
+                return False
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[key]
+            self._cond.notify_all()
+            return True
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                while not self._queues:
+                    self._cond.wait()
+                # 先处理最早到达的一组, 等到凑满或窗口结束
+                key = min(self._queues, key=lambda k: self._queues[k][0].arrival)
+                deadline = self._queues[key][0].arrival + self.window
+                while key in self._queues and len(self._queues[key]) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                jobs = self._queues.get(key)
+                if not jobs:
+                    # 等待期间这一组的句子全部被取消
+                    continue
+                batch, rest = jobs[: self.max_batch], jobs[self.max_batch :]
+                if rest:
+                    self._queues[key] = rest
+                else:
+                    del self._queues[key]
+                return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self._run_batch(batch)
+                for job, result in zip(batch, results):
+                    job.result = result
+            except Exception as e:
+                logger.exception("微批推理出错")
+                for job in batch:
+                    job.error = e
+            finally:
+                for job in batch:
+                    job.done.set()
+
+    def _run_batch(self, batch):
+        context = batch[0].context
+        t2s_model = context["t2s_model"]
+        x = [torch.LongTensor(job.phones).to(device) for job in batch]
+        x_lens = torch.LongTensor([len(job.phones) for job in batch]).to(device)
+        bert = [job.bert.to(device) for job in batch]
+        prompts = context["prompt"].expand(len(batch), -1)
+        t2s_timing = {}
+
+        def should_stop():
+            # 整批的请求都已取消才中止, 个别请求超时不影响同批的其他句子
+            return all(job.should_stop is not None and job.should_stop() for job in batch)
 
-    infer_gpt = speaker_list[spk].gpt
-    t2s_model = infer_gpt.t2s_model
-    max_sec = infer_gpt.max_sec
+        with torch.no_grad():
+            pred_list, idx_list = t2s_model.model.infer_panel_batch_infer(
+                x,
+                x_lens,
+                prompts,
+                bert,
+                top_k=context["top_k"],
+                top_p=context["top_p"],
+                temperature=context["temperature"],
+                early_stop_num=context["early_stop_num"],
+                max_len=x_lens.max(),
+                timing=t2s_timing,
+                should_stop=should_stop,
+            )
+        observe_t2s(t2s_timing)
+
+        self.batches += 1
+        self.sentences += len(batch)
+        # 整批被中止时未解码完的句子为 None, 对应的请求都已取消
+        return [
+            None if pred is None else pred[-idx:].unsqueeze(0).unsqueeze(0) for pred, idx in zip(pred_list, idx_list)
+        ]
+
+
+class RefFeatureCache:
+    """
+    参考音频特征的 LRU 缓存。
+    参考音频文件以修改时间和大小识别, 文件被覆盖后自动失效; 模型以对象 id 区分, 更换模型时整体清空。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(0, capacity)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _file_id(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def make_key(self, spk, vq_model, ref_wav_path, prompt_text, prompt_language, inp_refs):
+        inp_ids = []
+        for path in inp_refs or ():
+            try:
+                inp_ids.append(self._file_id(path))
+            except OSError:
+                inp_ids.append((path, None, None))  # 读取失败的辅助参考音频在提取时跳过
+        return (
+            spk,
+            id(vq_model),
+            self._file_id(ref_wav_path),
+            prompt_text,
+            prompt_language,
+            tuple(inp_ids),
+        )
 
-    t0 = ttime()
-    prompt_text = prompt_text.strip("\n")
-    if prompt_text[-1] not in splits:
-        prompt_text += "。" if prompt_language != "en" else "."
-    prompt_language, text = prompt_language, text.strip("\n")
+    def get(self, key, extract):
+        """命中时返回缓存的特征, 否则调用 extract() 提取并放入缓存"""
+        if self.capacity == 0:
+            return extract()
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return features
+            self.misses += 1
+        # 提取较慢, 不持有锁; 并发的相同请求可能各自提取一次
+        features = extract()
+        with self._lock:
+            self._entries[key] = features
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return features
+
+    def evict(self, ref_wav_path):
+        """移除指定参考音频 (作为主参考) 的所有条目, 返回移除的条数"""
+        path = os.path.abspath(ref_wav_path)
+        with self._lock:
+            keys = [key for key in self._entries if key[2][0] == path]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def evict_speaker(self, spk):
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == spk]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "capacity": self.capacity,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": [
+                    {"speaker": key[0], "refer_wav_path": key[2][0], "prompt_text": key[3], "prompt_language": key[4]}
+                    for key in reversed(self._entries)
+                ],
+            }
+
+
+def extract_ref_features(hps, vq_model, ref_wav_path, prompt_text, prompt_language, inp_refs):
+    """提取一条参考音频的全部特征: 语义 prompt、频谱 refers/refer、参考文本的音素与 BERT, v3 另有梅尔谱"""
+    version = vq_model.version
     dtype = torch.float16 if is_half == True else torch.float32
     zero_wav = np.zeros(int(hps.data.sampling_rate * 0.3), dtype=np.float16 if is_half == True else np.float32)
+    features = {}
     with torch.no_grad():
         wav16k, sr = librosa.load(ref_wav_path, sr=16000)
         wav16k = torch.from_numpy(wav16k)
@@ -757,7 +1209,7 @@ def get_tts_wav(
         ssl_content = ssl_model.model(wav16k.unsqueeze(0))["last_hidden_state"].transpose(1, 2)  # .float()
         codes = vq_model.extract_latent(ssl_content)
         prompt_semantic = codes[0, 0]
-        prompt = prompt_semantic.unsqueeze(0).to(device)
+        features["prompt"] = prompt_semantic.unsqueeze(0).to(device)
 
         if version != "v3":
             refers = []
@@ -770,22 +1222,276 @@ def get_tts_wav(
                         logger.error(e)
             if len(refers) == 0:
                 refers = [get_spepc(hps, ref_wav_path).to(dtype).to(device)]
+            features["refers"] = refers
         else:
-            refer = get_spepc(hps, ref_wav_path).to(device).to(dtype)
+            features["refer"] = get_spepc(hps, ref_wav_path).to(device).to(dtype)
+            ref_audio, sr = torchaudio.load(ref_wav_path)
+            ref_audio = ref_audio.to(device).float()
+            if ref_audio.shape[0] == 2:
+                ref_audio = ref_audio.mean(0).unsqueeze(0)
+            if sr != 24000:
+                ref_audio = resample(ref_audio, sr)
+            features["mel2"] = norm_spec(mel_fn(ref_audio))
+
+    phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, dict_language[prompt_language.lower()], version)
+    features["phones1"] = phones1
+    features["bert1"] = bert1
+    return features
+
+
+def get_tts_wav(
+    ref_wav_path,
+    prompt_text,
+    prompt_language,
+    text,
+    text_language,
+    top_k=15,
+    top_p=0.6,
+    temperature=0.6,
+    speed=1,
+    inp_refs=None,
+    sample_steps=32,
+    if_sr=False,
+    spk="default",
+    output=None,
+    ref_memo=None,
+    should_stop=None,
+):
+    """
+    output: 调用方持有的 ResponseAudio, 多次调用共用一个音频流 (WebSocket 连接), 由调用方负责 close;
+            不传时每次调用独立成一个完整的音频。
+    ref_memo: 调用方持有的参考音频特征字典 (每个 WebSocket 连接一个), 不受全局 LRU 淘汰影响。
+    should_stop: 返回 True 时尽快中止合成 (请求超时或客户端断开), 由 SynthesisScheduler 传入。
+    """
+    speaker = speaker_registry.acquire(spk)
+    owns_output = output is None
+    if owns_output:
+        output = ResponseAudio(stream=stream_mode == "normal")
+    try:
+        # 微批处理时同一说话人的请求需要同时进入 T2SBatcher 才能凑批, 推理由批处理线程串行执行;
+        # TTS 实例带有参考音频缓存与中止标记, 同一实例始终不能并发使用
+        use_lock = t2s_batcher is None or speaker.tts is not None
+        synthesize = engine_tts_wav if speaker.tts is not None else speaker_tts_wav
+        with speaker.lock if use_lock else nullcontext():
+            sample_rate = yield from synthesize(
+                speaker,
+                output,
+                ref_memo,
+                ref_wav_path,
+                prompt_text,
+                prompt_language,
+                text,
+                text_language,
+                top_k,
+                top_p,
+                temperature,
+                speed,
+                inp_refs,
+                sample_steps,
+                if_sr,
+                should_stop,
+            )
+        if owns_output:
+            yield from output.close(sample_rate)
+    finally:
+        if owns_output:
+            output.abort()  # 客户端断开或出错时结束编码进程
+        speaker_registry.release(speaker)
+
+
+# TTS.prompt_cache 中由参考音频与参考文本决定的字段
+tts_prompt_fields = (
+    "ref_audio_path",
+    "prompt_semantic",
+    "refer_spec",
+    "raw_audio",
+    "raw_sr",
+    "aux_ref_audio_paths",
+    "prompt_text",
+    "prompt_lang",
+    "phones",
+    "bert_features",
+    "norm_text",
+)
 
-    t1 = ttime()
+
+def extract_tts_prompt(tts, ref_wav_path, prompt_text, prompt_lang, aux_ref_audio_paths):
+    """按 TTS.run 的方式处理参考音频与参考文本, 返回 prompt_cache 中对应字段, 供 RefFeatureCache 缓存"""
+    if not os.path.exists(ref_wav_path):
+        raise ValueError(f"{ref_wav_path} not exists")
+    tts.set_ref_audio(ref_wav_path)
+    refer_spec = [tts.prompt_cache["refer_spec"][0]]
+    for path in aux_ref_audio_paths:
+        if os.path.exists(path):
+            refer_spec.append(tts._get_ref_spec(path))
+    tts.prompt_cache["refer_spec"] = refer_spec
+    tts.prompt_cache["aux_ref_audio_paths"] = list(aux_ref_audio_paths)
+    if prompt_text:
+        prompt_text = prompt_text.strip("\n")
+        if prompt_text[-1] not in tts_splits:
+            prompt_text += "。" if prompt_lang != "en" else "."
+        phones, bert_features, norm_text = tts.text_preprocessor.segment_and_extract_feature_for_text(
+            prompt_text, prompt_lang, tts.configs.version
+        )
+        tts.prompt_cache.update(
+            prompt_text=prompt_text,
+            prompt_lang=prompt_lang,
+            phones=phones,
+            bert_features=bert_features,
+            norm_text=norm_text,
+        )
+    return {field: tts.prompt_cache.get(field) for field in tts_prompt_fields}
+
+
+def engine_tts_wav(
+    speaker,
+    output,
+    ref_memo,
+    ref_wav_path,
+    prompt_text,
+    prompt_language,
+    text,
+    text_language,
+    top_k,
+    top_p,
+    temperature,
+    speed,
+    inp_refs,
+    sample_steps,
+    if_sr,
+    should_stop,
+):
+    """
+    tts 引擎: 把接口参数映射到 TTS.run 的输入, 输出格式与 legacy 引擎一致, 返回采样率。
+    参考音频特征与 legacy 引擎一样经 ref_memo / RefFeatureCache 缓存, 填入 TTS 实例后 TTS.run 不再重复提取。
+    TTS.run 出错时直接抛出 (不输出占位的静音), 由调用方返回错误码。
+    """
+    tts = speaker.tts
+    aux_ref_audio_paths = [path for path in inp_refs or [] if path]
+    prompt_lang = dict_language[prompt_language.lower()]
+    ref_key = ref_cache.make_key(speaker.name, tts.vits_model, ref_wav_path, prompt_text, prompt_lang, inp_refs)
+    ref_features = ref_memo.get(ref_key) if ref_memo is not None else None
+    if ref_features is None:
+        ref_features = ref_cache.get(
+            ref_key, lambda: extract_tts_prompt(tts, ref_wav_path, prompt_text, prompt_lang, aux_ref_audio_paths)
+        )
+        if ref_memo is not None:
+            ref_memo.clear()  # 一个连接只保留当前使用的参考音频
+            ref_memo[ref_key] = ref_features
+    tts.prompt_cache.update(ref_features)
+    tts.prompt_cache["refer_spec"] = list(ref_features["refer_spec"])  # TTS.run 会原地修改这个列表
+
+    inputs = {
+        "text": text,
+        "text_lang": dict_language[text_language.lower()],
+        "ref_audio_path": ref_wav_path,
+        "aux_ref_audio_paths": aux_ref_audio_paths,
+        "prompt_text": prompt_text,
+        "prompt_lang": prompt_lang,
+        "top_k": top_k,
+        "top_p": top_p,
+        "temperature": temperature,
+        "text_split_method": "cut0",  # handle 已按 cut_punc 切分, 每行一句
+        "batch_size": engine_batch_size,
+        "return_fragment": output.stream,
+        "speed_factor": speed,
+        "fragment_interval": 0.3,  # 与 legacy 引擎句间的 0.3 秒静音一致
+        "seed": -1,
+        "parallel_infer": True,
+        "sample_steps": sample_steps,
+        "super_sampling": if_sr,
+        "should_stop": should_stop,
+        "placeholder_audio": False,
+    }
+    sr = None
+    for sr, audio in tts.run(inputs):
+        if is_int32:
+            audio = audio.astype(np.int32) * 65536
+        yield from output.write(audio, sr)
+    return sr or tts.configs.sampling_rate
+
+
+def speaker_tts_wav(
+    speaker,
+    output,
+    ref_memo,
+    ref_wav_path,
+    prompt_text,
+    prompt_language,
+    text,
+    text_language,
+    top_k,
+    top_p,
+    temperature,
+    speed,
+    inp_refs,
+    sample_steps,
+    if_sr,
+    should_stop,
+):
+    spk = speaker.name
+    infer_sovits = speaker.sovits
+    vq_model = infer_sovits.vq_model
+    hps = infer_sovits.hps
+    version = vq_model.version
+
+    infer_gpt = speaker.gpt
+    t2s_model = infer_gpt.t2s_model
+    max_sec = infer_gpt.max_sec
+
+    t0 = time.perf_counter()
+    prompt_text = prompt_text.strip("\n")
+    if prompt_text[-1] not in splits:
+        prompt_text += "。" if prompt_language != "en" else "."
+    prompt_language, text = prompt_language, text.strip("\n")
+    dtype = torch.float16 if is_half == True else torch.float32
+    zero_wav = np.zeros(int(hps.data.sampling_rate * 0.3), dtype=np.float16 if is_half == True else np.float32)
+    ref_key = ref_cache.make_key(spk, vq_model, ref_wav_path, prompt_text, prompt_language, inp_refs)
+    ref_features = ref_memo.get(ref_key) if ref_memo is not None else None
+    if ref_features is None:
+        ref_features = ref_cache.get(
+            ref_key, lambda: extract_ref_features(hps, vq_model, ref_wav_path, prompt_text, prompt_language, inp_refs)
+        )
+        if ref_memo is not None:
+            ref_memo.clear()  # 一个连接只保留当前使用的参考音频
+            ref_memo[ref_key] = ref_features
+    prompt = ref_features["prompt"]
+    if version != "v3":
+        refers = ref_features["refers"]
+    else:
+        refer = ref_features["refer"]
+    phones1 = ref_features["phones1"]
+    bert1 = ref_features["bert1"]
+
+    t1 = time.perf_counter()
+    observe_stage("ref", t1 - t0)
+    compute_seconds = t1 - t0  # 不含等待调用方取走音频的时间, 用于计算实时率
+    audio_seconds = 0.0
     # os.environ['version'] = version
-    prompt_language = dict_language[prompt_language.lower()]
     text_language = dict_language[text_language.lower()]
-    phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
     texts = text.split("\n")
-    audio_bytes = BytesIO()
+
+    if t2s_batcher is not None:
+        # 这些参数都相同的句子才能放进同一批 (只合并 T2S, 与 speed 及辅助参考无关)
+        batch_key = (spk, id(t2s_model), ref_wav_path, prompt_text, top_k, top_p, temperature)
+        batch_context = {
+            "t2s_model": t2s_model,
+            "prompt": prompt,
+            "top_k": top_k,
+            "top_p": top_p,
+            "temperature": temperature,
+            "early_stop_num": hz * max_sec,
+        }
 
     for text in texts:
+        # 非流式输出时各句不会立即交给调用方, 在句间检查是否需要中止
+        if should_stop is not None and should_stop():
+            break
         # 简单防止纯符号引发参考音频泄露
         if only_punc(text):
             continue
 
+        t_sentence = time.perf_counter()
         audio_opt = []
         if text[-1] not in splits:
             text += "。" if text_language != "en" else "."
@@ -795,21 +1501,31 @@ def get_tts_wav(
         all_phoneme_ids = torch.LongTensor(phones1 + phones2).to(device).unsqueeze(0)
         bert = bert.to(device).unsqueeze(0)
         all_phoneme_len = torch.tensor([all_phoneme_ids.shape[-1]]).to(device)
-        t2 = ttime()
-        with torch.no_grad():
-            pred_semantic, idx = t2s_model.model.infer_panel(
-                all_phoneme_ids,
-                all_phoneme_len,
-                prompt,
-                bert,
-                # prompt_phone_len=ph_offset,
-                top_k=top_k,
-                top_p=top_p,
-                temperature=temperature,
-                early_stop_num=hz * max_sec,
-            )
-            pred_semantic = pred_semantic[:, -idx:].unsqueeze(0)
-        t3 = ttime()
+        t2 = time.perf_counter()
+        observe_stage("g2p_bert", t2 - t_sentence)
+        if t2s_batcher is not None:
+            pred_semantic = t2s_batcher.run(batch_key, batch_context, phones1 + phones2, bert[0], should_stop)
+            if pred_semantic is None:
+                break
+        else:
+            t2s_timing = {}
+            with torch.no_grad():
+                pred_semantic, idx = t2s_model.model.infer_panel(
+                    all_phoneme_ids,
+                    all_phoneme_len,
+                    prompt,
+                    bert,
+                    # prompt_phone_len=ph_offset,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    early_stop_num=hz * max_sec,
+                    timing=t2s_timing,
+                    should_stop=should_stop,
+                )
+                pred_semantic = pred_semantic[:, -idx:].unsqueeze(0)
+            observe_t2s(t2s_timing)
+        t3 = time.perf_counter()
 
         if version != "v3":
             audio = (
@@ -818,20 +1534,13 @@ def get_tts_wav(
                 .cpu()
                 .numpy()[0, 0]
             )  ###试试重建不带上prompt部分
+            observe_stage("vits", time.perf_counter() - t3)
         else:
             phoneme_ids0 = torch.LongTensor(phones1).to(device).unsqueeze(0)
             phoneme_ids1 = torch.LongTensor(phones2).to(device).unsqueeze(0)
             # print(11111111, phoneme_ids0, phoneme_ids1)
             fea_ref, ge = vq_model.decode_encp(prompt.unsqueeze(0), phoneme_ids0, refer)
-            ref_audio, sr = torchaudio.load(ref_wav_path)
-            ref_audio = ref_audio.to(device).float()
-            if ref_audio.shape[0] == 2:
-                ref_audio = ref_audio.mean(0).unsqueeze(0)
-            if sr != 24000:
-                ref_audio = resample(ref_audio, sr)
-            # print("ref_audio",ref_audio.abs().mean())
-            mel2 = mel_fn(ref_audio)
-            mel2 = norm_spec(mel2)
+            mel2 = ref_features["mel2"]
             T_min = min(mel2.shape[2], fea_ref.shape[2])
             mel2 = mel2[:, :, :T_min]
             fea_ref = fea_ref[:, :, :T_min]
@@ -866,11 +1575,15 @@ def get_tts_wav(
                 cfm_resss.append(cfm_res)
             cmf_res = torch.cat(cfm_resss, 2)
             cmf_res = denorm_spec(cmf_res)
+            sync_device()
+            observe_stage("cfm", time.perf_counter() - t3)
             if bigvgan_model == None:
                 init_bigvgan()
+            t_vocoder = time.perf_counter()
             with torch.inference_mode():
                 wav_gen = bigvgan_model(cmf_res)
                 audio = wav_gen[0][0].cpu().detach().numpy()
+            observe_stage("vocoder", time.perf_counter() - t_vocoder)
 
         max_audio = np.abs(audio).max()
         if max_audio > 1:
@@ -878,32 +1591,29 @@ def get_tts_wav(
         audio_opt.append(audio)
         audio_opt.append(zero_wav)
         audio_opt = np.concatenate(audio_opt, 0)
-        t4 = ttime()
 
         sr = hps.data.sampling_rate if version != "v3" else 24000
         if if_sr and sr == 24000:
+            t_sr = time.perf_counter()
             audio_opt = torch.from_numpy(audio_opt).float().to(device)
             audio_opt, sr = audio_sr(audio_opt.unsqueeze(0), sr)
             max_audio = np.abs(audio_opt).max()
             if max_audio > 1:
                 audio_opt /= max_audio
             sr = 48000
+            observe_stage("sr", time.perf_counter() - t_sr)
+        compute_seconds += time.perf_counter() - t_sentence
+        audio_seconds += audio_opt.shape[0] / sr
 
         if is_int32:
-            audio_bytes = pack_audio(audio_bytes, (audio_opt * 2147483647).astype(np.int32), sr)
+            yield from output.write((audio_opt * 2147483647).astype(np.int32), sr)
         else:
-            audio_bytes = pack_audio(audio_bytes, (audio_opt * 32768).astype(np.int16), sr)
-        # logger.info("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t3 - t2, t4 - t3))
-        if stream_mode == "normal":
-            audio_bytes, audio_chunk = read_clean_buffer(audio_bytes)
-            yield audio_chunk
+            yield from output.write((audio_opt * 32768).astype(np.int16), sr)
 
-    if not stream_mode == "normal":
-        if media_type == "wav":
-            sr = 48000 if if_sr else 24000
-            sr = hps.data.sampling_rate if version != "v3" else sr
-            audio_bytes = pack_wav(audio_bytes, sr)
-        yield audio_bytes.getvalue()
+    observe_synthesis(compute_seconds, audio_seconds)
+    sr = 48000 if if_sr else 24000
+    sr = hps.data.sampling_rate if version != "v3" else sr
+    return sr
 
 
 def handle_control(command):
@@ -914,6 +1624,18 @@ def handle_control(command):
         exit(0)
 
 
+def handle_ref_cache(command, path=None):
+    if command is None or command == "stats":
+        return JSONResponse({"code": 0, **ref_cache.stats()}, status_code=200)
+    if command == "clear":
+        return JSONResponse({"code": 0, "removed": ref_cache.clear()}, status_code=200)
+    if command == "evict":
+        if is_empty(path):
+            return JSONResponse({"code": 400, "message": "缺少参数: refer_wav_path"}, status_code=400)
+        return JSONResponse({"code": 0, "removed": ref_cache.evict(path)}, status_code=200)
+    return JSONResponse({"code": 400, "message": f"未知命令: {command}"}, status_code=400)
+
+
 def handle_change(path, text, language):
     if is_empty(path, text, language):
         return JSONResponse(
@@ -935,7 +1657,310 @@ def handle_change(path, text, language):
     return JSONResponse({"code": 0, "message": "Success"}, status_code=200)
 
 
-def handle(
+class QueueFullError(Exception):
+    pass
+
+
+# 已开始返回音频的请求计为 200, 之后的超时或出错只会让音频流提前结束
+requests_total = REGISTRY.counter("tts_requests_total", "合成请求数 (WebSocket 按句计)", ["endpoint", "code"])
+
+
+class SynthesisScheduler:
+    """
+    合成调度: 推理在有界线程池中执行, 不占用事件循环, 合成期间其他接口照常响应。
+    排队与执行中的请求数超过上限时拒绝新请求 (429); 每个请求有超时;
+    音频块经 asyncio.Queue 从工作线程送到响应流, 队列满时工作线程等待, 推理随客户端消费速度放缓。
+    """
+
+    def __init__(self, workers, max_queue, max_timeout=None, chunk_buffer=4):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.max_timeout = max_timeout  # 服务端的超时上限, None 表示不限
+        self.chunk_buffer = chunk_buffer
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tts")
+        self.active = 0  # 排队中与执行中的请求数, 只在事件循环线程中修改
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    def limit_timeout(self, timeout):
+        """请求给出的超时不能超过服务端上限; 不给、0 或负数时使用上限"""
+        timeout = float(timeout) if timeout is not None else 0
+        if timeout <= 0:
+            return self.max_timeout
+        return timeout if self.max_timeout is None else min(timeout, self.max_timeout)
+
+    async def submit(self, make_generator, timeout=None, on_finish=None):
+        """
+        在线程池中运行 make_generator(should_stop) 返回的同步生成器, 返回音频块的异步迭代器。
+        should_stop() 在请求超时或客户端断开后返回 True, 生成器应在推理中途检查并尽快结束。
+        会先等到第一个音频块: 排队超时或推理出错时直接抛出, 由调用方返回错误码而不是中断的音频流。
+        on_finish: 工作线程结束 (包括超时或取消后收尾完毕) 时在事件循环线程中调用; 抛出 QueueFullError 时不会调用。
+        """
+        timeout = self.limit_timeout(timeout)
+        if self.active >= self.capacity:
+            raise QueueFullError()
+        self.active += 1
+
+        loop = asyncio.get_running_loop()
+        channel = asyncio.Queue(maxsize=self.chunk_buffer)
+        cancelled = threading.Event()  # 超时或客户端断开
+        deadline = loop.time() + timeout if timeout is not None else None
+
+        def put(item):
+            # 工作线程中调用; 返回 False 表示请求已取消
+            future = asyncio.run_coroutine_threadsafe(channel.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except FutureTimeoutError:
+                    if cancelled.is_set():
+                        future.cancel()
+                        return False
+
+        def work():
+            if cancelled.is_set():
+                return  # 排队期间已超时
+            try:
+                generator = make_generator(cancelled.is_set)
+                try:
+                    for chunk in generator:
+                        if cancelled.is_set() or not put(("chunk", chunk)):
+                            return
+                finally:
+                    generator.close()
+                put(("end", None))
+            except Exception as e:
+                logger.exception("合成出错")
+                put(("error", e))
+
+        def release(_):
+            self.active -= 1
+            if on_finish is not None:
+                on_finish()
+
+        loop.run_in_executor(self.executor, work).add_done_callback(release)
+
+        async def receive():
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError()
+            return await asyncio.wait_for(channel.get(), remaining)
+
+        try:
+            kind, payload = await receive()
+        except BaseException:
+            cancelled.set()
+            raise
+        if kind == "error":
+            raise payload
+
+        async def stream():
+            nonlocal kind, payload
+            try:
+                while kind == "chunk":
+                    yield payload
+                    kind, payload = await receive()
+                if kind == "error":
+                    logger.error(f"流式合成中途出错: {payload}")
+            except asyncio.TimeoutError:
+                logger.warning("请求超时, 中止合成")
+            finally:
+                cancelled.set()
+
+        return stream()
+
+
+# WebSocket 未指定 cut_punc 时按句末标点断句
+ws_sentence_punc = "。！？；…!?;\n"
+ws_max_sentence = 200  # 缓冲区超过这么多字仍没有标点时强制断句
+ws_pending_sentences = 4  # 每个连接排队等待合成的句子上限
+
+
+def split_sentences(buffer, punc):
+    """从缓冲区中取出以 punc 中标点结尾的完整句子, 返回 (句子列表, 剩余文本)"""
+    pattern = "[" + re.escape(punc) + "]+"
+    sentences = []
+    start = 0
+    for match in re.finditer(pattern, buffer):
+        sentences.append(buffer[start : match.end()])
+        start = match.end()
+    rest = buffer[start:]
+    while len(rest) > ws_max_sentence:
+        sentences.append(rest[:ws_max_sentence])
+        rest = rest[ws_max_sentence:]
+    return [s.strip() for s in sentences if not only_punc(s)], rest
+
+
+async def ws_synthesize(websocket: WebSocket):
+    """WebSocket 流式合成, 协议见文件开头的说明"""
+    await websocket.accept()
+    if not startup.ready.is_set():
+        await websocket.send_json({"event": "error", "code": 503, "message": startup.message()})
+        await websocket.close()
+        return
+    try:
+        config = await websocket.receive_json()
+        if not isinstance(config, dict):
+            raise ValueError("第一条消息须为 JSON 对象")
+        spk = config.get("spk") or "default"
+        refer_wav_path, prompt_text, prompt_language = resolve_refer(
+            spk, config.get("refer_wav_path"), config.get("prompt_text"), config.get("prompt_language")
+        )
+        fmt = config.get("format", "wav")
+        if fmt not in STREAM_FORMATS:
+            raise ValueError(f"不支持的音频格式: {fmt}")
+        window = max(0, int(config.get("window", 0)))
+        timeout = scheduler.limit_timeout(config.get("timeout"))
+    except WebSocketDisconnect:
+        return
+    except (ValueError, TypeError, KeyError) as e:
+        # 非法 JSON、二进制消息或参数类型错误
+        await websocket.send_json({"event": "error", "code": 400, "message": f"配置消息无效: {e}"})
+        await websocket.close()
+        return
+
+    text_language = config.get("text_language", "zh")
+    punc = config.get("cut_punc") or ws_sentence_punc
+    sample_steps = config.get("sample_steps", 32)
+    params = dict(
+        top_k=config.get("top_k", 15),
+        top_p=config.get("top_p", 1.0),
+        temperature=config.get("temperature", 1.0),
+        speed=config.get("speed", 1.0),
+        inp_refs=config.get("inp_refs", []),
+        sample_steps=sample_steps if sample_steps in [4, 8, 16, 32] else 32,
+        if_sr=config.get("if_sr", False),
+        spk=spk,
+    )
+
+    output = ResponseAudio(stream=True, fmt=fmt)  # 整个连接共用一个音频流
+    ref_memo = {}  # 整个连接共用参考音频特征
+    sentences = asyncio.Queue(maxsize=ws_pending_sentences)
+    acked = 0
+    ack_changed = asyncio.Event()
+
+    async def receive():
+        # 持续读取到连接断开: end 之后仍要接收 ack
+        nonlocal acked
+        buffer = ""
+        ended = False
+        while True:
+            message = await websocket.receive_json()
+            event = message.get("event")
+            if event == "ack":
+                acked = max(acked, int(message.get("seq", 0)))
+                ack_changed.set()
+            if ended:
+                continue
+            if "text" in message:
+                buffer += message["text"]
+                ready, buffer = split_sentences(buffer, punc)
+                for sentence in ready:
+                    await sentences.put(sentence)  # 队列满时暂停读取, 由 TCP 反压客户端
+            if event in ("flush", "end") and not only_punc(buffer):
+                await sentences.put(buffer.strip())
+                buffer = ""
+            if event == "end":
+                ended = True
+                await sentences.put(None)
+
+    receiver = asyncio.create_task(receive())
+
+    async def wait_receiver(awaitable):
+        """等待 awaitable, 期间客户端断开或消息出错时抛出对应异常"""
+        task = asyncio.ensure_future(awaitable)
+        await asyncio.wait([task, receiver], return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            task.cancel()
+            receiver.result()
+        return task.result()
+
+    seq = 0
+    sample_rate = None
+    try:
+        while True:
+            sentence = await wait_receiver(sentences.get())
+            if sentence is None:
+                break
+            seq += 1
+            while window and seq - acked > window:
+                ack_changed.clear()
+                await wait_receiver(ack_changed.wait())
+
+            await websocket.send_json({"event": "sentence", "seq": seq, "text": sentence})
+            worker_done = asyncio.Event()
+            code, message = 200, None
+            try:
+                audio_stream = await scheduler.submit(
+                    lambda should_stop: get_tts_wav(
+                        refer_wav_path,
+                        prompt_text,
+                        prompt_language,
+                        sentence,
+                        text_language,
+                        output=output,
+                        ref_memo=ref_memo,
+                        should_stop=should_stop,
+                        **params,
+                    ),
+                    timeout=timeout,
+                    on_finish=worker_done.set,
+                )
+                try:
+                    async for chunk in audio_stream:
+                        await websocket.send_bytes(bytes(chunk))
+                finally:
+                    await audio_stream.aclose()  # 发送失败时立即通知工作线程停止
+            except QueueFullError:
+                code, message = 429, "合成队列已满"
+                worker_done.set()  # 没有进入线程池
+            except asyncio.TimeoutError:
+                code, message = 504, "合成超时"
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                code, message = 400, str(e)
+            # 各句共用一个编码器: 超时或出错的句子的工作线程可能还在写入, 等它收尾后才开始下一句
+            await wait_receiver(worker_done.wait())
+            requests_total.inc(endpoint="ws", code=str(code))
+            if message is not None:
+                await websocket.send_json({"event": "error", "seq": seq, "code": code, "message": message})
+                continue
+            sample_rate = output.sample_rate or sample_rate
+            await websocket.send_json({"event": "sentence_end", "seq": seq})
+
+        if sample_rate is not None:
+            for chunk in output.close(sample_rate):
+                await websocket.send_bytes(bytes(chunk))
+        await websocket.send_json({"event": "end"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info("WebSocket 客户端已断开")
+    finally:
+        receiver.cancel()
+        if receiver.done() and not receiver.cancelled():
+            receiver.exception()  # 连接关闭后读取失败是预期内的
+        output.abort()
+
+
+def resolve_refer(spk, refer_wav_path, prompt_text, prompt_language):
+    """请求未给全参考音频时, 依次使用说话人配置与默认参考音频; 都没有时抛出 ValueError"""
+    if spk not in speaker_registry.specs:
+        raise ValueError(f"未注册的说话人: {spk}")
+    if is_full(refer_wav_path, prompt_text, prompt_language):
+        return refer_wav_path, prompt_text, prompt_language
+    speaker_refer = speaker_registry.refer_of(spk)
+    if speaker_refer is not None:
+        return speaker_refer
+    if not default_refer.is_ready():
+        raise ValueError("未指定参考音频且接口无预设")
+    return default_refer.path, default_refer.text, default_refer.language
+
+
+async def handle(
     refer_wav_path,
     prompt_text,
     prompt_language,
@@ -949,22 +1974,18 @@ def handle(
     inp_refs,
     sample_steps,
     if_sr,
+    timeout=None,
+    spk=None,
 ):
-    if (
-        refer_wav_path == ""
-        or refer_wav_path is None
-        or prompt_text == ""
-        or prompt_text is None
-        or prompt_language == ""
-        or prompt_language is None
-    ):
-        refer_wav_path, prompt_text, prompt_language = (
-            default_refer.path,
-            default_refer.text,
-            default_refer.language,
-        )
-        if not default_refer.is_ready():
-            return JSONResponse({"code": 400, "message": "未指定参考音频且接口无预设"}, status_code=400)
+    if not startup.ready.is_set():
+        requests_total.inc(endpoint="http", code="503")
+        return not_ready_response()
+    spk = spk or "default"
+    try:
+        refer_wav_path, prompt_text, prompt_language = resolve_refer(spk, refer_wav_path, prompt_text, prompt_language)
+    except ValueError as e:
+        requests_total.inc(endpoint="http", code="400")
+        return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
 
     if sample_steps not in [4, 8, 16, 32]:
         sample_steps = 32
@@ -974,23 +1995,40 @@ def handle(
     else:
         text = cut_text(text, cut_punc)
 
-    return StreamingResponse(
-        get_tts_wav(
-            refer_wav_path,
-            prompt_text,
-            prompt_language,
-            text,
-            text_language,
-            top_k,
-            top_p,
-            temperature,
-            speed,
-            inp_refs,
-            sample_steps,
-            if_sr,
-        ),
-        media_type="audio/" + media_type,
-    )
+    try:
+        audio_stream = await scheduler.submit(
+            lambda should_stop: get_tts_wav(
+                refer_wav_path,
+                prompt_text,
+                prompt_language,
+                text,
+                text_language,
+                top_k,
+                top_p,
+                temperature,
+                speed,
+                inp_refs,
+                sample_steps,
+                if_sr,
+                spk,
+                should_stop=should_stop,
+            ),
+            timeout=timeout,
+        )
+    except QueueFullError:
+        requests_total.inc(endpoint="http", code="429")
+        return JSONResponse(
+            {"code": 429, "message": "合成队列已满, 请稍后重试"}, status_code=429, headers={"Retry-After": "1"}
+        )
+    except asyncio.TimeoutError:
+        requests_total.inc(endpoint="http", code="504")
+        return JSONResponse({"code": 504, "message": "合成超时"}, status_code=504)
+    except Exception as e:
+        requests_total.inc(endpoint="http", code="400")
+        return JSONResponse({"code": 400, "message": str(e)}, status_code=400)
+
+    requests_total.inc(endpoint="http", code="200")
+    return StreamingResponse(audio_stream, media_type=CONTENT_TYPES[media_type])
 
 
 # --------------------------------
@@ -1048,12 +2086,23 @@ parser.add_argument(
 # bool值的用法为 `python ./api.py -fp ...`
 # 此时 full_precision==True, half_precision==False
 parser.add_argument("-sm", "--stream_mode", type=str, default="close", help="流式返回模式, close / normal / keepalive")
-parser.add_argument("-mt", "--media_type", type=str, default="wav", help="音频编码格式, wav / ogg / aac")
+parser.add_argument("-mt", "--media_type", type=str, default="", help="音频编码格式, wav / ogg / opus / aac / mp3")
 parser.add_argument("-st", "--sub_type", type=str, default="int16", help="音频数据类型, int16 / int32")
 parser.add_argument("-cp", "--cut_punc", type=str, default="", help="文本切分符号设定, 符号范围,.;?!、，。？！；：…")
 # 切割常用分句符为 `python ./api.py -cp ".?!。？！"`
 parser.add_argument("-hb", "--hubert_path", type=str, default=g_config.cnhubert_path, help="覆盖config.cnhubert_path")
 parser.add_argument("-b", "--bert_path", type=str, default=g_config.bert_path, help="覆盖config.bert_path")
+parser.add_argument("-e", "--engine", type=str, default="tts", choices=["tts", "legacy"], help="推理引擎")
+parser.add_argument("-bs", "--batch_size", type=int, default=1, help="tts 引擎每批推理的句子数")
+parser.add_argument("-w", "--workers", type=int, default=1, help="合成工作线程数")
+parser.add_argument("-mq", "--max_queue", type=int, default=8, help="排队请求数上限, 超出时返回 429")
+parser.add_argument("-to", "--timeout", type=float, default=300, help="单个请求的超时秒数, 0 表示不限")
+parser.add_argument("-bw", "--batch_window", type=float, default=0, help="跨请求微批处理的等待窗口(毫秒), 0 表示不启用")
+parser.add_argument("-mb", "--max_batch", type=int, default=8, help="微批处理的最大 batch")
+parser.add_argument("-rc", "--ref_cache", type=int, default=16, help="参考音频特征缓存条数, 0 表示不缓存")
+parser.add_argument("-spk", "--speakers", type=str, default="", help="说话人配置 json 路径")
+parser.add_argument("-mm", "--model_memory", type=float, default=0, help="说话人模型内存预算(MB), 0 表示不限")
+parser.add_argument("-nw", "--no_warmup", action="store_true", default=False, help="跳过启动时的预热合成")
 
 args = parser.parse_args()
 sovits_path = args.sovits_path
@@ -1064,6 +2113,7 @@ host = args.bind_addr
 cnhubert_base_path = args.hubert_path
 bert_path = args.bert_path
 default_cut_punc = args.cut_punc
+default_timeout = args.timeout if args.timeout > 0 else None
 
 # 应用参数配置
 default_refer = DefaultRefer(args.default_refer_path, args.default_refer_text, args.default_refer_language)
@@ -1103,7 +2153,7 @@ else:
     stream_mode = "close"
 
 # 音频编码格式
-if args.media_type.lower() in ["aac", "ogg"]:
+if args.media_type.lower() in STREAM_FORMATS:
     media_type = args.media_type.lower()
 elif stream_mode == "close":
     media_type = "wav"
@@ -1119,18 +2169,173 @@ else:
     is_int32 = False
     logger.info("数据类型: int16")
 
-# 初始化模型
-cnhubert.cnhubert_base_path = cnhubert_base_path
-tokenizer = AutoTokenizer.from_pretrained(bert_path)
-bert_model = AutoModelForMaskedLM.from_pretrained(bert_path)
-ssl_model = cnhubert.get_model()
-if is_half:
-    bert_model = bert_model.half().to(device)
-    ssl_model = ssl_model.half().to(device)
-else:
-    bert_model = bert_model.to(device)
-    ssl_model = ssl_model.to(device)
-change_gpt_sovits_weights(gpt_path=gpt_path, sovits_path=sovits_path)
+# 推理引擎
+engine = args.engine
+engine_batch_size = max(1, args.batch_size)
+logger.info(f"推理引擎: {engine}")
+
+# 初始化模型: 模型本身在 warm_start 中并行加载
+@model_load("bert")
+def load_bert():
+    global tokenizer, bert_model
+    tokenizer = AutoTokenizer.from_pretrained(bert_path)
+    model = AutoModelForMaskedLM.from_pretrained(bert_path)
+    bert_model = model.half().to(device) if is_half else model.to(device)
+
+
+@model_load("cnhubert")
+def load_cnhubert():
+    global ssl_model
+    cnhubert.cnhubert_base_path = cnhubert_base_path
+    model = cnhubert.get_model()
+    ssl_model = model.half().to(device) if is_half else model.to(device)
+
+
+if engine != "legacy":
+    from model_cache import ModelCache
+
+    # 容量由 SpeakerRegistry 按 -mm 预算管理, ModelCache 自身不按数量淘汰
+    model_cache = ModelCache(max_models=sys.maxsize)
+    model_cache.set_device(device)
+    model_cache.is_half = is_half
+    model_cache.cnhuhbert_base_path = cnhubert_base_path
+    model_cache.bert_base_path = bert_path
+model_cache_lock = threading.Lock()
+ref_cache = RefFeatureCache(args.ref_cache)
+speaker_registry = SpeakerRegistry(args.model_memory)
+speaker_registry.register("default", gpt_path, sovits_path)
+if args.speakers:
+    speaker_registry.load_file(args.speakers)
+
+scheduler = SynthesisScheduler(args.workers, args.max_queue, default_timeout)
+logger.info(f"合成工作线程: {scheduler.workers}, 排队上限: {scheduler.max_queue}, 超时: {default_timeout}")
+t2s_batcher = None
+if args.batch_window > 0:
+    if engine == "legacy":
+        t2s_batcher = T2SBatcher(args.batch_window, args.max_batch)
+    else:
+        logger.warning("-bw 微批处理只对 legacy 引擎生效, tts 引擎请用 -bs 设置每批句子数")
+if t2s_batcher is not None:
+    if scheduler.workers == 1:
+        logger.warning("微批处理需要多个合成工作线程 (-w) 才能凑批")
+    logger.info(f"微批处理: 窗口 {args.batch_window}ms, 最大 batch {t2s_batcher.max_batch}")
+
+
+def cache_counts():
+    """{缓存名: (命中, 未命中)}"""
+    counts = {"ref": (ref_cache.hits, ref_cache.misses)}
+    if engine != "legacy":
+        counts["model"] = (model_cache.cache_hits, model_cache.cache_misses)
+    return counts
+
+
+def hit_ratio(hits, misses):
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+REGISTRY.callback("tts_requests_in_flight", "gauge", "排队与执行中的合成请求数", lambda: scheduler.active)
+REGISTRY.callback("tts_queue_capacity", "gauge", "合成工作线程数与排队上限之和", lambda: scheduler.capacity)
+REGISTRY.callback("tts_speakers_loaded", "gauge", "已加载的说话人数", lambda: len(speaker_list))
+REGISTRY.callback(
+    "tts_cache_hits_total", "counter", "缓存命中次数", lambda: {k: v[0] for k, v in cache_counts().items()}, ["cache"]
+)
+REGISTRY.callback(
+    "tts_cache_misses_total", "counter", "缓存未命中次数", lambda: {k: v[1] for k, v in cache_counts().items()}, ["cache"]
+)
+REGISTRY.callback(
+    "tts_cache_hit_ratio", "gauge", "缓存命中率", lambda: {k: hit_ratio(*v) for k, v in cache_counts().items()}, ["cache"]
+)
+
+
+class StartupState:
+    """启动进度: loading (并行加载模型) -> warmup (预热合成) -> ready; 出错时为 failed"""
+
+    def __init__(self):
+        self.phase = "loading"
+        self.error = None
+        self.timings = {"init": time.perf_counter() - startup_begin}  # 阶段 -> 秒
+        self.ready = threading.Event()
+
+    def message(self):
+        if self.error is not None:
+            return f"启动失败: {self.error}"
+        return "服务预热中, 请稍后重试"
+
+
+# 预热合成的文本, 按默认参考音频的语种选取; 混合语种按中文处理
+warmup_texts = {
+    "zh": "这是一句预热语音。",
+    "yue": "这是一句预热语音。",
+    "en": "This is a warm up sentence.",
+    "ja": "これはウォームアップの音声です。",
+    "ko": "이것은 예열 음성입니다.",
+}
+
+
+def warm_up():
+    """
+    用 "default" 说话人合成一句短文本, 触发 G2P 词典、参考音频特征、T2S/声码器的 kernel 选择与编码器等
+    首次调用才会发生的初始化; 没有可用的参考音频时跳过, 返回是否执行了预热
+    """
+    try:
+        refer_wav_path, prompt_text, prompt_language = resolve_refer("default", None, None, None)
+    except ValueError:
+        logger.info("没有默认参考音频, 跳过预热合成")
+        return False
+    language = dict_language[prompt_language.lower()]
+    text = warmup_texts.get(language.replace("all_", ""), warmup_texts["zh"])
+    for _ in get_tts_wav(refer_wav_path, prompt_text, prompt_language, text, language, spk="default"):
+        pass
+    return True
+
+
+def warm_start():
+    """后台线程中执行: 并行加载互不依赖的模型, 再合成一句预热, 之后 /ready 才返回 200"""
+    try:
+        tasks = {"speaker:default": lambda: speaker_registry.release(speaker_registry.acquire("default"))}
+        if engine == "legacy":
+            tasks["bert"] = load_bert
+            tasks["cnhubert"] = load_cnhubert
+            if get_sovits_version_from_path_fast(sovits_path)[1] == "v3":
+                tasks["bigvgan"] = init_bigvgan  # 与 SoVITS 权重同时加载, get_sovits_weights 中不再等待
+
+        def timed(fn):
+            start = time.perf_counter()
+            fn()
+            return time.perf_counter() - start
+
+        load_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="warm-start") as pool:
+            futures = {name: pool.submit(timed, fn) for name, fn in tasks.items()}
+            for name, future in futures.items():
+                startup.timings[name] = future.result()
+        startup.timings["load"] = time.perf_counter() - load_start
+
+        if not args.no_warmup:
+            startup.phase = "warmup"
+            warmup_start = time.perf_counter()
+            if warm_up():
+                startup.timings["warmup"] = time.perf_counter() - warmup_start
+        startup.timings["total"] = time.perf_counter() - startup_begin
+        startup.phase = "ready"
+        startup.ready.set()
+        logger.info("启动完成: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup.timings.items()))
+    except Exception as e:
+        startup.phase = "failed"
+        startup.error = str(e)
+        logger.exception("启动失败")
+
+
+def not_ready_response():
+    return JSONResponse(
+        {"code": 503, "message": startup.message(), "phase": startup.phase},
+        status_code=503,
+        headers={"Retry-After": "5"},
+    )
+
+
+startup = StartupState()
+threading.Thread(target=warm_start, name="warm-start", daemon=True).start()
 
 
 # --------------------------------
@@ -1141,9 +2346,16 @@ app = FastAPI()
 
 @app.post("/set_model")
 async def set_model(request: Request):
+    if not startup.ready.is_set():
+        return not_ready_response()
     json_post_raw = await request.json()
-    return change_gpt_sovits_weights(
-        gpt_path=json_post_raw.get("gpt_model_path"), sovits_path=json_post_raw.get("sovits_model_path")
+    # 加载权重较慢, 放到线程中执行以免阻塞事件循环
+    return await asyncio.get_running_loop().run_in_executor(
+        None,
+        change_gpt_sovits_weights,
+        json_post_raw.get("gpt_model_path"),
+        json_post_raw.get("sovits_model_path"),
+        json_post_raw.get("spk"),
     )
 
 
@@ -1151,8 +2363,47 @@ async def set_model(request: Request):
 async def set_model(
     gpt_model_path: str = None,
     sovits_model_path: str = None,
+    spk: str = None,
 ):
-    return change_gpt_sovits_weights(gpt_path=gpt_model_path, sovits_path=sovits_model_path)
+    if not startup.ready.is_set():
+        return not_ready_response()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, change_gpt_sovits_weights, gpt_model_path, sovits_model_path, spk
+    )
+
+
+@app.websocket("/ws")
+async def ws_endpoint(websocket: WebSocket):
+    await ws_synthesize(websocket)
+
+
+@app.get("/healthz")
+async def healthz():
+    if startup.error is not None:
+        return JSONResponse({"status": "failed", "error": startup.error}, status_code=503)
+    return JSONResponse({"status": "ok", "phase": startup.phase}, status_code=200)
+
+
+@app.get("/ready")
+async def ready():
+    return JSONResponse(
+        {
+            "ready": startup.ready.is_set(),
+            "phase": startup.phase,
+            "timings": {name: round(seconds, 3) for name, seconds in startup.timings.items()},
+        },
+        status_code=200 if startup.ready.is_set() else 503,
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/speakers")
+async def speakers():
+    return JSONResponse({"code": 0, "speakers": speaker_registry.stats()}, status_code=200)
 
 
 @app.post("/control")
@@ -1166,6 +2417,17 @@ async def control(command: str = None):
     return handle_control(command)
 
 
+@app.get("/ref_cache")
+async def ref_cache_stats():
+    return handle_ref_cache("stats")
+
+
+@app.post("/ref_cache")
+async def ref_cache_manage(request: Request):
+    json_post_raw = await request.json()
+    return handle_ref_cache(json_post_raw.get("command"), json_post_raw.get("refer_wav_path"))
+
+
 @app.post("/change_refer")
 async def change_refer(request: Request):
     json_post_raw = await request.json()
@@ -1182,7 +2444,7 @@ async def change_refer(refer_wav_path: str = None, prompt_text: str = None, prom
 @app.post("/")
 async def tts_endpoint(request: Request):
     json_post_raw = await request.json()
-    return handle(
+    return await handle(
         json_post_raw.get("refer_wav_path"),
         json_post_raw.get("prompt_text"),
         json_post_raw.get("prompt_language"),
@@ -1196,6 +2458,8 @@ async def tts_endpoint(request: Request):
         json_post_raw.get("inp_refs", []),
         json_post_raw.get("sample_steps", 32),
         json_post_raw.get("if_sr", False),
+        json_post_raw.get("timeout"),
+        json_post_raw.get("spk"),
     )
 
 
@@ -1214,8 +2478,10 @@ async def tts_endpoint(
     inp_refs: list = Query(default=[]),
     sample_steps: int = 32,
     if_sr: bool = False,
+    timeout: float = None,
+    spk: str = None,
 ):
-    return handle(
+    return await handle(
         refer_wav_path,
         prompt_text,
         prompt_language,
@@ -1229,6 +2495,8 @@ async def tts_endpoint(
         inp_refs,
         sample_steps,
         if_sr,
+        timeout,
+        spk,
     )
 
 
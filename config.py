@@ -101,6 +101,27 @@ class V4Config:
         'text_lang': 'all_zh',
     }
     
+    # 草稿试听模式参数（低音质，仅用于快速校听）
+    # 只降低 CFM 采样步数并关闭超分；T2S 的解码方式（parallel_infer）沿用预设，不改变语义 token
+    DRAFT_PARAMS = {
+        'sample_steps': 4,
+        'if_sr': False,
+    }
+    
+    # 推理后端: 'torch'(eager) / 'torchscript' / 'onnx'
+    # 导出产物由 GPT_SoVITS/export_torch_script_v4.py 生成，缺失或与权重不匹配时自动回退 eager
+    INFERENCE_BACKEND = 'torch'
+    EXPORTED_MODELS_DIR = 'GPT_SoVITS/exported/v4'
+    
+    # CPU int8 动态量化: 'none' / 'int8'（T2S、DiT、BERT 线性层），量化结果缓存在磁盘
+    QUANTIZATION = 'none'
+    
+    # CPU 线程划分: 同机运行 CPU_WORKERS 个合成进程时按核心切分（见 cpu_threads.py）
+    # CPU_THREADS_PER_WORKER = 0 表示 可用核心数 // CPU_WORKERS；CPU_PIN_CORES 为 True 时把进程绑定到分到的核心
+    CPU_WORKERS = 1
+    CPU_THREADS_PER_WORKER = 0
+    CPU_PIN_CORES = True
+    
     # v4版本新特性
     FEATURES = {
         'native_48k': True,
@@ -0,0 +1,117 @@
+"""
+CPU 线程与核心绑定配置
+
+同一台机器上运行多个合成进程时，torch / MKL / OMP / onnxruntime 默认都会按全部核心开线程，
+N 个进程叠加后严重超订。这里把可用核心切分给各个合成进程：每个进程绑定到自己的核心，
+并把各线程池限制为分到的核心数。
+
+用法：在每个合成进程加载模型之前调用
+    apply_worker_threads(plan_workers(num_workers, threads_per_worker)[worker_index])
+或按 config.V4Config 的 CPU_* 配置调用 configure_from_config(worker_index)。
+由一个协调进程启动各合成进程时（synthesis_farm），在协调进程中调用 plan_workers 并把各自的
+WorkerThreads 传给子进程：子进程继承父进程的核心绑定，协调进程自身不要调用 apply_worker_threads。
+"""
+
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 各数学库读取的线程数环境变量（需在对应库初始化线程池之前设置，子进程会继承）
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+]
+# onnxruntime 会话的 intra-op 线程数（G2PW、导出的 ONNX 模型读取），未设置时各自使用默认值
+ORT_THREADS_ENV = "GPT_SOVITS_ORT_THREADS"
+
+
+@dataclass
+class WorkerThreads:
+    """单个合成进程分到的核心与线程数"""
+
+    index: int
+    cores: List[int] = field(default_factory=list)
+    threads: int = 1
+    interop_threads: int = 1
+
+
+def available_cores() -> List[int]:
+    """当前进程允许使用的 CPU 核心编号"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(num_workers: int, threads_per_worker: int = 0, cores: Optional[List[int]] = None) -> List[WorkerThreads]:
+    """
+    把核心切分给 num_workers 个合成进程。
+
+    Args:
+        num_workers: 合成进程数
+        threads_per_worker: 每个进程的线程数，0 表示 可用核心数 // num_workers
+        cores: 参与切分的核心，默认为当前进程可用的全部核心
+    """
+    num_workers = max(1, num_workers)
+    cores = cores if cores is not None else available_cores()
+    threads = threads_per_worker if threads_per_worker > 0 else max(1, len(cores) // num_workers)
+    if threads * num_workers > len(cores):
+        logger.warning(
+            f"{num_workers} 个进程 × {threads} 线程超过可用核心数 {len(cores)}，部分核心将被多个进程共用"
+        )
+
+    plans = []
+    for index in range(num_workers):
+        worker_cores = [cores[(index * threads + i) % len(cores)] for i in range(threads)]
+        plans.append(WorkerThreads(index=index, cores=sorted(set(worker_cores)), threads=threads))
+    return plans
+
+
+def apply_worker_threads(plan: WorkerThreads, pin: bool = True):
+    """在当前进程中应用线程划分：环境变量、核心绑定、torch 线程池"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(plan.threads)
+    os.environ[ORT_THREADS_ENV] = str(plan.threads)
+
+    if pin and plan.cores:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, plan.cores)
+        else:
+            logger.warning("当前平台不支持核心绑定，只限制线程数")
+
+    import torch
+
+    torch.set_num_threads(plan.threads)
+    try:
+        torch.set_num_interop_threads(plan.interop_threads)
+    except RuntimeError:
+        # inter-op 线程池在首次并行计算后不能再修改
+        logger.warning("torch inter-op 线程池已初始化，保持原设置")
+
+    logger.info(
+        f"合成进程 {plan.index}: {plan.threads} 线程, "
+        f"核心 {plan.cores if pin else '不绑定'}, inter-op {torch.get_num_interop_threads()}"
+    )
+
+
+def configure_from_config(worker_index: int = 0, num_workers: Optional[int] = None, threads_per_worker: Optional[int] = None):
+    """
+    按 V4Config 的 CPU_WORKERS / CPU_THREADS_PER_WORKER / CPU_PIN_CORES 配置当前进程，参数非 None 时覆盖配置。
+    单进程且未指定线程数时保持库的默认行为，不做任何修改。
+    """
+    from config import V4Config
+
+    num_workers = V4Config.CPU_WORKERS if num_workers is None else num_workers
+    threads_per_worker = V4Config.CPU_THREADS_PER_WORKER if threads_per_worker is None else threads_per_worker
+    if num_workers <= 1 and threads_per_worker <= 0:
+        return None
+
+    plan = plan_workers(num_workers, threads_per_worker)[worker_index % max(1, num_workers)]
+    apply_worker_threads(plan, pin=V4Config.CPU_PIN_CORES)
+    return plan
+
@@ -1,7 +1,7 @@
 import os
 import torch
 import numpy as np
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 import logging
 from pathlib import Path
 import shutil
@@ -19,6 +19,8 @@ sys.path.append(current_dir)
 from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
 from GPT_SoVITS.AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from model_cache import get_global_model_cache
+from config import V4Config
+from seeding import segment_seed
 
 logging.basicConfig(level=logging.WARNING)  # 只显示警告和错误
 logger = logging.getLogger(__name__)
@@ -185,7 +187,11 @@ class GPTSoVITS:
             logger.error(f"设置预设时发生错误: {str(e)}")
             return False
 
-    def _prepare_tts_inputs(self, text: str, speed_factor: float = None, emotion: str = None) -> dict:
+    def is_draft_mode(self) -> bool:
+        """当前预设是否开启草稿试听模式"""
+        return bool(self.current_preset and self.current_preset.get('draft_mode', False))
+
+    def _prepare_tts_inputs(self, text: str, speed_factor: float = None, emotion: str = None, draft: bool = False) -> dict:
         """准备TTS输入参数 - 适配v4版本 (已修复)"""
         if not self.current_preset:
             logger.error("未设置预设")
@@ -232,26 +238,47 @@ class GPTSoVITS:
             
             'fragment_interval': self.current_preset.get('fragment_interval', 0.3),
             'repetition_penalty': self.current_preset.get('repetition_penalty', 1.35),
+            'parallel_infer': self.current_preset.get('parallel_infer', False),
+            # T2S 投机解码：每轮草稿 token 数（0 为关闭），草稿来源 layers / ngram
+            'speculative_k': self.current_preset.get('speculative_k', 0),
+            'speculative_draft': self.current_preset.get('speculative_draft', 'layers'),
+            # 同一音色的句子复用参考前缀的 T2S kv cache（近似，参考部分不再看到目标文本）
+            'reuse_prompt_kv': self.current_preset.get('reuse_prompt_kv', False),
         }
         
+        # 草稿模式：降低CFM采样步数、关闭超分，音质较低但试听延迟显著降低
+        if draft:
+            inputs.update(V4Config.DRAFT_PARAMS)
+            logger.warning("⚠️ 草稿试听模式：输出为低音质版本，仅供校听")
+        
         logger.warning(f"🔥 TTS参数调试 - sample_steps: {inputs['sample_steps']}, if_sr: {inputs['if_sr']}")
         
         return inputs
 
-    def generate_preview(self, text: str, emotion: str = None) -> Optional[str]:
-        """生成预览音频 - 适配v4版本"""
+    def generate_preview(
+        self, text: str, emotion: str = None, draft: bool = None,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> Optional[str]:
+        """生成预览音频 - 适配v4版本
+        
+        draft 为 None 时跟随预设中的 draft_mode；草稿音频保存为 preview_draft.wav 以示区分
+        should_stop 与 synthesize 相同，被中止时返回 None
+        """
         if not self.tts or not self.current_preset:
             logger.error("TTS未初始化或未设置预设")
             return None
             
         try:
+            if draft is None:
+                draft = self.is_draft_mode()
+            
             # 准备输入参数
-            inputs = self._prepare_tts_inputs(text, emotion=emotion)
+            inputs = self._prepare_tts_inputs(text, emotion=emotion, draft=draft)
             if not inputs:
                 return None
                 
             # 生成输出文件路径
-            output_path = self.preview_dir / "preview.wav"
+            output_path = self.preview_dir / ("preview_draft.wav" if draft else "preview.wav")
             
             # 获取用户设置的文本切分方法，默认为cut1（每4句切分）以平衡质量和速度
             text_split_method = self.current_preset.get('text_split_method', 'cut1')
@@ -276,8 +303,12 @@ class GPTSoVITS:
                 'return_fragment': False,
                 'fragment_interval': inputs.get('fragment_interval', 0.3),
                 'seed': -1,
-                'parallel_infer': self.current_preset.get('parallel_infer', False),
+                'should_stop': should_stop,
+                'parallel_infer': inputs['parallel_infer'],
                 'repetition_penalty': inputs.get('repetition_penalty', 1.35),
+                'speculative_k': inputs.get('speculative_k', 0),
+                'speculative_draft': inputs.get('speculative_draft', 'layers'),
+                'reuse_prompt_kv': inputs.get('reuse_prompt_kv', False),
             }
             
             # 🚨 添加TTS调用前的参数确认
@@ -285,10 +316,13 @@ class GPTSoVITS:
             
             # 调用TTS生成
             for sample_rate, audio_data in self.tts.run(tts_inputs):
+                if self.tts.interrupted:
+                    logger.info("试听合成已中止")
+                    return None
                 # 保存音频文件
                 import soundfile as sf
                 sf.write(str(output_path), audio_data, samplerate=sample_rate)
-                logger.info(f"预览音频生成成功: {output_path}")
+                logger.info(f"预览音频生成成功{'（草稿音质）' if draft else ''}: {output_path}")
                 return str(output_path)
             
             logger.error("音频生成失败")
@@ -298,17 +332,46 @@ class GPTSoVITS:
             logger.error(f"生成预览音频时发生错误: {str(e)}")
             return None
 
-    def generate_audio(self, text: str, output_path: str, emotion: str = None) -> bool:
+    def generate_audio(
+        self, text: str, output_path: str, emotion: str = None, seed: int = -1,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> bool:
         """生成音频文件 - 适配v4版本"""
+        result = self.synthesize(text, emotion=emotion, seed=seed, should_stop=should_stop)
+        if result is None:
+            return False
+        try:
+            import soundfile as sf
+            sample_rate, audio_data = result
+            sf.write(output_path, audio_data, samplerate=sample_rate)
+            logger.info(f"音频生成成功: {output_path}")
+            return True
+        except Exception as e:
+            logger.error(f"保存音频时发生错误: {str(e)}")
+            return False
+    
+    def stop(self):
+        """请求中止正在进行的合成（在 T2S 解码、CFM 采样与 vocoder 分块之间生效）"""
+        if self.tts is not None:
+            self.tts.stop()
+
+    def synthesize(
+        self, text: str, emotion: str = None, seed: int = -1,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        合成音频，返回 (采样率, int16 音频)，失败或被中止返回 None；seed 固定时结果可复现。
+        should_stop 在推理过程中被反复调用，返回 True 时尽快中止本次合成。
+        """
         if not self.tts or not self.current_preset:
             logger.error("TTS未初始化或未设置预设")
-            return False
+            return None
             
         try:
             # 准备输入参数
             inputs = self._prepare_tts_inputs(text, emotion=emotion)
             if not inputs:
-                return False
+                return None
                 
             # 获取用户设置的文本切分方法，默认为cut1（每4句切分）以平衡质量和速度
             text_split_method = self.current_preset.get('text_split_method', 'cut1')
@@ -332,9 +395,13 @@ class GPTSoVITS:
                 'batch_size': self.current_preset.get('batch_size', 1),
                 'return_fragment': False,
                 'fragment_interval': inputs.get('fragment_interval', 0.3),
-                'seed': -1,
+                'seed': seed,
+                'should_stop': should_stop,
                 'parallel_infer': self.current_preset.get('parallel_infer', False),
                 'repetition_penalty': inputs.get('repetition_penalty', 1.35),
+                'speculative_k': inputs.get('speculative_k', 0),
+                'speculative_draft': inputs.get('speculative_draft', 'layers'),
+                'reuse_prompt_kv': inputs.get('reuse_prompt_kv', False),
             }
             
             # 🚨 添加TTS调用前的参数确认（generate_audio方法）
@@ -342,18 +409,17 @@ class GPTSoVITS:
             
             # 调用TTS生成
             for sample_rate, audio_data in self.tts.run(tts_inputs):
-                # 保存音频文件
-                import soundfile as sf
-                sf.write(output_path, audio_data, samplerate=sample_rate)
-                logger.info(f"音频生成成功: {output_path}")
-                return True
+                if self.tts.interrupted:
+                    logger.info("合成已中止")
+                    return None
+                return sample_rate, audio_data
             
             logger.error("音频生成失败")
-            return False
+            return None
                 
         except Exception as e:
             logger.error(f"生成音频时发生错误: {str(e)}")
-            return False
+            return None
 
     def generate_book_audio(self, segments: List[str], txt_file_path: str) -> bool:
         """生成完整的有声书音频 - 适配v4版本"""
@@ -376,7 +442,7 @@ class GPTSoVITS:
                     continue
                     
                 segment_file = book_output_dir / f"segment_{i+1:03d}.wav"
-                if self.generate_audio(segment, str(segment_file)):
+                if self.generate_audio(segment, str(segment_file), seed=segment_seed(book_name, i, segment)):
                     audio_files.append(str(segment_file))
                 else:
                     logger.error(f"段落 {i+1} 生成失败")
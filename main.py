@@ -152,6 +152,24 @@ def main():
         default='127.0.0.1',
         help='Web UI 或 API 服务地址 (默认: 127.0.0.1)'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='同机合成进程总数，用于切分 CPU 核心 (默认: config.V4Config.CPU_WORKERS)'
+    )
+    parser.add_argument(
+        '--worker-index',
+        type=int,
+        default=0,
+        help='当前进程在合成进程中的序号 (默认: 0)'
+    )
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        help='每个合成进程的 CPU 线程数，0 表示自动 (默认: config.V4Config.CPU_THREADS_PER_WORKER)'
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -176,6 +194,13 @@ def main():
     # 设置环境
     setup_environment()
     
+    # 按合成进程数切分 CPU 核心与线程
+    # 界面模式下多进程合成由 SynthesisFarm 协调：界面进程不绑定核心，由它按全部核心为各合成进程切分
+    from cpu_threads import configure_from_config
+    from config import V4Config
+    if not (args.mode == 'gui' and V4Config.CPU_WORKERS > 1):
+        configure_from_config(args.worker_index, args.workers, args.threads)
+    
     # 设置端口和主机
     if args.mode in ['webui', 'api']:
         os.environ["API_PORT"] = str(args.port)
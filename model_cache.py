@@ -2,6 +2,7 @@ import os
 import sys
 import time
 import logging
+import threading
 import torch
 from typing import Dict, Optional, Tuple
 from pathlib import Path
@@ -13,6 +14,8 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
+from config import V4Config
+
 try:
     from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
 except ImportError as e:
@@ -35,7 +38,12 @@ class ModelCache:
         """
         self.max_models = max_models
         self.cache: Dict[str, Dict] = {}  # 缓存字典: {cache_key: {tts, config, last_used}}
+        # 界面线程与合成线程都可能取模型，加载、淘汰与清空在锁内进行
+        self._lock = threading.RLock()
         self.device = "cpu"  # 默认使用CPU
+        self.is_half = True  # 使用半精度节省显存（CPU 上 TTS 会自动使用全精度）
+        self.cnhuhbert_base_path = "GPT_SoVITS/pretrained_models/chinese-hubert-base"
+        self.bert_base_path = "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large"
         
         # 统计信息
         self.cache_hits = 0
@@ -63,12 +71,15 @@ class ModelCache:
         try:
             config_dict = {
                 "device": self.device,
-                "is_half": True,  # 使用半精度节省显存
+                "is_half": self.is_half,
                 "version": "v4",  # 使用v4版本
                 "t2s_weights_path": gpt_path,
                 "vits_weights_path": sovits_path,
-                "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
-                "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+                "cnhuhbert_base_path": self.cnhuhbert_base_path,
+                "bert_base_path": self.bert_base_path,
+                "inference_backend": V4Config.INFERENCE_BACKEND,
+                "exported_models_dir": V4Config.EXPORTED_MODELS_DIR,
+                "quantization": V4Config.QUANTIZATION,
             }
             return TTS_Config(config_dict)
         except Exception as e:
@@ -95,8 +106,8 @@ class ModelCache:
             if config is None:
                 return None
             
-            # 初始化TTS
-            tts = TTS(config)
+            # 初始化TTS，与已缓存的模型共用 BERT / CNHuBERT / 声码器
+            tts = TTS(config, shared=self._shared_tts())
             
             load_time = time.time() - start_time
             logger.info(f"模型加载完成，耗时: {load_time:.2f}秒")
@@ -107,6 +118,25 @@ class ModelCache:
             logger.error(f"加载模型时发生错误: {str(e)}")
             return None
     
+    def _shared_tts(self) -> Optional['TTS']:
+        """取一个设备与精度相同的已缓存模型，新模型与其共用公共组件"""
+        # TTS_Config 在 CPU 上会把 is_half 改为 False，按实际生效的精度比较
+        is_half = self.is_half and str(self.device) != "cpu"
+        for info in self.cache.values():
+            tts = info['tts']
+            if str(tts.configs.device) == str(self.device) and tts.configs.is_half == is_half:
+                return tts
+        return None
+
+    def remove(self, gpt_path: str, sovits_path: str):
+        """从缓存中移除指定模型（由调用方管理容量时使用）"""
+        with self._lock:
+            cache_key = self._generate_cache_key(gpt_path, sovits_path)
+            if self.cache.pop(cache_key, None) is not None:
+                logger.info(f"移除模型: {cache_key}")
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+
     def _evict_oldest(self):
         """移除最久未使用的模型"""
         if not self.cache:
@@ -139,54 +169,56 @@ class ModelCache:
         Returns:
             TTS实例或None
         """
-        cache_key = self._generate_cache_key(gpt_path, sovits_path)
-        
-        # 检查缓存是否命中
-        if cache_key in self.cache:
-            # 缓存命中
-            self.cache_hits += 1
-            self.cache[cache_key]['last_used'] = time.time()
-            logger.info(f"缓存命中: {cache_key}")
-            return self.cache[cache_key]['tts']
-        
-        # 缓存未命中，需要加载模型
-        self.cache_misses += 1
-        logger.info(f"缓存未命中: {cache_key}")
-        
-        # 如果缓存已满，移除最久未使用的模型
-        if len(self.cache) >= self.max_models:
-            self._evict_oldest()
-        
-        # 加载新模型
-        tts = self._load_model(gpt_path, sovits_path)
-        if tts is None:
-            return None
+        with self._lock:
+            cache_key = self._generate_cache_key(gpt_path, sovits_path)
         
-        # 将模型添加到缓存
-        self.cache[cache_key] = {
-            'tts': tts,
-            'gpt_path': gpt_path,
-            'sovits_path': sovits_path,
-            'last_used': time.time()
-        }
+            # 检查缓存是否命中
+            if cache_key in self.cache:
+                # 缓存命中
+                self.cache_hits += 1
+                self.cache[cache_key]['last_used'] = time.time()
+                logger.info(f"缓存命中: {cache_key}")
+                return self.cache[cache_key]['tts']
+        
+            # 缓存未命中，需要加载模型
+            self.cache_misses += 1
+            logger.info(f"缓存未命中: {cache_key}")
+        
+            # 如果缓存已满，移除最久未使用的模型
+            if len(self.cache) >= self.max_models:
+                self._evict_oldest()
         
-        logger.info(f"模型已缓存: {cache_key}")
-        return tts
+            # 加载新模型
+            tts = self._load_model(gpt_path, sovits_path)
+            if tts is None:
+                return None
+        
+            # 将模型添加到缓存
+            self.cache[cache_key] = {
+                'tts': tts,
+                'gpt_path': gpt_path,
+                'sovits_path': sovits_path,
+                'last_used': time.time()
+            }
+        
+            logger.info(f"模型已缓存: {cache_key}")
+            return tts
     
     def clear_cache(self):
         """清空所有缓存"""
-        logger.info("清空模型缓存")
-        for cache_key in list(self.cache.keys()):
-            try:
-                del self.cache[cache_key]['tts']
-            except:
-                pass
-        
-        self.cache.clear()
-        
-        # 清理GPU内存
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        with self._lock:
+            logger.info("清空模型缓存")
+            for cache_key in list(self.cache.keys()):
+                try:
+                    del self.cache[cache_key]['tts']
+                except:
+                    pass
+        
+            self.cache.clear()
+        
+            # 清理GPU内存
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
     
     def get_cache_info(self) -> Dict:
         """获取缓存统计信息"""
@@ -0,0 +1,503 @@
+"""
+多机渲染整本书
+
+协调器按段落切分任务并通过 HTTP 提供租约式任务队列，各机器上的 worker 拉取任务、
+用自己的 GPTSoVITS / ModelCache 合成后把 int16 PCM 上传回协调器：
+    POST /lease      {"worker_id"}                      领取任务，返回任务与租约；暂无任务返回 204，全部完成返回 {"done": true}
+    POST /heartbeat  {"lease_id"}                       续租；租约已失效返回 410
+    PUT  /result/<lease_id>                             上传 PCM（请求头 X-Sample-Rate / X-Channels）
+    POST /fail       {"lease_id", "error"}              合成失败，重新排队
+    GET  /status                                        进度
+租约到期未续（worker 崩溃、断网）的任务自动重新排队，超过重试次数后放弃。
+全部完成后协调器继续应答一段时间（--grace），直到领过任务的 worker 都收到 done 再退出；
+worker 连续多次连不上协调器或收到异常响应后自行退出。
+
+每段使用由 (--book_id, 段落序号, 文本) 派生的固定 seed（见 seeding.segment_seed），
+与单机顺序合成、多进程合成得到的 seed 相同。各 worker 按预设名从本机 PresetManager 读取预设
+（各机器的预设、模型与参考音频需保持一致）。在相同硬件、线程数与推理后端下，
+合并结果与 `local` 单机渲染逐字节一致。
+
+用法（在项目根目录运行）:
+    python render_cluster.py coordinator -p <预设名> -i <书.txt> --merge book.wav --port 9890
+    python render_cluster.py worker --url http://<协调器>:9890
+    python render_cluster.py local -p <预设名> -i <书.txt> --merge book.wav
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import wave
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from seeding import auto_generate_output_name, segment_seed, working_audio_dir
+from synthesis_farm import prepare_preset_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9890
+LEASE_SECONDS = 60
+HEARTBEAT_INTERVAL = 10
+DONE_GRACE_SECONDS = 30
+MAX_WORKER_FAILURES = 30
+
+
+@dataclass
+class RenderJob:
+    index: int
+    text: str
+    preset_name: str
+    seed: int
+    emotion: Optional[str] = None
+
+
+def split_book(input_path: str, preset_name: str, book_id: str, batch_size: int = 5000) -> List[RenderJob]:
+    """按 TextProcessor 的分段规则切分书籍，每段一个任务；seed 由 book_id、段落序号与文本决定"""
+    from text_processor import TextProcessor
+
+    with open(input_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    segments = TextProcessor().process_text_with_progress(text, {"batch_size": batch_size}, lambda p: None)
+    return [
+        RenderJob(index=i, text=segment, preset_name=preset_name, seed=segment_seed(book_id, i, segment))
+        for i, segment in enumerate(segments)
+    ]
+
+
+def write_pcm_wav(path: str, pcm: bytes, sample_rate: int, channels: int = 1):
+    """把 int16 PCM 写成 wav（先写临时文件再改名）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with wave.open(tmp_path, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm)
+    os.replace(tmp_path, path)
+
+
+def merge_wavs(paths: List[str], output_path: str):
+    """按顺序拼接采样率一致的 int16 wav"""
+    params = None
+    frames = []
+    for path in paths:
+        with wave.open(path, "rb") as f:
+            if params is None:
+                params = f.getparams()
+            elif (f.getframerate(), f.getnchannels()) != (params.framerate, params.nchannels):
+                raise ValueError(f"采样率或声道数不一致: {path}")
+            frames.append(f.readframes(f.getnframes()))
+    with wave.open(output_path, "wb") as f:
+        f.setnchannels(params.nchannels)
+        f.setsampwidth(params.sampwidth)
+        f.setframerate(params.framerate)
+        for data in frames:
+            f.writeframes(data)
+
+
+class JobSynthesizer:
+    """worker 与单机渲染共用的合成逻辑，保证两者走同一条路径"""
+
+    def __init__(self):
+        from gpt_sovits import GPTSoVITS
+        from preset_manager import PresetManager
+
+        self.engine = GPTSoVITS()
+        self.preset_manager = PresetManager()
+        self.current_key = None
+
+    def __call__(self, job: RenderJob) -> Tuple[int, bytes]:
+        key = (job.preset_name, job.emotion)
+        if key != self.current_key:
+            preset = self.preset_manager.get_preset(job.preset_name)
+            if preset is None:
+                raise RuntimeError(f"预设不存在: {job.preset_name}")
+            if not self.engine.set_preset(prepare_preset_settings(job.preset_name, preset[0], job.emotion)):
+                raise RuntimeError(f"设置预设失败: {job.preset_name}")
+            self.current_key = key
+
+        result = self.engine.synthesize(job.text, emotion=job.emotion, seed=job.seed)
+        if result is None:
+            raise RuntimeError("合成失败")
+        sample_rate, audio = result
+        return sample_rate, audio.astype("<i2").tobytes()
+
+
+class RenderCoordinator:
+    """租约式任务队列"""
+
+    def __init__(
+        self,
+        jobs: List[RenderJob],
+        output_paths: Dict[int, str],
+        lease_seconds: float = LEASE_SECONDS,
+        max_retries: int = 3,
+    ):
+        self.jobs = {job.index: job for job in jobs}
+        self.output_paths = output_paths
+        self.lease_seconds = lease_seconds
+        self.max_retries = max_retries
+
+        self.pending: List[int] = sorted(self.jobs)
+        self.leases: Dict[str, dict] = {}  # lease_id -> {index, worker_id, expires}
+        self.attempts: Dict[int, int] = {index: 0 for index in self.jobs}
+        self.completed: Dict[int, str] = {}
+        self.failed: Dict[int, str] = {}
+        self.workers = set()  # 访问过 /lease 的 worker
+        self.released = set()  # 已收到 done 的 worker
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.all_released = threading.Event()
+        if not self.jobs:
+            self.finished.set()
+            self.all_released.set()
+
+    def lease(self, worker_id: str) -> Optional[dict]:
+        """领取任务；暂无任务返回 None，全部完成返回 {"done": True}"""
+        with self.lock:
+            self.workers.add(worker_id)
+            if self.finished.is_set():
+                self.released.add(worker_id)
+                self._check_released()
+                return {"done": True}
+            self._expire_leases()
+            if not self.pending:
+                return None
+            index = self.pending.pop(0)
+            lease_id = uuid.uuid4().hex
+            expires = time.time() + self.lease_seconds
+            self.leases[lease_id] = {"index": index, "worker_id": worker_id, "expires": expires}
+            logger.info(f"段落 {index + 1} 租给 {worker_id}")
+            return {"lease_id": lease_id, "lease_seconds": self.lease_seconds, "job": asdict(self.jobs[index])}
+
+    def heartbeat(self, lease_id: str) -> bool:
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return False
+            lease["expires"] = time.time() + self.lease_seconds
+            return True
+
+    def complete(self, lease_id: str, pcm: bytes, sample_rate: int, channels: int) -> bool:
+        """写入结果后才释放租约；写入失败时租约仍在，worker 报告 /fail 或租约过期后重新排队"""
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return False
+            index = lease["index"]
+        path = self.output_paths[index]
+        write_pcm_wav(path, pcm, sample_rate, channels)
+        with self.lock:
+            self.leases.pop(lease_id, None)
+            if index in self.completed:
+                return True
+            # 写入期间租约可能已过期并重新排队，结果已落盘则直接记为完成
+            if index in self.pending:
+                self.pending.remove(index)
+            self.failed.pop(index, None)
+            self.completed[index] = path
+            logger.info(f"段落 {index + 1} 完成 ({len(self.completed)}/{len(self.jobs)})")
+            self._check_finished()
+        return True
+
+    def fail(self, lease_id: str, error: str) -> bool:
+        with self.lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return False
+            self._requeue(lease["index"], f"{lease['worker_id']}: {error}")
+            return True
+
+    def _requeue(self, index: int, reason: str):
+        if index in self.completed or index in self.failed:
+            return
+        self.attempts[index] += 1
+        if self.attempts[index] > self.max_retries:
+            logger.error(f"段落 {index + 1} 失败 {self.attempts[index]} 次，放弃: {reason}")
+            self.failed[index] = reason
+            self._check_finished()
+        else:
+            logger.warning(f"段落 {index + 1} 重新排队: {reason}")
+            if index not in self.pending:
+                self.pending.insert(0, index)
+
+    def _expire_leases(self):
+        now = time.time()
+        for lease_id, lease in list(self.leases.items()):
+            if lease["expires"] < now:
+                del self.leases[lease_id]
+                self._requeue(lease["index"], f"{lease['worker_id']} 租约过期")
+
+    def _check_finished(self):
+        if len(self.completed) + len(self.failed) == len(self.jobs):
+            self.finished.set()
+            self._check_released()
+
+    def _check_released(self):
+        if self.workers <= self.released:
+            self.all_released.set()
+
+    def status(self) -> dict:
+        with self.lock:
+            self._expire_leases()
+            return {
+                "total": len(self.jobs),
+                "pending": len(self.pending),
+                "leased": len(self.leases),
+                "completed": len(self.completed),
+                "failed": len(self.failed),
+                "done": self.finished.is_set(),
+                "workers": len(self.workers),
+                "released": len(self.released),
+            }
+
+    def watch(self, interval: float = 1.0):
+        """后台线程：定期回收过期租约"""
+        while not self.finished.wait(interval):
+            with self.lock:
+                self._expire_leases()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    coordinator: RenderCoordinator = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, code: int, payload: Optional[dict] = None):
+        body = json.dumps(payload or {}, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send_json(200, self.coordinator.status())
+        else:
+            self._send_json(404)
+
+    def do_POST(self):
+        data = json.loads(self._read_body() or b"{}")
+        if self.path == "/lease":
+            lease = self.coordinator.lease(data.get("worker_id", self.client_address[0]))
+            if lease is None:
+                self.send_response(204)
+                self.end_headers()
+            else:
+                self._send_json(200, lease)
+        elif self.path == "/heartbeat":
+            self._send_json(200 if self.coordinator.heartbeat(data["lease_id"]) else 410)
+        elif self.path == "/fail":
+            self._send_json(200 if self.coordinator.fail(data["lease_id"], data.get("error", "")) else 410)
+        else:
+            self._send_json(404)
+
+    def do_PUT(self):
+        if not self.path.startswith("/result/"):
+            self._send_json(404)
+            return
+        lease_id = self.path[len("/result/") :]
+        pcm = self._read_body()
+        sample_rate = int(self.headers["X-Sample-Rate"])
+        channels = int(self.headers.get("X-Channels", 1))
+        try:
+            completed = self.coordinator.complete(lease_id, pcm, sample_rate, channels)
+        except OSError as e:
+            logger.error(f"写入结果失败: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200 if completed else 410)
+
+
+def serve(coordinator: RenderCoordinator, host: str, port: int) -> ThreadingHTTPServer:
+    handler = type("RenderHandler", (_Handler,), {"coordinator": coordinator})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=coordinator.watch, daemon=True).start()
+    logger.info(f"协调器监听 http://{host}:{port}，共 {len(coordinator.jobs)} 段")
+    return server
+
+
+class RenderWorker:
+    """从协调器拉取任务的 worker"""
+
+    def __init__(
+        self,
+        url: str,
+        worker_id: Optional[str] = None,
+        poll_interval: float = 2.0,
+        max_failures: int = MAX_WORKER_FAILURES,
+    ):
+        self.url = url.rstrip("/")
+        self.worker_id = worker_id or f"{os.uname().nodename if hasattr(os, 'uname') else 'worker'}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.max_failures = max_failures
+        self.synthesize = None
+
+    def _request(self, method: str, path: str, payload=None, data: bytes = None, headers: Optional[dict] = None):
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            headers = {"Content-Type": "application/json"}
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                body = response.read()
+                return response.status, json.loads(body) if body else None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def _heartbeat(self, lease_id: str, stop: threading.Event):
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                status, _ = self._request("POST", "/heartbeat", {"lease_id": lease_id})
+                if status == 410:
+                    logger.warning(f"租约 {lease_id} 已失效")
+                    return
+            except OSError as e:
+                logger.warning(f"心跳失败: {e}")
+
+    def _report(self, path: str, payload: dict):
+        """上报结果以外的请求，连不上协调器时只记录日志"""
+        try:
+            return self._request("POST", path, payload)[0]
+        except OSError as e:
+            logger.warning(f"请求 {path} 失败: {e}")
+            return None
+
+    def run(self):
+        failures = 0
+        while True:
+            try:
+                status, lease = self._request("POST", "/lease", {"worker_id": self.worker_id})
+            except OSError as e:
+                status, lease = None, None
+                logger.warning(f"无法连接协调器: {e}")
+            if status == 204:
+                failures = 0
+                time.sleep(self.poll_interval)
+                continue
+            if status != 200 or not isinstance(lease, dict):
+                failures += 1
+                if status is not None:
+                    logger.warning(f"协调器返回异常响应: {status}")
+                if failures >= self.max_failures:
+                    logger.error(f"连续 {failures} 次无法领取任务，worker 退出")
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            failures = 0
+            if lease.get("done"):
+                logger.info("全部任务已完成，worker 退出")
+                return
+
+            job = RenderJob(**lease["job"])
+            lease_id = lease["lease_id"]
+            stop = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(lease_id, stop), daemon=True).start()
+            try:
+                if self.synthesize is None:
+                    self.synthesize = JobSynthesizer()
+                sample_rate, pcm = self.synthesize(job)
+                headers = {"X-Sample-Rate": str(sample_rate), "X-Channels": "1"}
+                status, _ = self._request("PUT", f"/result/{lease_id}", data=pcm, headers=headers)
+                if status == 410:
+                    logger.warning(f"段落 {job.index + 1} 的租约已失效，结果未被接收")
+                elif status != 200:
+                    raise RuntimeError(f"上传结果失败: {status}")
+            except Exception as e:
+                logger.error(f"段落 {job.index + 1} 合成失败: {e}")
+                self._report("/fail", {"lease_id": lease_id, "error": str(e)})
+            finally:
+                stop.set()
+
+
+def render_local(jobs: List[RenderJob], output_paths: Dict[int, str]):
+    """单机顺序渲染，作为多机结果的对照"""
+    synthesize = JobSynthesizer()
+    for job in jobs:
+        sample_rate, pcm = synthesize(job)
+        write_pcm_wav(output_paths[job.index], pcm, sample_rate)
+        logger.info(f"段落 {job.index + 1}/{len(jobs)} 完成")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多机渲染整本书")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ["coordinator", "local"]:
+        sub = subparsers.add_parser(name)
+        sub.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+        sub.add_argument("-i", "--input", type=str, required=True, help="书籍文本文件（UTF-8）")
+        sub.add_argument("--book_id", type=str, default=None, help="派生各段 seed 的书籍标识（默认文件名）")
+        sub.add_argument("--batch_size", type=int, default=5000, help="分段字数")
+        sub.add_argument("--merge", type=str, default=None, help="合并后的输出文件")
+    coordinator_parser = subparsers.choices["coordinator"]
+    coordinator_parser.add_argument("--host", type=str, default="0.0.0.0")
+    coordinator_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    coordinator_parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="租约秒数")
+    coordinator_parser.add_argument("--retries", type=int, default=3, help="单段最大重试次数")
+    coordinator_parser.add_argument(
+        "--grace", type=float, default=DONE_GRACE_SECONDS, help="完成后等待 worker 收到结束通知的最长秒数"
+    )
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("--url", type=str, required=True, help="协调器地址")
+    worker_parser.add_argument("--id", type=str, default=None, help="worker 名称")
+    worker_parser.add_argument("--threads", type=int, default=None, help="CPU 线程数")
+    worker_parser.add_argument(
+        "--max_failures", type=int, default=MAX_WORKER_FAILURES, help="连续多少次领取任务失败后退出"
+    )
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        if args.threads:
+            from cpu_threads import configure_from_config
+
+            configure_from_config(0, 1, args.threads)
+        RenderWorker(args.url, args.id, max_failures=args.max_failures).run()
+        return
+
+    source_filename = os.path.splitext(os.path.basename(args.input))[0]
+    jobs = split_book(args.input, args.preset, args.book_id or source_filename, args.batch_size)
+    audio_dir = working_audio_dir(source_filename)
+    output_paths = {
+        job.index: os.path.join(audio_dir, auto_generate_output_name(source_filename, job.index)) for job in jobs
+    }
+
+    if args.command == "local":
+        render_local(jobs, output_paths)
+        failed = 0
+    else:
+        coordinator = RenderCoordinator(jobs, output_paths, args.lease, args.retries)
+        server = serve(coordinator, args.host, args.port)
+        coordinator.finished.wait()
+        # 继续应答 /lease，让各 worker 收到 done 后退出；已失联的 worker 等到超时为止
+        if not coordinator.all_released.wait(args.grace):
+            logger.warning("部分 worker 未收到结束通知")
+        server.shutdown()
+        failed = len(coordinator.failed)
+        for index, reason in sorted(coordinator.failed.items()):
+            logger.error(f"段落 {index + 1} 失败: {reason}")
+
+    if args.merge and not failed:
+        merge_wavs([output_paths[job.index] for job in jobs], args.merge)
+        print(f"已合并到 {args.merge}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "GPT_SoVITS"))
+    main()
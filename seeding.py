@@ -0,0 +1,36 @@
+"""
+段落 seed 与输出文件命名
+
+界面、单机多进程合成（synthesis_farm）、多机渲染（render_cluster）与 GPTSoVITS.process_book 共用，
+同一文本框无论由哪条路径合成，seed 与输出路径都相同。本模块不依赖模型与界面，可被任意一方导入。
+"""
+
+import os
+import hashlib
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+
+
+def segment_seed(book_id: str, segment_index: int, text: str, box_index: int = 0) -> int:
+    """
+    由 (书籍标识, 段落序号, 文本框序号, 文本内容) 派生的固定 seed。
+    同一文本框无论顺序合成、多进程并行、断点续跑还是多机渲染都得到相同的 seed，文本修改后 seed 随之变化。
+    """
+    key = f"{book_id}\x00{segment_index}\x00{box_index}\x00{text}".encode("utf-8")
+    # TTS 的 set_seed 同时设置 numpy 的种子，取值需在 [0, 2**32)
+    return int.from_bytes(hashlib.sha256(key).digest()[:4], "little")
+
+
+def auto_generate_output_name(source_filename: str, segment_index: int) -> str:
+    """AutoGenerateCard 的单人模式命名"""
+    return f"{source_filename}_段落{segment_index + 1}_文本框1.wav"
+
+
+def multi_speaker_output_name(source_filename: str, segment_index: int, box_index: int) -> str:
+    """多人配音页面的命名"""
+    return f"{source_filename}_段落{segment_index + 1:04d}_文本框{box_index + 1:02d}.wav"
+
+
+def working_audio_dir(source_filename: str) -> str:
+    """Working/<书名>_processed/audio_segments"""
+    return os.path.join(project_root, "Working", f"{source_filename}_processed", "audio_segments")
@@ -0,0 +1,376 @@
+"""
+单机多进程合成
+
+把一本书的段落分给 N 个合成进程，每个进程持有自己的 GPTSoVITS / ModelCache，
+协调器负责派发、失败重试、进程意外退出后的重新派发，并按书内顺序交付结果。
+每个进程有自己的任务队列，协调器始终知道哪些任务在哪个进程手里，进程退出时这些任务不会丢失；
+同一槽位的进程重启次数超过上限后不再补进程，全部槽位都停用时剩余任务直接判为失败。
+输出文件命名与 AutoGenerateCard（单人）/ 多人配音页面一致，合成结果可直接沿用原有的合并流程。
+
+用法（在项目根目录运行）:
+    python synthesis_farm.py -p <预设名> -i <书.txt> -w 4
+"""
+
+import os
+import sys
+import time
+import queue
+import logging
+import argparse
+import multiprocessing as mp
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from seeding import auto_generate_output_name, multi_speaker_output_name, segment_seed, working_audio_dir
+
+logger = logging.getLogger(__name__)
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class SynthesisJob:
+    """一个待合成的文本框"""
+
+    index: int  # 在整本书中的顺序
+    text: str
+    output_path: str
+    settings: dict  # 传给 GPTSoVITS.set_preset 的预设
+    emotion: Optional[str] = None
+    seed: int = -1  # -1 表示随机
+    attempts: int = 0
+
+
+def prepare_preset_settings(preset_name: str, preset_data: dict, emotion: Optional[str] = None) -> dict:
+    """补齐 GPTSoVITS.set_preset 需要的字段（与 AutoGenerateCard 一致）"""
+    settings = dict(preset_data)
+    settings["preset_name"] = preset_name
+    if "gpt_path" not in settings and "model_path" in settings:
+        settings["gpt_path"] = settings["model_path"]
+    if "ref_language" not in settings:
+        settings["ref_language"] = settings.get("text_lang", "all_zh")
+    if emotion:
+        settings["ref_emotion"] = emotion
+    return settings
+
+
+def jobs_from_segments(
+    segments: List[str], preset_name: str, preset_data: dict, source_filename: str
+) -> List[SynthesisJob]:
+    """单人模式：TextProcessor.process_text_with_progress 的段落，一段一个任务"""
+    audio_dir = working_audio_dir(source_filename)
+    settings = prepare_preset_settings(preset_name, preset_data)
+    return [
+        SynthesisJob(
+            index=i,
+            text=text,
+            output_path=os.path.join(audio_dir, auto_generate_output_name(source_filename, i)),
+            settings=settings,
+            seed=segment_seed(source_filename, i, text),
+        )
+        for i, text in enumerate(segments)
+    ]
+
+
+def jobs_from_tasks(
+    tasks: List[Tuple[int, int, str, str, Optional[str]]], presets: Dict[str, dict], source_filename: str
+) -> List[SynthesisJob]:
+    """
+    多人模式：tasks 为 (段落序号, 文本框序号, 文本, 预设名, 情绪)，presets 为 预设名 -> 预设数据。
+    同一预设与情绪的任务排在一起派发，减少各进程切换音色的次数。
+    """
+    audio_dir = working_audio_dir(source_filename)
+    jobs = []
+    for i, (segment_index, box_index, text, preset_name, emotion) in enumerate(tasks):
+        jobs.append(
+            SynthesisJob(
+                index=i,
+                text=text,
+                output_path=os.path.join(
+                    audio_dir, multi_speaker_output_name(source_filename, segment_index, box_index)
+                ),
+                settings=prepare_preset_settings(preset_name, presets[preset_name], emotion),
+                emotion=emotion,
+                seed=segment_seed(source_filename, segment_index, text, box_index),
+            )
+        )
+    jobs.sort(key=lambda job: (job.settings["preset_name"], job.emotion or "", job.index))
+    return jobs
+
+
+def _worker_main(worker_index: int, plan, job_queue, result_queue):
+    """合成进程：应用协调器分配的核心与线程后逐个处理任务，None 表示退出"""
+    from cpu_threads import apply_worker_threads
+
+    if plan is not None:
+        apply_worker_threads(plan)
+
+    from gpt_sovits import GPTSoVITS
+
+    engine = GPTSoVITS()
+    current_key = None
+    while True:
+        job: Optional[SynthesisJob] = job_queue.get()
+        if job is None:
+            break
+        start = time.perf_counter()
+        error = None
+        try:
+            key = (job.settings.get("preset_name"), job.emotion)
+            if key != current_key:
+                if not engine.set_preset(job.settings):
+                    raise RuntimeError(f"设置预设失败: {key[0]}")
+                current_key = key
+
+            # 先写临时文件再改名，进程中途退出不会留下不完整的音频
+            os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+            tmp_path = job.output_path[: -len(".wav")] + ".tmp.wav"
+            if not engine.generate_audio(job.text, tmp_path, emotion=job.emotion, seed=job.seed):
+                raise RuntimeError("generate_audio 返回失败")
+            os.replace(tmp_path, job.output_path)
+        except Exception as e:
+            current_key = None
+            error = str(e)
+        result_queue.put(("done", worker_index, job.index, error, time.perf_counter() - start))
+
+
+class SynthesisFarm:
+    """多进程合成协调器"""
+
+    def __init__(self, num_workers: int, threads_per_worker: int = 0, max_retries: int = 2, max_restarts: int = 3):
+        """
+        Args:
+            num_workers: 合成进程数
+            threads_per_worker: 每个进程的 CPU 线程数，0 表示按核心均分（见 cpu_threads.plan_workers）
+            max_retries: 单个任务失败后的最大重试次数
+            max_restarts: 单个槽位的进程意外退出后最多重启几次
+        """
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker
+        # 在协调器中按其全部可用核心一次性切分，子进程只应用自己的那一份
+        # （子进程继承协调器的核心绑定，在子进程里再切分只能分到协调器的那一片）
+        self.plans = None
+        if self.num_workers > 1 or threads_per_worker > 0:
+            from cpu_threads import plan_workers
+
+            self.plans = plan_workers(self.num_workers, threads_per_worker)
+        self.max_retries = max_retries
+        self.max_restarts = max_restarts
+
+        self._ctx = mp.get_context("spawn")
+        self._job_queues: List = [None] * self.num_workers
+        self._result_queue = None
+        self._workers: List[Optional[mp.Process]] = [None] * self.num_workers
+        self.restarts: List[int] = [0] * self.num_workers
+
+        self.jobs: Dict[int, SynthesisJob] = {}
+        self.pending = deque()  # 尚未派发的 job index
+        # worker -> 派给它的 job index；每个进程同时只持有一个任务，进程退出时能确定是哪个任务
+        # （进程被杀时结果队列里尚未发出的消息会丢失，多派的任务无法区分是否已完成）
+        self.in_flight: Dict[int, int] = {}
+        self.completed: Dict[int, str] = {}  # job index -> 输出路径
+        self.failed: Dict[int, str] = {}  # job index -> 错误信息
+        self.busy_seconds = 0.0
+        self._next_ordered = 0
+        self._order: List[int] = []
+
+    def start(self):
+        self._result_queue = self._ctx.Queue()
+        for i in range(self.num_workers):
+            self._spawn(i)
+        logger.info(f"已启动 {self.num_workers} 个合成进程")
+
+    def _spawn(self, worker_index: int):
+        # 进程被杀时可能正持有队列的锁，重启时换一个新队列
+        self._job_queues[worker_index] = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker_index,
+                self.plans[worker_index] if self.plans is not None else None,
+                self._job_queues[worker_index],
+                self._result_queue,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self._workers[worker_index] = process
+
+    def submit(self, jobs: List[SynthesisJob]):
+        """派发任务；交付顺序为 job.index 升序"""
+        for job in jobs:
+            self.jobs[job.index] = job
+            self.pending.append(job.index)
+        self._order = sorted(self.jobs)
+        self._dispatch()
+
+    def _dispatch(self):
+        """把待派发的任务分给空闲的进程"""
+        for i, process in enumerate(self._workers):
+            if not self.pending:
+                break
+            if process is not None and i not in self.in_flight:
+                index = self.pending.popleft()
+                self.in_flight[i] = index
+                self._job_queues[i].put(self.jobs[index])
+
+    @property
+    def done(self) -> bool:
+        return len(self.completed) + len(self.failed) == len(self.jobs)
+
+    def _retry_or_fail(self, index: int, error: str):
+        if index in self.completed or index in self.failed:
+            return
+        job = self.jobs[index]
+        job.attempts += 1
+        if job.attempts <= self.max_retries:
+            logger.warning(f"任务 {index} 失败（第 {job.attempts} 次）: {error}，重新派发")
+            self.pending.appendleft(index)
+        else:
+            logger.error(f"任务 {index} 失败 {job.attempts} 次，放弃: {error}")
+            self.failed[index] = error
+
+    def _check_workers(self):
+        """进程意外退出时重新派发派给它的任务并补一个新进程；重启次数用尽的槽位停用"""
+        for i, process in enumerate(self._workers):
+            if process is None or process.is_alive():
+                continue
+            index = self.in_flight.pop(i, None)
+            if index is not None:
+                self._retry_or_fail(index, f"合成进程退出 (exitcode={process.exitcode})")
+            if self.restarts[i] < self.max_restarts:
+                self.restarts[i] += 1
+                logger.error(f"合成进程 {i} 意外退出 (exitcode={process.exitcode})，第 {self.restarts[i]} 次重启")
+                self._spawn(i)
+            else:
+                logger.error(f"合成进程 {i} 意外退出 (exitcode={process.exitcode})，已重启 {self.restarts[i]} 次，停用")
+                self._workers[i] = None
+
+        if self.pending and all(process is None for process in self._workers):
+            logger.error(f"全部合成进程已停用，剩余 {len(self.pending)} 个任务判为失败")
+            while self.pending:
+                index = self.pending.popleft()
+                if index not in self.completed:
+                    self.failed[index] = "全部合成进程已停用"
+
+    def poll(self, timeout: float = 0.1) -> List[Tuple[int, Optional[str]]]:
+        """
+        处理合成进程的消息，返回按书内顺序新交付的 (job.index, 输出路径)；放弃的任务输出路径为 None。
+        """
+        messages = []
+        try:
+            messages.append(self._result_queue.get(timeout=timeout))
+            while True:
+                messages.append(self._result_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        for _, worker_index, index, error, seconds in messages:
+            if self.in_flight.get(worker_index) != index:
+                continue  # 已因进程退出重新派发过
+            del self.in_flight[worker_index]
+            self.busy_seconds += seconds
+            if error is None:
+                if index not in self.failed:
+                    self.completed[index] = self.jobs[index].output_path
+            else:
+                self._retry_or_fail(index, error)
+        self._check_workers()
+        self._dispatch()
+
+        ready = []
+        while self._next_ordered < len(self._order):
+            index = self._order[self._next_ordered]
+            if index in self.completed:
+                ready.append((index, self.completed[index]))
+            elif index in self.failed:
+                ready.append((index, None))
+            else:
+                break
+            self._next_ordered += 1
+        return ready
+
+    def run(
+        self, jobs: List[SynthesisJob], on_ready: Optional[Callable[[int, Optional[str]], None]] = None
+    ) -> List[Optional[str]]:
+        """派发并等待全部任务完成，返回按 job.index 排列的输出路径"""
+        self.submit(jobs)
+        while not self.done:
+            for index, path in self.poll(timeout=0.5):
+                if on_ready is not None:
+                    on_ready(index, path)
+        for index, path in self.poll(timeout=0):
+            if on_ready is not None:
+                on_ready(index, path)
+        return [self.completed.get(index) for index in self._order]
+
+    def terminate(self):
+        """立即结束全部合成进程，未完成的任务直接丢弃"""
+        for process in self._workers:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._workers:
+            if process is not None:
+                process.join(timeout=5)
+        self._workers = [None] * self.num_workers
+
+    def close(self):
+        for process, job_queue in zip(self._workers, self._job_queues):
+            if process is not None:
+                job_queue.put(None)
+        for process in self._workers:
+            if process is not None:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
+        self._workers = [None] * self.num_workers
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单机多进程合成整本书")
+    parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    parser.add_argument("-i", "--input", type=str, required=True, help="书籍文本文件（UTF-8）")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="合成进程数（默认 config.V4Config.CPU_WORKERS）")
+    parser.add_argument("--threads", type=int, default=None, help="每进程线程数，0 表示自动均分")
+    parser.add_argument("--batch_size", type=int, default=5000, help="分段字数")
+    parser.add_argument("--retries", type=int, default=2, help="单段最大重试次数")
+    args = parser.parse_args()
+
+    sys.path.append(os.path.join(project_root, "GPT_SoVITS"))
+    from config import V4Config
+    from preset_manager import PresetManager
+    from text_processor import TextProcessor
+
+    preset = PresetManager().get_preset(args.preset)
+    if preset is None:
+        raise SystemExit(f"预设不存在: {args.preset}")
+    with open(args.input, "r", encoding="utf-8") as f:
+        text = f.read()
+    segments = TextProcessor().process_text_with_progress(text, {"batch_size": args.batch_size}, lambda p: None)
+    source_filename = os.path.splitext(os.path.basename(args.input))[0]
+    jobs = jobs_from_segments(segments, args.preset, preset[0], source_filename)
+
+    workers = V4Config.CPU_WORKERS if args.workers is None else args.workers
+    threads = V4Config.CPU_THREADS_PER_WORKER if args.threads is None else args.threads
+    start = time.perf_counter()
+    with SynthesisFarm(workers, threads, args.retries) as farm:
+        paths = farm.run(jobs, lambda index, path: print(f"[{index + 1}/{len(jobs)}] {path or '失败'}"))
+    wall = time.perf_counter() - start
+
+    failed = sum(path is None for path in paths)
+    print(f"完成 {len(paths) - failed}/{len(paths)} 段，耗时 {wall:.1f}s，进程忙碌总时长 {farm.busy_seconds:.1f}s")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,311 @@
+"""
+界面合成服务
+
+合成任务在独立的 QThread 中串行执行，界面线程只负责提交任务和响应信号，
+整本书合成期间界面保持响应，段落之间也不再需要用 QTimer 人为让出事件循环。
+
+任务按优先级执行，同一优先级按提交顺序。交互任务（单个文本框的生成/试听）提交时若正在合成
+后台任务（整本书、批量生成），后台任务在 T2S 解码、CFM 采样或 vocoder 分块之间被中止并放回队列，
+交互任务完成后从该段重新合成；已完成的段落不受影响，且每段 seed 固定，重新合成的结果不变。
+一个 GPTSoVITS 实例只应交给一个服务使用，不要再在界面线程中直接调用它的合成方法。
+各界面页面通过 service.client() 共用同一个服务：试听、单段生成与整本书合成排在同一个队列里，
+优先级在页面之间同样生效，也不会有两个任务同时调用同一个 TTS 实例。
+client.cancel_all() 只取消该页面提交的任务；页面销毁时调用它即可，服务在程序退出时 shutdown。
+排队任务数与各合成阶段耗时记录在 tools.metrics.REGISTRY 中，界面可用 REGISTRY.snapshot() 读取。
+
+用法:
+    service = SynthesisService(gpt_sovits)
+    client = service.client()
+    client.task_finished.connect(self.on_task_finished)
+    client.submit(SynthesisTask(text, output_path, settings=settings, seed=seed, tag=index))
+    client.submit(SynthesisTask(text, "", settings=settings, preview=True, priority=PRIORITY_INTERACTIVE))
+"""
+
+import os
+import queue
+import logging
+import itertools
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from PyQt6.QtCore import QObject, QThread, QCoreApplication, pyqtSignal
+
+from tools.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# shutdown(wait=False) 后仍在收尾的后台线程，线程结束前保持引用
+_retiring_threads = set()
+
+pending_tasks = REGISTRY.gauge("tts_gui_pending_tasks", "界面合成服务中尚未完成（含正在合成）的任务数")
+
+# 数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+@dataclass
+class SynthesisTask:
+    """一个合成任务"""
+
+    text: str
+    output_path: str
+    settings: Optional[dict] = None  # 传给 GPTSoVITS.set_preset 的完整预设，None 表示沿用当前预设
+    emotion: Optional[str] = None
+    seed: int = -1  # -1 表示随机
+    tag: object = None  # 调用方的标识（段落序号、文本框等），随信号原样返回
+    priority: int = PRIORITY_BACKGROUND
+    task_id: int = 0
+    preemptions: int = 0  # 被更高优先级任务中断的次数
+    # 试听任务：调用 GPTSoVITS.generate_preview（草稿模式跟随预设），完成后 output_path 为引擎给出的试听文件
+    preview: bool = False
+    client: object = None  # 提交任务的 SynthesisClient，由 SynthesisClient.submit 填写
+
+
+class _SynthesisThread(QThread):
+    def __init__(self, service: "SynthesisService"):
+        super().__init__()
+        self.service = service
+
+    def run(self):
+        self.service._run_loop()
+
+
+class SynthesisClient(QObject):
+    """共享服务的一个使用方（通常是一个界面页面），只接收和取消自己提交的任务"""
+
+    task_started = pyqtSignal(object)  # SynthesisTask
+    task_finished = pyqtSignal(object, bool, str)  # SynthesisTask, 是否成功, 错误信息
+    task_cancelled = pyqtSignal(object)  # SynthesisTask
+    task_preempted = pyqtSignal(object)  # SynthesisTask，已放回队列稍后重新合成
+    idle = pyqtSignal()  # 本页面提交的任务全部处理完毕
+
+    def __init__(self, service: "SynthesisService"):
+        super().__init__()
+        self.service = service
+        self._generation = 0  # 由 service._lock 保护，cancel_all 后递增
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """本页面尚未完成（含正在合成）的任务数"""
+        with self.service._lock:
+            return self._pending
+
+    @property
+    def busy(self) -> bool:
+        return self.pending > 0
+
+    def submit(self, task: SynthesisTask) -> int:
+        task.client = self
+        return self.service.submit(task)
+
+    def cancel_all(self):
+        """丢弃本页面排队中的任务，正在合成的本页面任务在下一个中止检查点停止（其结果不会交付）"""
+        with self.service._lock:
+            self._generation += 1
+
+
+class SynthesisService(QObject):
+    """在后台线程中串行执行合成任务"""
+
+    task_started = pyqtSignal(object)  # SynthesisTask
+    task_finished = pyqtSignal(object, bool, str)  # SynthesisTask, 是否成功, 错误信息
+    task_cancelled = pyqtSignal(object)  # SynthesisTask
+    task_preempted = pyqtSignal(object)  # SynthesisTask，已放回队列稍后重新合成
+    idle = pyqtSignal()  # 队列中的任务全部处理完毕
+
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._generation = 0  # cancel_all 后递增，旧一代的任务一律丢弃
+        self._pending = 0
+        self._queued_priorities: Counter = Counter()  # 队列中各优先级的任务数
+        self._current_settings: Optional[dict] = None
+        self._thread: Optional[_SynthesisThread] = None
+
+    @property
+    def pending(self) -> int:
+        """尚未完成（含正在合成）的任务数"""
+        with self._lock:
+            return self._pending
+
+    @property
+    def busy(self) -> bool:
+        return self.pending > 0
+
+    def client(self) -> SynthesisClient:
+        """为一个使用方创建客户端；客户端不要挂到界面控件下，以免后台线程发信号时对象已被销毁"""
+        return SynthesisClient(self)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = _SynthesisThread(self)
+        self._thread.start()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.shutdown)
+
+    def submit(self, task: SynthesisTask) -> int:
+        """提交任务，返回任务编号"""
+        self.start()
+        task.task_id = next(self._ids)
+        if task.settings is not None:
+            # 调用方之后修改自己的预设字典不影响已提交的任务
+            task.settings = dict(task.settings)
+        with self._lock:
+            self._pending += 1
+            if task.client is not None:
+                task.client._pending += 1
+            self._enqueue(self._current_generation(task), task)
+        pending_tasks.inc()
+        return task.task_id
+
+    def _current_generation(self, task: SynthesisTask) -> tuple:
+        # 调用方持有 self._lock；服务整体取消与任务所属页面的取消都会使旧任务过期
+        client_generation = task.client._generation if task.client is not None else 0
+        return self._generation, client_generation
+
+    def _enqueue(self, generation: tuple, task: SynthesisTask):
+        # 调用方持有 self._lock；task_id 递增，同一优先级内保持提交顺序
+        self._queued_priorities[task.priority] += 1
+        self._queue.put((task.priority, task.task_id, generation, task))
+
+    def _has_waiting_above(self, priority: int) -> bool:
+        """队列中是否有比 priority 更优先的任务"""
+        with self._lock:
+            return any(p < priority and n > 0 for p, n in self._queued_priorities.items())
+
+    def cancel_all(self):
+        """丢弃所有排队中的任务，正在合成的任务在下一个中止检查点停止（其结果不会交付）"""
+        # 只通过本服务的 should_stop 中止，不调用 engine.stop()：它会置位共用 TTS 实例的 stop_flag
+        with self._lock:
+            self._generation += 1
+
+    def shutdown(self, wait: bool = True):
+        """取消全部任务并结束后台线程；wait=False 时不等待正在合成的任务收尾"""
+        if self._thread is None:
+            return
+        self.cancel_all()
+        # 结束标记排在所有任务之前，排队中的任务不会再被执行
+        self._queue.put((float("-inf"), 0, None, None))
+        thread, self._thread = self._thread, None
+        if wait:
+            thread.wait()
+        else:
+            _retiring_threads.add(thread)
+            thread.finished.connect(lambda: _retiring_threads.discard(thread))
+
+    def _is_stale(self, generation: tuple, task: SynthesisTask) -> bool:
+        with self._lock:
+            return generation != self._current_generation(task)
+
+    def _emit(self, name: str, task: SynthesisTask, *args):
+        """同时在服务和任务所属的客户端上发出信号"""
+        getattr(self, name).emit(task, *args)
+        if task.client is not None:
+            getattr(task.client, name).emit(task, *args)
+
+    def _apply_settings(self, settings: Optional[dict]):
+        if settings is None or settings == self._current_settings:
+            return
+        self._current_settings = None
+        if not self.engine.set_preset(settings):
+            raise RuntimeError(f"设置预设失败: {settings.get('preset_name', '')}")
+        self._current_settings = settings
+
+    def _run_loop(self):
+        while True:
+            _, _, generation, task = self._queue.get()
+            if task is None:
+                break
+            with self._lock:
+                self._queued_priorities[task.priority] -= 1
+            try:
+                if self._is_stale(generation, task):
+                    self._emit("task_cancelled", task)
+                    continue
+                self._emit("task_started", task)
+                self._run_task(generation, task)
+            finally:
+                client = task.client
+                with self._lock:
+                    self._pending -= 1
+                    is_idle = self._pending == 0
+                    if client is not None:
+                        client._pending -= 1
+                        client_idle = client._pending == 0
+                pending_tasks.dec()
+                if is_idle:
+                    self.idle.emit()
+                if client is not None and client_idle:
+                    client.idle.emit()
+
+    def _run_task(self, generation: tuple, task: SynthesisTask):
+        # 先写临时文件再改名，取消或失败时不会留下不完整的音频；试听文件由引擎自己管理
+        tmp_path = None if task.preview else task.output_path[: -len(".wav")] + ".tmp.wav"
+        preempted = []
+
+        def should_stop() -> bool:
+            if self._is_stale(generation, task):
+                return True
+            if self._has_waiting_above(task.priority):
+                preempted.append(True)
+                return True
+            return False
+
+        try:
+            self._apply_settings(task.settings)
+            if task.preview:
+                preview_path = self.engine.generate_preview(task.text, emotion=task.emotion, should_stop=should_stop)
+                ok = preview_path is not None
+            else:
+                os.makedirs(os.path.dirname(task.output_path), exist_ok=True)
+                ok = self.engine.generate_audio(
+                    task.text, tmp_path, emotion=task.emotion, seed=task.seed, should_stop=should_stop
+                )
+            if self._is_stale(generation, task):
+                self._discard(tmp_path)
+                self._emit("task_cancelled", task)
+                return
+            if not ok and preempted:
+                # 让出给更高优先级的任务，放回队列后按原来的顺序重新合成
+                self._discard(tmp_path)
+                task.preemptions += 1
+                with self._lock:
+                    self._pending += 1
+                    if task.client is not None:
+                        task.client._pending += 1
+                    self._enqueue(generation, task)
+                pending_tasks.inc()
+                logger.info(f"合成任务 {task.task_id} 被更高优先级的任务中断，稍后重新合成")
+                self._emit("task_preempted", task)
+                return
+            if not ok:
+                self._discard(tmp_path)
+                method = "generate_preview" if task.preview else "generate_audio"
+                self._emit("task_finished", task, False, f"{method} 返回失败")
+                return
+            if task.preview:
+                task.output_path = preview_path
+            else:
+                os.replace(tmp_path, task.output_path)
+            self._emit("task_finished", task, True, "")
+        except Exception as e:
+            logger.error(f"合成任务 {task.task_id} 出错: {e}")
+            self._discard(tmp_path)
+            self._emit("task_finished", task, False, str(e))
+
+    @staticmethod
+    def _discard(path: Optional[str]):
+        try:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
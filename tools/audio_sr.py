@@ -14,7 +14,15 @@ from models.model import APNet_BWE_Model
 
 
 class AP_BWE:
-    def __init__(self, device, DictToAttrRecursive, checkpoint_file=None):
+    def __init__(
+        self,
+        device,
+        DictToAttrRecursive,
+        checkpoint_file=None,
+        chunk_seconds=10.0,
+        overlap_seconds=0.25,
+        max_batch_size=4,
+    ):
         if checkpoint_file == None:
             checkpoint_file = "%s/24kto48k/g_24kto48k.zip" % (AP_BWE_main_dir_path)
             if os.path.exists(checkpoint_file) == False:
@@ -32,6 +40,11 @@ class AP_BWE:
         self.device = device
         self.model = model
         self.h = h
+        # 长音频按固定长度的重叠窗口切分处理，窗口长度对齐到 hop_size，保证 istft 输出长度与输入一致
+        hop_size = self.h.hop_size
+        self.chunk_len = max(int(chunk_seconds * self.h.hr_sampling_rate) // hop_size, 1) * hop_size
+        self.overlap_len = min(int(overlap_seconds * self.h.hr_sampling_rate) // hop_size * hop_size, self.chunk_len // 2)
+        self.max_batch_size = max_batch_size
 
     def to(self, *arg, **kwargs):
         self.model.to(*arg, **kwargs)
@@ -39,12 +52,69 @@ class AP_BWE:
         return self
 
     def __call__(self, audio, orig_sampling_rate):
+        outputs, hr_sampling_rate = self.process_batch([audio], orig_sampling_rate)
+        return outputs[0], hr_sampling_rate
+
+    def _window_starts(self, length):
+        step = self.chunk_len - self.overlap_len
+        starts = [0]
+        while starts[-1] + self.chunk_len < length:
+            starts.append(starts[-1] + step)
+        return starts
+
+    def process_batch(self, audios, orig_sampling_rate):
+        """
+        对音频做超分。音频先切成重叠窗口，窗口按 max_batch_size 组批推理，
+        结果在重叠区线性交叉淡化后写回各自的输出缓冲区，显存/内存占用只与批大小和窗口长度有关。
+        每批只补零到其中最长的窗口，短音频不会按整个 chunk_len 计算。
+        TTS.audio_postprocess 每次只传入拼接好的一整段输出，组批发生在这段音频的各窗口之间。
+
+        Args:
+            audios: List[torch.Tensor]，每段为单声道波形（任意形状，会被展平）
+            orig_sampling_rate: 输入采样率
+        Returns:
+            (List[np.ndarray], hr_sampling_rate)
+        """
         with torch.no_grad():
-            # audio, orig_sampling_rate = torchaudio.load(inp_path)
-            # audio = audio.to(self.device)
-            audio = aF.resample(audio, orig_freq=orig_sampling_rate, new_freq=self.h.hr_sampling_rate)
-            amp_nb, pha_nb, com_nb = amp_pha_stft(audio, self.h.n_fft, self.h.hop_size, self.h.win_size)
-            amp_wb_g, pha_wb_g, com_wb_g = self.model(amp_nb, pha_nb)
-            audio_hr_g = amp_pha_istft(amp_wb_g, pha_wb_g, self.h.n_fft, self.h.hop_size, self.h.win_size)
+            hr_audios = [
+                aF.resample(
+                    audio.reshape(-1).to(self.device).float(),
+                    orig_freq=orig_sampling_rate,
+                    new_freq=self.h.hr_sampling_rate,
+                )
+                for audio in audios
+            ]
+            outputs = [torch.zeros(hr_audio.shape[0], dtype=torch.float32) for hr_audio in hr_audios]
+            windows = [
+                (i, start, start + self.chunk_len >= hr_audio.shape[0])
+                for i, hr_audio in enumerate(hr_audios)
+                for start in self._window_starts(hr_audio.shape[0])
+            ]
+            fade_in = torch.linspace(0, 1, self.overlap_len + 2)[1:-1]
+            fade_out = 1 - fade_in
+            hop_size = self.h.hop_size
+
+            for pos in range(0, len(windows), self.max_batch_size):
+                batch_windows = windows[pos : pos + self.max_batch_size]
+                # 补零到批内最长窗口并对齐到 hop_size（chunk_len 本身已对齐）
+                longest = max(min(self.chunk_len, hr_audios[i].shape[0] - start) for i, start, _ in batch_windows)
+                batch_len = max(-(-longest // hop_size), 1) * hop_size
+                batch = torch.zeros(len(batch_windows), batch_len, dtype=torch.float32, device=self.device)
+                for j, (i, start, _) in enumerate(batch_windows):
+                    chunk = hr_audios[i][start : start + self.chunk_len]
+                    batch[j, : chunk.shape[0]] = chunk
+                amp_nb, pha_nb, com_nb = amp_pha_stft(batch, self.h.n_fft, self.h.hop_size, self.h.win_size)
+                amp_wb_g, pha_wb_g, com_wb_g = self.model(amp_nb, pha_nb)
+                batch_hr = amp_pha_istft(amp_wb_g, pha_wb_g, self.h.n_fft, self.h.hop_size, self.h.win_size).cpu()
+
+                for j, (i, start, is_last) in enumerate(batch_windows):
+                    valid_len = min(self.chunk_len, outputs[i].shape[0] - start)
+                    chunk_hr = batch_hr[j, :valid_len]
+                    if start > 0:
+                        chunk_hr[: self.overlap_len] *= fade_in
+                    if not is_last and self.overlap_len > 0:
+                        chunk_hr[-self.overlap_len :] *= fade_out
+                    outputs[i][start : start + valid_len] += chunk_hr
+
             # sf.write(opt_path, audio_hr_g.squeeze().cpu().numpy(), self.h.hr_sampling_rate, 'PCM_16')
-            return audio_hr_g.squeeze().cpu().numpy(), self.h.hr_sampling_rate
+            return [output.numpy() for output in outputs], self.h.hr_sampling_rate
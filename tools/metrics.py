@@ -0,0 +1,304 @@
+"""
+进程内指标统计
+
+合成各阶段耗时、实时率、排队深度、缓存命中与模型加载次数记录在进程内的注册表中:
+api_v4 在 /metrics 以 Prometheus 文本格式输出, 图形界面可以直接调用 REGISTRY.snapshot() 读取。
+不依赖 prometheus_client, 记录一次指标只是加锁累加。
+
+阶段 (tts_stage_seconds 的 stage 标签):
+    ref          参考音频与参考文本处理 (HuBERT 语义、频谱、参考文本 BERT)
+    g2p_bert     目标文本切分、G2P 与 BERT 特征
+    t2s_prefill  T2S 首步 (prompt 整段前向)
+    t2s_decode   T2S 逐 token 解码; 吞吐另见 tts_t2s_decode_tokens_per_second
+    vits         vits 解码 (v1/v2 与 v4 以外的非声码器模型)
+    cfm          v3/v4 的 CFM 采样
+    vocoder      BigVGAN / HiFiGAN 声码器
+    sr           音频超分
+    encode       响应音频编码
+
+GPU 上的 kernel 是异步执行的, 记录阶段耗时的调用方需在阶段边界同步设备, 否则耗时会计入下一个同步的阶段。
+
+用法:
+    with stage_timer("vocoder"):
+        audio = vocoder(mel)
+    observe_t2s({"prefill": 0.05, "decode": 1.2, "tokens": 300})
+    text = REGISTRY.render()
+"""
+
+import math
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["ref", "g2p_bert", "t2s_prefill", "t2s_decode", "vits", "cfm", "vocoder", "sr", "encode"]
+
+# 秒级耗时的默认分桶, 覆盖单句的几毫秒到整段长文本的几十秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}, 传入 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        """(后缀, 标签文本, 值)"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield "", _format_labels(self.labelnames, key), value
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return {",".join(key): value for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """分桶统计; 各标签组合记录每个桶的计数、总和与总数"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state["buckets"]), state["sum"], state["count"]) for key, state in self._values.items()]
+        for key, buckets, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), buckets):
+                cumulative += n
+                yield "_bucket", _format_labels(self.labelnames, key, ("le", _format_value(bound))), cumulative
+            yield "_sum", _format_labels(self.labelnames, key), total
+            yield "_count", _format_labels(self.labelnames, key), count
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                ",".join(key): {
+                    "count": state["count"],
+                    "sum": state["sum"],
+                    "avg": state["sum"] / state["count"] if state["count"] else 0.0,
+                }
+                for key, state in self._values.items()
+            }
+
+
+class CallbackMetric(_Metric):
+    """采集时调用 fn 取值的指标, 用于已经自行统计的对象 (缓存、队列)"""
+
+    def __init__(self, name: str, kind: str, documentation: str, labelnames: Sequence[str], fn: Callable):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def _collect(self) -> Dict[tuple, float]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.warning(f"采集指标 {self.name} 失败: {e}")
+            return {}
+        if not isinstance(values, dict):
+            return {(): values}
+        return {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+
+    def _samples(self):
+        for key, value in self._collect().items():
+            yield "", _format_labels(self.labelnames, key), value
+
+    def _snapshot(self):
+        return {",".join(str(k) for k in key): value for key, value in self._collect().items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: _Metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"指标 {metric.name} 已注册为其他类型")
+                if isinstance(metric, CallbackMetric):
+                    existing.fn = metric.fn  # 重新注册时换成新的取值函数
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self, name: str, kind: str, documentation: str, fn: Callable, labelnames: Sequence[str] = ()
+    ) -> CallbackMetric:
+        """fn 返回单个值, 或 {标签值 (多个标签时为元组): 值}"""
+        return self._add(CallbackMetric(name, kind, documentation, labelnames, fn))
+
+    def render(self) -> str:
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric._samples():
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """{指标名: {标签值 (逗号连接): 值}}, 直方图的值为 {"count", "sum", "avg"}"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric._snapshot() for metric in metrics}
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("tts_stage_seconds", "各合成阶段耗时(秒)", ["stage"])
+T2S_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "tts_t2s_decode_tokens_per_second",
+    "T2S 逐 token 解码吞吐 (一批内所有句子的 token 数 / 解码耗时)",
+    buckets=(5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000),
+)
+REAL_TIME_FACTOR = REGISTRY.histogram(
+    "tts_real_time_factor",
+    "合成耗时 / 音频时长, 小于1表示快于实时",
+    buckets=(0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0),
+)
+AUDIO_SECONDS = REGISTRY.counter("tts_audio_seconds_total", "合成的音频总时长(秒)")
+MODEL_LOADS = REGISTRY.counter("tts_model_loads_total", "模型加载次数", ["kind"])
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "tts_model_load_seconds", "模型加载耗时(秒)", ["kind"], buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录 with 块的耗时; 块内抛出异常时不记录"""
+    start = time.perf_counter()
+    yield
+    observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_t2s(timing: Optional[dict]):
+    """记录 infer_panel 填写的 timing: {"prefill": 秒, "decode": 秒, "tokens": 解码 token 数}"""
+    if not timing:
+        return
+    observe_stage("t2s_prefill", timing["prefill"])
+    observe_stage("t2s_decode", timing["decode"])
+    if timing["decode"] > 0 and timing["tokens"] > 0:
+        T2S_TOKENS_PER_SECOND.observe(timing["tokens"] / timing["decode"])
+
+
+def observe_synthesis(compute_seconds: float, audio_seconds: float):
+    """记录一次合成请求的实时率与音频时长"""
+    if audio_seconds <= 0:
+        return
+    AUDIO_SECONDS.inc(audio_seconds)
+    REAL_TIME_FACTOR.observe(compute_seconds / audio_seconds)
+
+
+def record_model_load(kind: str, seconds: float):
+    MODEL_LOADS.inc(kind=kind)
+    MODEL_LOAD_SECONDS.observe(seconds, kind=kind)
+
+
+@contextmanager
+def model_load(kind: str):
+    """记录一次模型加载, 也可以作为装饰器使用; 加载失败 (抛出异常) 时不计数"""
+    start = time.perf_counter()
+    yield
+    record_model_load(kind, time.perf_counter() - start)
@@ -0,0 +1,223 @@
+"""
+流式音频编码器
+
+每个响应持有一个编码器，逐块写入 PCM，返回当前已编码好的字节；
+各块按顺序拼接即为一个完整、合法的音频流（单个 Ogg 逻辑流 / ADTS / MP3 帧序列），
+不再像逐句打包那样每句重新开一个文件或一个 ffmpeg 进程。
+wav 在开头写入长度未定的文件头，之后直接输出 numpy 缓冲区中的 PCM，不经过编码器。
+
+用法:
+    encoder = create_encoder("opus", sample_rate=32000, dtype=np.int16)
+    for pcm in chunks:
+        yield encoder.write(pcm)
+    yield encoder.close()
+"""
+
+import io
+import queue
+import struct
+import subprocess
+import threading
+
+import numpy as np
+import soundfile as sf
+
+STREAM_FORMATS = ["wav", "ogg", "opus", "aac", "mp3"]
+
+# 流式 wav 的长度字段写最大值，浏览器与多数播放器会一直读到连接结束
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg; codecs=opus",
+    "aac": "audio/aac",
+    "mp3": "audio/mpeg",
+}
+
+
+def pcm_view(pcm: np.ndarray) -> memoryview:
+    """PCM 数组的字节视图，不复制数据"""
+    return memoryview(np.ascontiguousarray(pcm)).cast("B")
+
+
+def wav_header(sample_rate: int, dtype=np.int16, data_size: int = None) -> bytes:
+    """单声道 PCM wav 文件头；data_size 为 None 时表示长度未知"""
+    sample_width = np.dtype(dtype).itemsize
+    if data_size is None:
+        riff_size = data_size = _UNKNOWN_SIZE
+    else:
+        riff_size = min(36 + data_size, _UNKNOWN_SIZE)
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * sample_width, sample_width, sample_width * 8,
+        b"data", data_size,
+    )
+
+
+class StreamEncoder:
+    """编码器基类：write 与 close 返回新产生的编码数据（可能为空，wav 为不复制的 memoryview）"""
+
+    def write(self, pcm: np.ndarray) -> bytes:
+        raise NotImplementedError
+
+    def close(self) -> bytes:
+        """写完全部数据，返回剩余的编码数据"""
+        raise NotImplementedError
+
+    def abort(self):
+        """请求中途取消时释放资源，不再产生数据"""
+
+
+class WavStreamEncoder(StreamEncoder):
+    """wav：先发长度未定的文件头，之后原样输出 PCM"""
+
+    def __init__(self, sample_rate: int, dtype=np.int16):
+        self.header = wav_header(sample_rate, dtype)
+        self.started = False
+
+    def write(self, pcm: np.ndarray):
+        data = pcm_view(pcm)
+        if self.started:
+            return data
+        self.started = True
+        return self.header + data
+
+    def close(self) -> bytes:
+        if self.started:
+            return b""
+        self.started = True
+        return self.header
+
+
+class _ChunkSink:
+    """只追加写入的虚拟文件，供 libsndfile 写入；已写出的数据随时可以取走"""
+
+    def __init__(self):
+        self.position = 0
+        self.pending = []
+
+    def write(self, data) -> int:
+        self.pending.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def read(self, size=-1) -> bytes:
+        return b""
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET) -> int:
+        # libsndfile 只会用 seek 查询文件长度；真正回写文件头的格式无法流式输出
+        target = {io.SEEK_SET: offset, io.SEEK_CUR: self.position + offset, io.SEEK_END: self.position + offset}[whence]
+        if target != self.position:
+            raise io.UnsupportedOperation("流式输出不支持回写")
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.pending)
+        self.pending.clear()
+        return data
+
+
+class SoundFileEncoder(StreamEncoder):
+    """Ogg Vorbis：一个 SoundFile 写到底，输出单个 Ogg 逻辑流"""
+
+    # 分块写入：一次写入过长的数组会触发 libsndfile 的栈溢出（见 GPT-SoVITS issue #1199）
+    block_frames = 16384
+
+    def __init__(self, sample_rate: int, dtype=np.int16, format="OGG", subtype="VORBIS"):
+        self.sink = _ChunkSink()
+        self.file = sf.SoundFile(self.sink, mode="w", samplerate=sample_rate, channels=1, format=format, subtype=subtype)
+
+    def write(self, pcm: np.ndarray) -> bytes:
+        for start in range(0, len(pcm), self.block_frames):
+            self.file.write(pcm[start : start + self.block_frames])
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        self.file.close()
+        return self.sink.take()
+
+    def abort(self):
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+
+class FFmpegEncoder(StreamEncoder):
+    """AAC / MP3 / Opus：每个响应一个常驻 ffmpeg 进程，stdin 写入 PCM，后台线程读取编码结果"""
+
+    CODECS = {
+        "aac": ["-c:a", "aac", "-f", "adts"],
+        "mp3": ["-c:a", "libmp3lame", "-f", "mp3"],
+        # libopus 只支持 48k 等固定采样率，由 ffmpeg 重采样
+        "opus": ["-c:a", "libopus", "-ar", "48000", "-application", "audio", "-f", "ogg"],
+    }
+    BIT_RATES = {"aac": ("128k", "256k"), "mp3": ("128k", "256k"), "opus": ("64k", "96k")}
+
+    def __init__(self, fmt: str, sample_rate: int, dtype=np.int16):
+        is_int32 = np.dtype(dtype) == np.int32
+        self.process = subprocess.Popen(
+            [
+                "ffmpeg", "-loglevel", "error",
+                "-f", "s32le" if is_int32 else "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+                "-vn", "-b:a", self.BIT_RATES[fmt][is_int32], *self.CODECS[fmt],
+                "-flush_packets", "1", "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self.output: "queue.Queue[bytes]" = queue.Queue()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        stdout = self.process.stdout
+        while True:
+            data = stdout.read1(65536)
+            if not data:
+                break
+            self.output.put(data)
+
+    def _drain(self) -> bytes:
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.output.get_nowait())
+            except queue.Empty:
+                return b"".join(chunks)
+
+    def write(self, pcm: np.ndarray) -> bytes:
+        self.process.stdin.write(pcm_view(pcm))
+        self.process.stdin.flush()
+        return self._drain()
+
+    def close(self) -> bytes:
+        self.process.stdin.close()
+        self.reader.join()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 编码失败, 返回码 {self.process.returncode}")
+        return self._drain()
+
+    def abort(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+def create_encoder(fmt: str, sample_rate: int, dtype=np.int16) -> StreamEncoder:
+    if fmt == "wav":
+        return WavStreamEncoder(sample_rate, dtype)
+    if fmt == "ogg":
+        return SoundFileEncoder(sample_rate, dtype)
+    if fmt in FFmpegEncoder.CODECS:
+        return FFmpegEncoder(fmt, sample_rate, dtype)
+    raise ValueError(f"不支持的流式格式: {fmt}")
@@ -0,0 +1,702 @@
+"""
+合成性能基准测试脚本
+
+用法（在项目根目录运行）:
+    python tools/tts_benchmark.py preview -p <预设名> -t "试听文本" -n 3
+    python tools/tts_benchmark.py backend -p <预设名> -d GPT_SoVITS/exported/v4 -n 3
+    python tools/tts_benchmark.py quant -p <预设名> -n 3
+    python tools/tts_benchmark.py sampler --top_k 15 --top_p 0.9
+    python tools/tts_benchmark.py speculative -p <预设名> -f <章节.txt> -k 4
+    python tools/tts_benchmark.py prefill -p <预设名> -b 1 4 16
+    python tools/tts_benchmark.py threads -p <预设名> -w 1 2 4 --threads 0 4 8
+    python tools/tts_benchmark.py api --url http://127.0.0.1:9880 -c 1 4 16 -n 32
+    python tools/tts_benchmark.py encode -i <音频.wav> --formats wav ogg opus aac mp3
+    python tools/tts_benchmark.py api_compat --url http://127.0.0.1:9880 --baseline_url http://127.0.0.1:9881 -r ref.wav --prompt_text "参考文本"
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+sys.path.append(os.path.join(project_root, "GPT_SoVITS"))
+os.chdir(project_root)
+
+DEFAULT_TEXT = "天色渐渐暗了下来，街上的行人越来越少，只有远处的灯火还在静静地亮着。"
+
+
+def load_engine(preset_name: str):
+    """按预设名加载 GPTSoVITS 引擎"""
+    from gpt_sovits import GPTSoVITS
+    from preset_manager import PresetManager
+
+    preset = PresetManager().get_preset(preset_name)
+    if preset is None:
+        raise SystemExit(f"预设不存在: {preset_name}")
+    settings, _ = preset
+    settings = dict(settings)
+    settings.setdefault("gpt_path", settings.get("model_path", ""))
+
+    engine = GPTSoVITS()
+    if not engine.set_preset(settings):
+        raise SystemExit(f"预设加载失败: {preset_name}")
+    return engine
+
+
+def audio_seconds(path: str) -> float:
+    import soundfile as sf
+
+    info = sf.info(path)
+    return info.frames / info.samplerate
+
+
+def time_call(fn, repeat: int, warmup: int = 1):
+    """运行 fn 若干次，返回 (每次耗时列表, 最后一次的返回值)"""
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - t0)
+    return timings, result
+
+
+def report(rows, baseline_label: str):
+    """打印 (标签, 耗时列表, 音频秒数) 表格，并给出相对 baseline 的加速比"""
+    baseline = None
+    for label, timings, _ in rows:
+        if label == baseline_label:
+            baseline = statistics.mean(timings)
+    print(f"{'mode':<12}{'mean(s)':>10}{'min(s)':>10}{'audio(s)':>10}{'RTF':>8}{'speedup':>9}")
+    for label, timings, seconds in rows:
+        mean = statistics.mean(timings)
+        rtf = mean / seconds if seconds else float("nan")
+        speedup = baseline / mean if baseline else float("nan")
+        print(f"{label:<12}{mean:>10.3f}{min(timings):>10.3f}{seconds:>10.2f}{rtf:>8.3f}{speedup:>8.2f}x")
+
+
+def bench_preview(args):
+    """对比正式试听与草稿试听的延迟"""
+    engine = load_engine(args.preset)
+    rows = []
+    for label, draft in (("final", False), ("draft", True)):
+        timings, path = time_call(lambda: engine.generate_preview(args.text, draft=draft), args.repeat, args.warmup)
+        if path is None:
+            raise SystemExit(f"{label} 试听生成失败")
+        rows.append((label, timings, audio_seconds(path)))
+    report(rows, "final")
+
+
+def bench_backend(args):
+    """对比 eager / TorchScript / ONNX 推理后端的整句合成延迟（以 torch 为基准）"""
+    engine = load_engine(args.preset)
+    tts = engine.tts
+    tts.configs.exported_models_dir = args.exported_dir
+    rows = []
+    # 导出后端会替换 eager 组件，因此 torch 必须最先测
+    for backend in ("torch", "torchscript", "onnx"):
+        tts.configs.inference_backend = backend
+        tts.init_exported_models()
+        if backend != "torch" and tts.exported_vocoder is None:
+            print(f"跳过 {backend}: 导出模型不可用")
+            continue
+        timings, path = time_call(lambda: engine.generate_preview(args.text, draft=False), args.repeat, args.warmup)
+        if path is None:
+            raise SystemExit(f"{backend} 合成失败")
+        rows.append((backend, timings, audio_seconds(path)))
+    report(rows, "torch")
+
+
+def compare(reference, result) -> dict:
+    """两组输出的最大绝对误差与余弦相似度"""
+    import torch
+
+    reference = reference.float().flatten()
+    result = result.float().flatten()
+    return {
+        "max_abs_diff": (reference - result).abs().max().item(),
+        "cosine": torch.nn.functional.cosine_similarity(reference, result, dim=0).item(),
+    }
+
+
+def component_outputs(tts, inputs: dict, text: str) -> dict:
+    """在固定输入上运行 BERT / T2S / DiT，返回各组件输出"""
+    import torch
+
+    with torch.no_grad():
+        bert_inputs = tts.bert_tokenizer(text, return_tensors="pt")
+        bert = tts.bert_model(**bert_inputs, output_hidden_states=True)["hidden_states"][-3]
+
+        decoder = tts.t2s_model.model
+        xy_pos, attn_mask, _ = inputs["t2s"]
+        xy_dec = decoder.t2s_transformer.process_prompt(xy_pos, attn_mask, None)[0]
+        logits = decoder.ar_predict_layer(xy_dec)
+
+        dit = tts.vits_model.cfm.estimator(*inputs["estimator"])
+    return {"bert": bert, "t2s": logits, "dit": dit}
+
+
+def bench_quant(args):
+    """对比 fp32 与 int8 动态量化的 CPU 合成延迟，并给出各量化组件的数值误差"""
+    from export_torch_script_v4 import example_inputs
+
+    engine = load_engine(args.preset)
+    tts = engine.tts
+    if str(tts.configs.device) != "cpu":
+        raise SystemExit("int8 量化仅支持 CPU，请在 CPU 上运行")
+
+    inputs = example_inputs(tts, args.frames)
+    outputs = {}
+    rows = []
+    for mode in ("none", "int8"):
+        if mode != tts.configs.quantization:
+            tts.configs.quantization = mode
+            tts.init_t2s_weights(tts.configs.t2s_weights_path)
+            tts.init_vits_weights(tts.configs.vits_weights_path)
+            tts.init_bert_weights(tts.configs.bert_base_path)
+        outputs[mode] = component_outputs(tts, inputs, args.text)
+        timings, path = time_call(lambda: engine.generate_preview(args.text, draft=False), args.repeat, args.warmup)
+        if path is None:
+            raise SystemExit(f"{mode} 合成失败")
+        rows.append(("fp32" if mode == "none" else mode, timings, audio_seconds(path)))
+    report(rows, "fp32")
+
+    print()
+    print(f"{'component':<12}{'max_abs_diff':>14}{'cosine':>10}{'top1':>8}")
+    for name in ("bert", "t2s", "dit"):
+        reference, result = outputs["none"][name], outputs["int8"][name]
+        metrics = compare(reference, result)
+        top1 = ""
+        if name == "t2s":
+            top1 = f"{(reference.argmax(-1) == result.argmax(-1)).float().mean().item():>8.3f}"
+        print(f"{name:<12}{metrics['max_abs_diff']:>14.4f}{metrics['cosine']:>10.5f}{top1}")
+
+
+def bench_sampler(args):
+    """T2S 单步采样耗时：logits_to_probs + sample vs T2SSampler（CPU，不需要加载模型）"""
+    import torch
+    from AR.models.utils import T2SSampler, logits_to_probs, sample
+
+    torch.set_grad_enabled(False)
+    vocab_size = 1025
+    params = dict(
+        top_k=args.top_k, top_p=args.top_p, temperature=args.temperature, repetition_penalty=args.repetition_penalty
+    )
+    print(f"{'batch':>6}{'history':>9}{'naive(us)':>12}{'fused(us)':>12}{'speedup':>9}{'max|dp|':>10}")
+    for bsz in args.batch_sizes:
+        for history in args.history:
+            y = torch.randint(0, vocab_size - 1, (bsz, history))
+            logits = torch.randn(bsz, vocab_size) * 4
+            sampler = T2SSampler(y, vocab_size, **params)
+
+            naive, _ = time_call(lambda: sample(logits.clone(), y, **params), args.steps, args.warmup)
+            fused, _ = time_call(lambda: sampler.sample(logits), args.steps, args.warmup)
+
+            # 分布一致性：把 top-k 候选概率放回全词表后与原实现比较
+            sampler = T2SSampler(y, vocab_size, **params)
+            probs, indices = sampler.filter(logits)
+            full = torch.zeros(bsz, vocab_size).scatter_(1, indices, probs)
+            diff = (full - logits_to_probs(logits.clone(), y, **params)).abs().max().item()
+
+            naive_us = statistics.mean(naive) * 1e6
+            fused_us = statistics.mean(fused) * 1e6
+            print(f"{bsz:>6}{history:>9}{naive_us:>12.1f}{fused_us:>12.1f}{naive_us / fused_us:>8.2f}x{diff:>10.2e}")
+
+
+def bench_speculative(args):
+    """整章合成：逐 token 解码 vs 投机解码（layers / ngram 草稿），输出接受率与端到端加速比"""
+    with open(args.file, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    engine = load_engine(args.preset)
+    decoder = engine.tts.t2s_model.model
+    output_dir = os.path.join(project_root, "output", "benchmark")
+    os.makedirs(output_dir, exist_ok=True)
+
+    rows = []
+    stats = {}
+    for label, k, draft in [("baseline", 0, "layers")] + [(name, args.k, name) for name in args.drafts]:
+        engine.current_preset["speculative_k"] = k
+        engine.current_preset["speculative_draft"] = draft
+        path = os.path.join(output_dir, f"speculative_{label}.wav")
+        decoder.reset_speculative_stats()
+        timings, ok = time_call(lambda: engine.generate_audio(text, path), args.repeat, args.warmup)
+        if not ok:
+            raise SystemExit(f"{label} 合成失败")
+        rows.append((label, timings, audio_seconds(path)))
+        stats[label] = dict(decoder.speculative_stats)
+    report(rows, "baseline")
+
+    print()
+    print(f"{'draft':<12}{'rounds':>8}{'proposed':>10}{'accepted':>10}{'accept/round':>14}{'tokens/forward':>16}")
+    for label in args.drafts:
+        s = stats[label]
+        per_round = s["accepted"] / s["rounds"] if s["rounds"] else 0.0
+        per_forward = s["tokens"] / s["forwards"] if s["forwards"] else 0.0
+        print(f"{label:<12}{s['rounds']:>8}{s['proposed']:>10}{s['accepted']:>10}{per_round:>14.2f}{per_forward:>16.2f}")
+
+
+def bench_prefill(args):
+    """T2S prefill：左侧 padding + 完整 mask vs 无 padding 打包序列，长度不均的随机句子，输出延迟与峰值显存"""
+    import torch
+
+    engine = load_engine(args.preset)
+    decoder = engine.tts.t2s_model.model
+    device = engine.tts.configs.device
+    dtype = engine.tts.precision
+    cuda = str(device).startswith("cuda")
+    torch.set_grad_enabled(False)
+    generator = torch.Generator().manual_seed(0)
+
+    def prefill_padded(x_list, x_lens, y_pos):
+        max_len = int(x_lens.max())
+        x = torch.stack([torch.nn.functional.pad(x_item, (0, 0, max_len - x_item.shape[0], 0)) for x_item in x_list])
+        xy_pos, attn_mask = decoder._prefill_padded(x, x_lens, y_pos, max_len)
+        return decoder.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+
+    def peak_memory(fn):
+        if not cuda:
+            return float("nan")
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return (torch.cuda.max_memory_allocated() - base) / 2**20
+
+    def timed(fn):
+        def run():
+            result = fn()
+            if cuda:
+                torch.cuda.synchronize()
+            return result
+
+        return run
+
+    print(f"{'batch':>6}{'tokens':>8}{'padded':>8}{'pad(ms)':>10}{'ragged(ms)':>12}{'speedup':>9}{'pad(MB)':>10}{'ragged(MB)':>12}")
+    for bsz in args.batch_sizes:
+        lens = torch.randint(args.min_len, args.max_len + 1, (bsz,), generator=generator)
+        x_list = []
+        for length in lens.tolist():
+            phones = torch.randint(1, 300, (1, length), generator=generator).to(device)
+            bert = torch.randn(1, length, 1024, generator=generator).to(device=device, dtype=dtype)
+            x_item = decoder.ar_text_embedding(phones) + decoder.bert_proj(bert)
+            x_list.append(decoder.ar_text_position(x_item).squeeze(0))
+        x_lens = lens.to(device)
+        y = torch.randint(0, 1024, (bsz, args.prompt_len), generator=generator).to(device)
+        y_pos = decoder.ar_audio_position(decoder.ar_audio_embedding(y))
+
+        padded_fn = timed(lambda: prefill_padded(x_list, x_lens, y_pos))
+        ragged_fn = timed(lambda: decoder._prefill_ragged(x_list, y_pos))
+        padded, _ = time_call(padded_fn, args.repeat, args.warmup)
+        ragged, _ = time_call(ragged_fn, args.repeat, args.warmup)
+
+        tokens = int(lens.sum()) + bsz * args.prompt_len
+        padded_tokens = bsz * (int(lens.max()) + args.prompt_len)
+        pad_ms = statistics.mean(padded) * 1e3
+        ragged_ms = statistics.mean(ragged) * 1e3
+        print(
+            f"{bsz:>6}{tokens:>8}{padded_tokens:>8}{pad_ms:>10.2f}{ragged_ms:>12.2f}{pad_ms / ragged_ms:>8.2f}x"
+            f"{peak_memory(padded_fn):>10.1f}{peak_memory(ragged_fn):>12.1f}"
+        )
+
+
+def bench_threads_worker(args):
+    """threads 子命令启动的单个合成进程：先划分线程再加载模型，就绪后等待统一开始信号"""
+    from cpu_threads import apply_worker_threads, plan_workers
+
+    plan = plan_workers(args.workers, args.threads)[args.index]
+    apply_worker_threads(plan, pin=not args.no_pin)
+    engine = load_engine(args.preset)
+    output_dir = os.path.join(project_root, "output", "benchmark")
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"threads_{args.workers}x{args.threads}_{args.index}.wav")
+    engine.generate_audio(args.text, path)
+
+    print("@@ready", flush=True)
+    sys.stdin.readline()
+    start = time.time()
+    for _ in range(args.repeat):
+        if not engine.generate_audio(args.text, path):
+            raise SystemExit("合成失败")
+    end = time.time()
+    result = {"start": start, "end": end, "audio": audio_seconds(path) * args.repeat, "threads": plan.threads}
+    print("@@result " + json.dumps(result), flush=True)
+
+
+def bench_threads(args):
+    """扫描 合成进程数 × 每进程线程数，各进程同时开始合成，输出整体实时率（总耗时 / 总音频时长）"""
+    from cpu_threads import available_cores
+
+    def read_marker(proc, marker):
+        for line in proc.stdout:
+            if line.startswith(marker):
+                return line[len(marker) :].strip()
+        raise SystemExit(f"合成进程异常退出: {proc.args}")
+
+    print(f"可用核心数: {len(available_cores())}")
+    print(f"{'workers':>8}{'threads':>9}{'audio(s)':>10}{'wall(s)':>10}{'RTF':>8}")
+    results = []
+    for workers in args.workers:
+        for threads in args.threads:
+            procs = []
+            for index in range(workers):
+                cmd = [
+                    sys.executable, os.path.abspath(__file__), "_threads_worker",
+                    "-p", args.preset, "-t", args.text, "-n", str(args.repeat),
+                    "--workers", str(workers), "--index", str(index), "--threads", str(threads),
+                ]
+                if args.no_pin:
+                    cmd.append("--no_pin")
+                procs.append(subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+            for proc in procs:
+                read_marker(proc, "@@ready")
+            for proc in procs:
+                proc.stdin.write("go\n")
+                proc.stdin.flush()
+            reports = [json.loads(read_marker(proc, "@@result")) for proc in procs]
+            for proc in procs:
+                proc.wait()
+
+            wall = max(r["end"] for r in reports) - min(r["start"] for r in reports)
+            audio = sum(r["audio"] for r in reports)
+            actual_threads = reports[0]["threads"]
+            results.append((wall / audio, workers, actual_threads))
+            print(f"{workers:>8}{actual_threads:>9}{audio:>10.2f}{wall:>10.2f}{wall / audio:>8.3f}")
+
+    rtf, workers, threads = min(results)
+    print(f"\n最佳配置: {workers} 个合成进程 × {threads} 线程, RTF {rtf:.3f}")
+    print(f"对应 config.V4Config: CPU_WORKERS = {workers}, CPU_THREADS_PER_WORKER = {threads}")
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def bench_api(args):
+    """对运行中的 api_v4 服务压测：按并发数发送请求，统计 p50/p99 延迟与吞吐（req/s）"""
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+
+    payload = {"text": args.text, "text_language": args.language}
+    if args.refer_wav_path:
+        payload.update(
+            refer_wav_path=args.refer_wav_path, prompt_text=args.prompt_text, prompt_language=args.prompt_language
+        )
+    body = json.dumps(payload).encode("utf-8")
+
+    def request_once(_):
+        req = urllib.request.Request(args.url, data=body, headers={"Content-Type": "application/json"})
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=args.timeout) as resp:
+                resp.read()
+            return time.perf_counter() - t0, None
+        except Exception as e:
+            return time.perf_counter() - t0, str(e)
+
+    request_once(0)  # 预热
+    print(f"{'conc':>6}{'ok':>6}{'fail':>6}{'p50(s)':>10}{'p99(s)':>10}{'req/s':>10}")
+    for concurrency in args.concurrency:
+        total = max(args.requests, concurrency)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(request_once, range(total)))
+        wall = time.perf_counter() - t0
+        latencies = [t for t, err in results if err is None]
+        errors = [err for _, err in results if err is not None]
+        if not latencies:
+            print(f"{concurrency:>6}{0:>6}{len(errors):>6}  全部失败: {errors[0]}")
+            continue
+        print(
+            f"{concurrency:>6}{len(latencies):>6}{len(errors):>6}"
+            f"{percentile(latencies, 50):>10.3f}{percentile(latencies, 99):>10.3f}{len(latencies) / wall:>10.2f}"
+        )
+
+
+def api_compat_cases(args):
+    """api_compat 使用的请求：(名称, 方法, 路径, 参数)，覆盖现有接口的各类参数组合"""
+    refer = {"refer_wav_path": args.refer_wav_path, "prompt_text": args.prompt_text, "prompt_language": args.prompt_language}
+    text = {"text": args.text, "text_language": args.language}
+    cases = [
+        ("default_refer_get", "GET", "/", text),
+        ("default_refer_post", "POST", "/", text),
+        ("cut_punc", "POST", "/", {**text, "cut_punc": "，。"}),
+        ("bad_language", "POST", "/", {"text": args.text, "text_language": "xx"}),
+    ]
+    if args.refer_wav_path:
+        cases += [
+            ("refer_get", "GET", "/", {**refer, **text}),
+            ("refer_post", "POST", "/", {**refer, **text}),
+            ("sampling", "POST", "/", {**refer, **text, "top_k": 20, "top_p": 0.6, "temperature": 0.6, "speed": 1.2}),
+            ("inp_refs", "POST", "/", {**refer, **text, "inp_refs": [args.refer_wav_path]}),
+            ("sample_steps", "POST", "/", {**refer, **text, "sample_steps": 8}),
+        ]
+    return cases
+
+
+def call_api(base_url: str, method: str, path: str, params: dict, timeout: float):
+    """返回 (状态码, Content-Type, 响应体)"""
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    url = base_url.rstrip("/") + path
+    if method == "GET":
+        query = urllib.parse.urlencode(params, doseq=True)
+        req = urllib.request.Request(f"{url}?{query}")
+    else:
+        req = urllib.request.Request(
+            url, data=json.dumps(params).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.headers.get("Content-Type", ""), resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get("Content-Type", ""), e.read()
+
+
+def describe_response(status: int, content_type: str, body: bytes) -> dict:
+    import io
+    import soundfile as sf
+
+    result = {"status": status, "type": content_type.split(";")[0]}
+    if status == 200 and content_type.startswith("audio/"):
+        try:
+            info = sf.info(io.BytesIO(body))
+            result.update(sr=info.samplerate, seconds=info.frames / info.samplerate, subtype=info.subtype)
+        except Exception:
+            result.update(sr=None, seconds=None, subtype=None)  # 流式 ogg/aac 不一定能直接解析
+    return result
+
+
+def bench_api_compat(args):
+    """
+    接口兼容性检查：同一组请求分别发给两个 api_v4 服务（如 -e tts 与 -e legacy），
+    对比状态码、返回类型、采样率与音频时长；不设 --baseline_url 时只检查请求都能正常返回。
+    """
+    failures = 0
+    print(f"{'case':<20}{'status':>8}{'type':>14}{'sr':>8}{'audio(s)':>10}  result")
+    for name, method, path, params in api_compat_cases(args):
+        result = describe_response(*call_api(args.url, method, path, params, args.timeout))
+        problems = []
+        if args.baseline_url:
+            baseline = describe_response(*call_api(args.baseline_url, method, path, params, args.timeout))
+            for key in ("status", "type", "subtype"):
+                if result.get(key) != baseline.get(key):
+                    problems.append(f"{key}: {result.get(key)} != {baseline.get(key)}")
+            if result.get("seconds") and baseline.get("seconds"):
+                ratio = result["seconds"] / baseline["seconds"]
+                # 采样是随机的，时长只要求在同一量级
+                if not 1 / args.duration_tolerance <= ratio <= args.duration_tolerance:
+                    problems.append(f"时长比 {ratio:.2f}")
+        elif name != "bad_language" and result["status"] != 200:
+            problems.append(f"状态码 {result['status']}")
+        failures += bool(problems)
+        seconds = result.get("seconds")
+        print(
+            f"{name:<20}{result['status']:>8}{result['type']:>14}{str(result.get('sr', '-')):>8}"
+            f"{(f'{seconds:.2f}' if seconds else '-'):>10}  {'; '.join(problems) or 'ok'}"
+        )
+    if failures:
+        raise SystemExit(f"{failures} 个请求与基准不一致")
+    print("全部一致")
+
+
+def legacy_pack(fmt: str, pcm, rate: int) -> bytes:
+    """api_v4 原来的逐句打包：ogg 每句新开一个 SoundFile（放在大栈线程中），aac 每句启动一个 ffmpeg"""
+    import io
+    import threading
+    import soundfile as sf
+
+    if fmt == "ogg":
+        buffer = io.BytesIO()
+
+        def pack():
+            with sf.SoundFile(buffer, mode="w", samplerate=rate, channels=1, format="ogg") as f:
+                f.write(pcm)
+
+        previous = threading.stack_size(4096 * 4096)
+        thread = threading.Thread(target=pack)
+        thread.start()
+        thread.join()
+        threading.stack_size(previous)
+        return buffer.getvalue()
+    codec = {"aac": ["-c:a", "aac", "-f", "adts"], "mp3": ["-c:a", "libmp3lame", "-f", "mp3"]}[fmt]
+    process = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+         "-b:a", "128k", *codec, "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    out, _ = process.communicate(pcm.tobytes())
+    return out
+
+
+def bench_encode(args):
+    """流式编码的 CPU 开销：逐句新建编码器（原实现） vs 每个响应一个常驻编码器，按音频秒数归一"""
+    import numpy as np
+    import soundfile as sf
+    from tools.stream_encoder import create_encoder
+
+    if args.input:
+        audio, rate = sf.read(args.input, dtype="int16", always_2d=True)
+        pcm = audio[:, 0]
+    else:
+        rate = args.sample_rate
+        t = np.arange(int(rate * args.seconds)) / rate
+        pcm = (np.sin(2 * np.pi * 220 * t) * (0.3 + 0.2 * np.sin(2 * np.pi * 0.5 * t)) * 32767).astype(np.int16)
+    step = int(rate * args.chunk_seconds)
+    chunks = [pcm[i : i + step] for i in range(0, len(pcm), step)]
+    seconds = len(pcm) / rate
+
+    def cpu_time():
+        times = os.times()
+        return times.user + times.system + times.children_user + times.children_system
+
+    def run(encode):
+        wall0, cpu0 = time.perf_counter(), cpu_time()
+        size = encode()
+        return time.perf_counter() - wall0, cpu_time() - cpu0, size
+
+    def streaming(fmt):
+        encoder = create_encoder(fmt, rate, pcm.dtype)
+        size = sum(len(encoder.write(chunk)) for chunk in chunks)
+        return size + len(encoder.close())
+
+    print(f"音频 {seconds:.1f}s @ {rate}Hz, 每块 {args.chunk_seconds}s, 共 {len(chunks)} 块")
+    print(f"{'format':<8}{'mode':<10}{'wall(s)':>9}{'cpu(s)':>9}{'cpu/audio-s(ms)':>17}{'size(KB)':>10}")
+    for fmt in args.formats:
+        modes = [("stream", lambda: streaming(fmt))]
+        if fmt in ("ogg", "aac", "mp3"):
+            modes.insert(0, ("legacy", lambda: sum(len(legacy_pack(fmt, chunk, rate)) for chunk in chunks)))
+        for mode, encode in modes:
+            results = [run(encode) for _ in range(args.repeat)]
+            wall = statistics.mean(r[0] for r in results)
+            cpu = statistics.mean(r[1] for r in results)
+            size = results[-1][2]
+            print(f"{fmt:<8}{mode:<10}{wall:>9.3f}{cpu:>9.3f}{cpu / seconds * 1e3:>17.2f}{size / 1024:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AudioBookGenerator 合成性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    preview_parser = subparsers.add_parser("preview", help="试听延迟：正式音质 vs 草稿音质")
+    preview_parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    preview_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT, help="试听文本")
+    preview_parser.add_argument("-n", "--repeat", type=int, default=3, help="每种模式重复次数")
+    preview_parser.add_argument("--warmup", type=int, default=1, help="预热次数")
+    preview_parser.set_defaults(func=bench_preview)
+
+    backend_parser = subparsers.add_parser("backend", help="推理后端：eager vs TorchScript vs ONNX")
+    backend_parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    backend_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT, help="合成文本")
+    backend_parser.add_argument("-d", "--exported_dir", type=str, default="GPT_SoVITS/exported/v4", help="导出目录")
+    backend_parser.add_argument("-n", "--repeat", type=int, default=3, help="每种后端重复次数")
+    backend_parser.add_argument("--warmup", type=int, default=1, help="预热次数")
+    backend_parser.set_defaults(func=bench_backend)
+
+    quant_parser = subparsers.add_parser("quant", help="CPU int8 动态量化：延迟与数值误差")
+    quant_parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    quant_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT, help="合成文本")
+    quant_parser.add_argument("-f", "--frames", type=int, default=120, help="误差对比使用的语义 token 帧数")
+    quant_parser.add_argument("-n", "--repeat", type=int, default=3, help="每种模式重复次数")
+    quant_parser.add_argument("--warmup", type=int, default=1, help="预热次数")
+    quant_parser.set_defaults(func=bench_quant)
+
+    sampler_parser = subparsers.add_parser("sampler", help="T2S 单步采样耗时：原实现 vs 融合采样器")
+    sampler_parser.add_argument("-b", "--batch_sizes", type=int, nargs="+", default=[1, 4, 16], help="batch 大小")
+    sampler_parser.add_argument("--history", type=int, nargs="+", default=[100, 500, 1500], help="已生成 token 数")
+    sampler_parser.add_argument("--top_k", type=int, default=15)
+    sampler_parser.add_argument("--top_p", type=float, default=1.0)
+    sampler_parser.add_argument("--temperature", type=float, default=1.0)
+    sampler_parser.add_argument("--repetition_penalty", type=float, default=1.35)
+    sampler_parser.add_argument("-n", "--steps", type=int, default=200, help="计时步数")
+    sampler_parser.add_argument("--warmup", type=int, default=20, help="预热步数")
+    sampler_parser.set_defaults(func=bench_sampler)
+
+    speculative_parser = subparsers.add_parser("speculative", help="T2S 投机解码：整章合成加速比与接受率")
+    speculative_parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    speculative_parser.add_argument("-f", "--file", type=str, required=True, help="章节文本文件（UTF-8）")
+    speculative_parser.add_argument("-k", type=int, default=4, help="每轮草稿 token 数")
+    speculative_parser.add_argument("--drafts", type=str, nargs="+", default=["layers", "ngram"], choices=["layers", "ngram"])
+    speculative_parser.add_argument("-n", "--repeat", type=int, default=1, help="每种模式重复次数")
+    speculative_parser.add_argument("--warmup", type=int, default=0, help="预热次数")
+    speculative_parser.set_defaults(func=bench_speculative)
+
+    prefill_parser = subparsers.add_parser("prefill", help="T2S prefill：左侧 padding vs 无 padding 打包序列")
+    prefill_parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    prefill_parser.add_argument("-b", "--batch_sizes", type=int, nargs="+", default=[1, 4, 16], help="batch 大小")
+    prefill_parser.add_argument("--min_len", type=int, default=10, help="句子音素数下限")
+    prefill_parser.add_argument("--max_len", type=int, default=200, help="句子音素数上限")
+    prefill_parser.add_argument("--prompt_len", type=int, default=150, help="参考语义 token 数")
+    prefill_parser.add_argument("-n", "--repeat", type=int, default=10, help="重复次数")
+    prefill_parser.add_argument("--warmup", type=int, default=2, help="预热次数")
+    prefill_parser.set_defaults(func=bench_prefill)
+
+    threads_parser = subparsers.add_parser("threads", help="CPU 多进程合成：进程数 × 线程数扫描")
+    threads_parser.add_argument("-p", "--preset", type=str, required=True, help="预设名称")
+    threads_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT, help="合成文本")
+    threads_parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4], help="合成进程数")
+    threads_parser.add_argument("--threads", type=int, nargs="+", default=[0], help="每进程线程数，0 表示自动均分")
+    threads_parser.add_argument("-n", "--repeat", type=int, default=3, help="每个进程合成次数")
+    threads_parser.add_argument("--no_pin", action="store_true", help="不绑定核心，只限制线程数")
+    threads_parser.set_defaults(func=bench_threads)
+
+    api_parser = subparsers.add_parser("api", help="HTTP 服务压测：不同并发下的 p50/p99 延迟与吞吐")
+    api_parser.add_argument("--url", type=str, default="http://127.0.0.1:9880", help="api_v4 服务地址")
+    api_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT, help="合成文本")
+    api_parser.add_argument("-l", "--language", type=str, default="zh", help="合成文本语言")
+    api_parser.add_argument("-r", "--refer_wav_path", type=str, default="", help="参考音频，留空使用服务默认参考")
+    api_parser.add_argument("--prompt_text", type=str, default="")
+    api_parser.add_argument("--prompt_language", type=str, default="zh")
+    api_parser.add_argument("-c", "--concurrency", type=int, nargs="+", default=[1, 4, 16], help="并发数")
+    api_parser.add_argument("-n", "--requests", type=int, default=32, help="每种并发发送的请求数")
+    api_parser.add_argument("--timeout", type=float, default=600, help="单个请求超时秒数")
+    api_parser.set_defaults(func=bench_api)
+
+    encode_parser = subparsers.add_parser("encode", help="流式编码 CPU 开销：逐句打包 vs 常驻编码器")
+    encode_parser.add_argument("-i", "--input", type=str, default="", help="输入音频，留空使用合成的测试音")
+    encode_parser.add_argument("--formats", type=str, nargs="+", default=["wav", "ogg", "opus", "aac", "mp3"])
+    encode_parser.add_argument("--sample_rate", type=int, default=32000, help="测试音采样率")
+    encode_parser.add_argument("--seconds", type=float, default=60, help="测试音时长")
+    encode_parser.add_argument("--chunk_seconds", type=float, default=3, help="每块（句）时长")
+    encode_parser.add_argument("-n", "--repeat", type=int, default=3, help="重复次数")
+    encode_parser.set_defaults(func=bench_encode)
+
+    compat_parser = subparsers.add_parser("api_compat", help="HTTP 接口兼容性：对比两个服务对同一组请求的返回")
+    compat_parser.add_argument("--url", type=str, default="http://127.0.0.1:9880", help="待检查的服务地址")
+    compat_parser.add_argument("--baseline_url", type=str, default="", help="作为基准的服务地址，留空只检查可用性")
+    compat_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT, help="合成文本")
+    compat_parser.add_argument("-l", "--language", type=str, default="zh", help="合成文本语言")
+    compat_parser.add_argument("-r", "--refer_wav_path", type=str, default="", help="参考音频，留空跳过指定参考音频的用例")
+    compat_parser.add_argument("--prompt_text", type=str, default="")
+    compat_parser.add_argument("--prompt_language", type=str, default="zh")
+    compat_parser.add_argument("--duration_tolerance", type=float, default=1.5, help="音频时长比允许的倍数")
+    compat_parser.add_argument("--timeout", type=float, default=600, help="单个请求超时秒数")
+    compat_parser.set_defaults(func=bench_api_compat)
+
+    worker_parser = subparsers.add_parser("_threads_worker")
+    worker_parser.add_argument("-p", "--preset", type=str, required=True)
+    worker_parser.add_argument("-t", "--text", type=str, default=DEFAULT_TEXT)
+    worker_parser.add_argument("-n", "--repeat", type=int, default=3)
+    worker_parser.add_argument("--workers", type=int, required=True)
+    worker_parser.add_argument("--index", type=int, required=True)
+    worker_parser.add_argument("--threads", type=int, default=0)
+    worker_parser.add_argument("--no_pin", action="store_true")
+    worker_parser.set_defaults(func=bench_threads_worker)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,10 @@ from gpt_sovits import GPTSoVITS
 from preset_manager import PresetManager
 from preset_order_manager import PresetOrderManager
 from model_cache import get_global_model_cache
+from config import V4Config
+from seeding import segment_seed
+from synthesis_farm import SynthesisFarm, jobs_from_segments, prepare_preset_settings
+from synthesis_service import PRIORITY_INTERACTIVE, SynthesisService, SynthesisTask
 from typing import List, Dict, Optional, Tuple
 import jieba
 
@@ -120,6 +124,16 @@ class ReplaceHistoryManager:
 # 创建全局替换历史管理器实例
 replace_history_manager = ReplaceHistoryManager()
 
+# 全部页面共用的合成服务，首次使用时创建
+_synthesis_service = None
+
+def get_synthesis_service() -> SynthesisService:
+    """获取全局合成服务：一个 GPTSoVITS 实例、一个后台线程，试听与整本书合成在同一队列中按优先级执行"""
+    global _synthesis_service
+    if _synthesis_service is None:
+        _synthesis_service = SynthesisService(GPTSoVITS())
+    return _synthesis_service
+
 def enable_simple_preset_wheel_scrolling(combo_box: QComboBox, preset_order_manager):
     """
     为预设QComboBox启用简化的滚轮滚动功能，只在男主和女主之间切换
@@ -1282,6 +1296,15 @@ class PresetSettingCard(Card):
         aux_ref_note = QLabel("可以添加多个辅助参考音频进行音色融合（建议同性别）")
         aux_ref_note.setStyleSheet(f"color: #666; font-size: {int(base_font_size * 0.85)}px;")
         
+        # 草稿试听设置
+        draft_label = QLabel("草稿试听")
+        draft_label.setStyleSheet(f"font-size: {int(base_font_size * 0.9)}px;")
+        self.draft_mode_check = QCheckBox("试听使用草稿音质")
+        self.draft_mode_check.setChecked(default_params.get('draft_mode', False))  # 默认关闭
+        self.draft_mode_check.setStyleSheet(f"font-size: {int(base_font_size * 0.9)}px;")
+        draft_note = QLabel("试听时减少采样步数并关闭超分，音质较低但生成更快（不影响正式生成）")
+        draft_note.setStyleSheet(f"color: #666; font-size: {int(base_font_size * 0.85)}px;")
+        
         # 添加到布局
         infer_layout.addWidget(temp_label, 0, 0)
         infer_layout.addWidget(self.temp_spin, 0, 1)
@@ -1306,6 +1329,9 @@ class PresetSettingCard(Card):
         infer_layout.addWidget(aux_ref_label, 5, 0)
         infer_layout.addWidget(self.aux_ref_check, 5, 1)
         infer_layout.addWidget(aux_ref_note, 5, 2, 1, 2)
+        infer_layout.addWidget(draft_label, 6, 0)
+        infer_layout.addWidget(self.draft_mode_check, 6, 1)
+        infer_layout.addWidget(draft_note, 6, 2, 1, 2)
         
         infer_group.setLayout(infer_layout)
         
@@ -1484,6 +1510,7 @@ class PresetSettingCard(Card):
         self.sample_steps_spin.setValue(settings.get('sample_steps', 8))  # 更新默认值为8
         self.if_sr_check.setChecked(settings.get('if_sr', True))  # 更新默认值为True
         self.aux_ref_check.setChecked(settings.get('aux_ref_enabled', False))
+        self.draft_mode_check.setChecked(settings.get('draft_mode', False))
         
         # 设置语言选项
         text_lang = settings.get('text_lang', 'all_zh')
@@ -1549,6 +1576,7 @@ class PresetSettingCard(Card):
             'sample_steps': self.sample_steps_spin.value(),  # 采样步数
             'if_sr': self.if_sr_check.isChecked(),  # 音频超分辨率
             'aux_ref_enabled': self.aux_ref_check.isChecked(),  # 启用辅助参考音频
+            'draft_mode': self.draft_mode_check.isChecked(),  # 草稿试听
         }
         
         # 打印settings字典中的关键参数
@@ -1751,6 +1779,7 @@ class PresetSettingCard(Card):
         self.batch_size_spin.setValue(1)  # 批处理大小
         self.split_bucket_check.setChecked(False)  # 分桶处理
         self.aux_ref_check.setChecked(False)  # 辅助参考音频
+        self.draft_mode_check.setChecked(False)  # 草稿试听
         
         # 🔧 完全静默执行，无任何提示
     
@@ -1793,6 +1822,7 @@ class PresetSettingCard(Card):
                 'sample_steps': self.sample_steps_spin.value(),
                 'if_sr': self.if_sr_check.isChecked(),
                 'aux_ref_enabled': self.aux_ref_check.isChecked(),
+                'draft_mode': self.draft_mode_check.isChecked(),
             }
             
             # 获取所有预设并更新
@@ -1862,6 +1892,7 @@ class PresetSettingCard(Card):
             'sample_steps': 8,
             'if_sr': True,
             'aux_ref_enabled': False,
+            'draft_mode': False,
         }
         
         try:
@@ -1884,7 +1915,10 @@ class FirstSegmentCard(Card):
         self.current_segment_index = 0
         self.is_generating_preview = False
         self.preview_generated = False
-        self.gpt_sovits = GPTSoVITS()
+        # 试听交给全局合成服务，界面线程不直接调用 gpt_sovits 的加载与合成方法
+        self.synthesis_service = get_synthesis_service().client()
+        self.synthesis_service.task_finished.connect(self.on_preview_task_finished)
+        self.destroyed.connect(self.synthesis_service.cancel_all)
         self.player = QMediaPlayer()
         self.audio_output = QAudioOutput()
         self.player.setAudioOutput(self.audio_output)
@@ -2296,27 +2330,25 @@ class FirstSegmentCard(Card):
         self.preview_progress.setValue(0)
         self.preview_btn.setEnabled(False)
         self.preview_status.setText("🔄 生成中...")
-        QApplication.processEvents()
 
-        try:
-            gpt_path = self.current_preset_settings.get('model_path', '') or self.current_preset_settings.get('gpt_path', '')
-            self.gpt_sovits.load_models(gpt_path, self.current_preset_settings['sovits_path'])
-            self.gpt_sovits.set_preset(self.current_preset_settings)
-            
-            text = self.processed_segments[self.current_segment_index]
-            preview_text = self.get_preview_text(text)
-            
-            preview_path = self.gpt_sovits.generate_preview(preview_text)
-            
-            if preview_path:
-                self.preview_path = preview_path
-                self.on_preview_generated()
-            else:
-                self.reset_preview_state(error=True)
-                QMessageBox.warning(self, "错误", "生成试听音频失败")
-        except Exception as e:
+        # 加载模型、设置预设与合成都在后台线程中进行，结果经 on_preview_task_finished 返回
+        text = self.processed_segments[self.current_segment_index]
+        self.synthesis_service.submit(SynthesisTask(
+            text=self.get_preview_text(text),
+            output_path="",
+            settings=prepare_preset_settings(preset_name, self.current_preset_settings),
+            preview=True,
+            priority=PRIORITY_INTERACTIVE,
+        ))
+
+    def on_preview_task_finished(self, task: SynthesisTask, success: bool, error: str):
+        """后台试听合成结束"""
+        if success:
+            self.preview_path = task.output_path
+            self.on_preview_generated(draft=bool(task.settings.get('draft_mode', False)))
+        else:
             self.reset_preview_state(error=True)
-            QMessageBox.critical(self, "错误", f"生成预览时发生未知错误: {e}")
+            QMessageBox.warning(self, "错误", f"生成试听音频失败: {error}")
 
     def reset_preview_state(self, error=False):
         """重置预览状态"""
@@ -2325,11 +2357,14 @@ class FirstSegmentCard(Card):
         self.play_btn.setEnabled(self.preview_generated and not error)
         self.preview_progress.setEnabled(self.preview_generated and not error)
 
-    def on_preview_generated(self):
+    def on_preview_generated(self, draft: bool = False):
         """预览音频生成完成后的处理"""
         self.preview_generated = True
         self.reset_preview_state(error=False)
-        self.preview_status.setText("✅ 已生成")
+        if draft:
+            self.preview_status.setText("✅ 已生成（草稿音质）")
+        else:
+            self.preview_status.setText("✅ 已生成")
         
     def play_preview(self):
         """播放试听音频"""
@@ -2468,10 +2503,6 @@ class AutoGenerateCard(Card):
         self.preset_data = settings['preset_data']
         self.current_segment_index = 0
         self.is_generating = False
-        self.gpt_sovits = GPTSoVITS()
-        
-        # 添加前一个段落长度记录
-        self.prev_segment_length = 0
         
         # 添加文件名和目录相关属性
         self.main_window = self.window()
@@ -2488,26 +2519,18 @@ class AutoGenerateCard(Card):
         # 所有生成的音频文件路径列表
         self.generated_audio_files = []
         
-        self.init_ui()
+        # CPU_WORKERS > 1 时交给多进程合成，各合成进程自行加载模型
+        self.use_farm = V4Config.CPU_WORKERS > 1
+        self.farm = None
+        self.farm_timer = None
         
-        # 加载模型
-        gpt_path = self.preset_data.get('model_path', '') or self.preset_data.get('gpt_path', '')
-        if not self.gpt_sovits.load_models(gpt_path, self.preset_data['sovits_path']):
-            QMessageBox.warning(self, "错误", "加载模型失败")
-            return
-            
-        # 设置预设参数
-        # 确保设置包含gpt_sovits.py所需的所有必要字段
-        preset_settings = self.preset_data.copy()
-        preset_settings['preset_name'] = self.preset_name  # 添加预设名称
-        if 'gpt_path' not in preset_settings and 'model_path' in preset_settings:
-            preset_settings['gpt_path'] = preset_settings['model_path']
-        if 'ref_language' not in preset_settings:
-            preset_settings['ref_language'] = preset_settings.get('text_lang', 'all_zh')
-            
-        if not self.gpt_sovits.set_preset(preset_settings):
-            QMessageBox.warning(self, "错误", "设置预设失败")
-            return
+        # 单进程时交给全局合成服务，模型加载与预设设置随第一个任务完成
+        self.service = get_synthesis_service().client()
+        self.service.task_started.connect(self.on_segment_started)
+        self.service.task_finished.connect(self.on_segment_finished)
+        self.destroyed.connect(self.service.cancel_all)
+        
+        self.init_ui()
 
     def init_ui(self):
         layout = QVBoxLayout(self)
@@ -2535,17 +2558,18 @@ class AutoGenerateCard(Card):
         layout.addWidget(self.progress)
         layout.addWidget(preview_group)
         
+        # 停止按钮
+        self.stop_btn = QPushButton("停止生成")
+        self.stop_btn.clicked.connect(self.stop_generate)
+        layout.addWidget(self.stop_btn, alignment=Qt.AlignmentFlag.AlignCenter)
+        
         # 开始生成
         QTimer.singleShot(100, self.start_generate)
     
     def start_generate(self):
         """开始生成全书音频"""
         try:
-            # 设置预设
-            preset_settings = self.preset_data.copy()
-            preset_settings['preset_name'] = self.preset_name  # 添加预设名称
-            if not self.gpt_sovits.set_preset(preset_settings):
-                raise Exception("设置预设失败")
+            self.is_generating = True
             
             # 创建输出目录结构
             working_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Working")
@@ -2559,68 +2583,112 @@ class AutoGenerateCard(Card):
             self.merged_dir = os.path.join(processed_dir, "merged_segments")
             os.makedirs(self.merged_dir, exist_ok=True)
             
-            self.process_next_segment()
+            if self.use_farm:
+                self.start_farm_generate()
+            else:
+                self.start_service_generate()
             
         except Exception as e:
             QMessageBox.critical(self, "错误", f"开始生成失败: {str(e)}")
             self.on_generation_complete()
     
-    def process_next_segment(self):
-        """处理下一个段落"""
-        if self.current_segment_index >= len(self.segments):
+    def start_service_generate(self):
+        """一次性提交全部段落，由后台线程依次合成"""
+        preset_settings = prepare_preset_settings(self.preset_name, self.preset_data)
+        for index, text in enumerate(self.segments):
+            # 生成音频路径使用多人模式的命名格式
+            output_path = os.path.join(
+                self.audio_dir,
+                f"{self.source_filename}_段落{index + 1}_文本框1.wav"
+            )
+            self.service.submit(SynthesisTask(
+                text=text,
+                output_path=output_path,
+                settings=preset_settings,
+                seed=segment_seed(self.source_filename, index, text),
+                tag=index,
+            ))
+    
+    def on_segment_started(self, task: SynthesisTask):
+        """后台开始合成某个段落时更新显示"""
+        # 显示预览文本（限制长度以便阅读）
+        self.preview_text.setText(self.get_preview_text(task.text, 200))
+        self.progress.setValue(task.tag)
+    
+    def on_segment_finished(self, task: SynthesisTask, success: bool, error: str):
+        """某个段落合成结束"""
+        if not self.is_generating:
+            return
+        if not success:
+            self.service.cancel_all()
+            QMessageBox.critical(self, "错误", f"生成第 {task.tag + 1} 段失败：{error}")
             self.on_generation_complete()
             return
         
-        # 更新显示
-        current_text = self.segments[self.current_segment_index]
-        # 显示预览文本（限制长度以便阅读）
-        preview_text = self.get_preview_text(current_text, 200)
-        self.preview_text.setText(preview_text)
+        # 添加生成的文件到列表
+        self.generated_audio_files.append(task.output_path)
+        self.current_segment_index = task.tag + 1
         self.progress.setValue(self.current_segment_index)
-        
-        # 强制刷新UI
-        QApplication.processEvents()
-        
-        # 记录当前段落长度，供下一次生成使用
-        self.prev_segment_length = len(current_text)
-        
-        # 生成音频路径使用多人模式的命名格式
-        output_path = os.path.join(
-            self.audio_dir,
-            f"{self.source_filename}_段落{self.current_segment_index + 1}_文本框1.wav"
-        )
-        
-        # 使用QTimer异步生成音频，避免阻塞UI
-        QTimer.singleShot(100, lambda: self.generate_current_segment(output_path))
+        if self.current_segment_index >= len(self.segments):
+            self.on_generation_complete()
+    
+    def stop_generate(self):
+        """停止生成：丢弃尚未合成的段落，已生成的段落保留"""
+        if not self.is_generating:
+            return
+        if self.use_farm:
+            self.stop_farm(terminate=True)
+        self.on_generation_complete()
+    
+    def start_farm_generate(self):
+        """多进程合成：派发全部段落，定时轮询按书内顺序交付的结果"""
+        jobs = jobs_from_segments(self.segments, self.preset_name, self.preset_data, self.source_filename)
+        self.status_label.setText(f"正在使用 {V4Config.CPU_WORKERS} 个进程生成...")
+        self.preview_text.setText(self.get_preview_text(self.segments[0], 200) if self.segments else "")
+        
+        self.farm = SynthesisFarm(V4Config.CPU_WORKERS, V4Config.CPU_THREADS_PER_WORKER)
+        self.farm.start()
+        self.farm.submit(jobs)
+        
+        self.farm_timer = QTimer(self)
+        self.farm_timer.timeout.connect(self.poll_farm)
+        self.farm_timer.start(200)
     
-    def generate_current_segment(self, output_path: str):
-        """生成当前段落的音频"""
+    def poll_farm(self):
+        """处理多进程合成的结果"""
         try:
-            # 生成音频
-            success = self.gpt_sovits.generate_audio(
-                self.segments[self.current_segment_index],
-                output_path
-            )
-            
-            if success:
-                # 添加生成的文件到列表
-                self.generated_audio_files.append(output_path)
-                self.current_segment_index += 1
-                
-                # 添加基于前一个段落长度的延迟，然后处理下一个段落
-                if self.current_segment_index < len(self.segments):
-                    delay_ms = max(100, self.prev_segment_length // 2)  # 最少100ms延迟
-                    QTimer.singleShot(delay_ms, self.process_next_segment)
-                else:
+            for index, path in self.farm.poll(timeout=0):
+                if path is None:
+                    error = self.farm.failed.get(index, '')
+                    self.stop_farm()
+                    QMessageBox.critical(self, "错误", f"生成第 {index + 1} 段失败：{error}")
                     self.on_generation_complete()
-            else:
-                QMessageBox.critical(self, "错误", f"生成第 {self.current_segment_index + 1} 段失败")
+                    return
+                self.generated_audio_files.append(path)
+                self.current_segment_index = index + 1
+                self.progress.setValue(self.current_segment_index)
+                if self.current_segment_index < len(self.segments):
+                    self.preview_text.setText(self.get_preview_text(self.segments[self.current_segment_index], 200))
+            
+            if self.farm.done:
+                self.stop_farm()
                 self.on_generation_complete()
-                
         except Exception as e:
+            self.stop_farm()
             QMessageBox.critical(self, "错误", f"生成第 {self.current_segment_index + 1} 段时出错: {str(e)}")
             self.on_generation_complete()
     
+    def stop_farm(self, terminate: bool = False):
+        if self.farm_timer is not None:
+            self.farm_timer.stop()
+            self.farm_timer = None
+        if self.farm is not None:
+            if terminate:
+                self.farm.terminate()
+            else:
+                self.farm.close()
+            self.farm = None
+    
     def get_preview_text(self, text: str, limit: int = 200) -> str:
         """获取预览文本（保持句子完整性）"""
         if len(text) <= limit:
@@ -2639,6 +2707,10 @@ class AutoGenerateCard(Card):
     
     def on_generation_complete(self):
         """全部生成完成"""
+        self.is_generating = False
+        self.stop_btn.setEnabled(False)
+        # 被中断时丢弃本页面尚未合成的段落
+        self.service.cancel_all()
         self.status_label.setText("✅ 生成完成！")
         self.progress.setValue(len(self.segments))
         
@@ -4895,7 +4967,14 @@ class SegmentProcessCard(Card):
         else:
             self.batch_size = 5000
         
-        self.gpt_sovits = GPTSoVITS()
+        # 单个生成与批量生成都交给全局合成服务；单个生成优先，会中断正在进行的批量任务
+        self.synthesis_service = get_synthesis_service().client()
+        self.synthesis_service.task_started.connect(self.on_synthesis_started)
+        self.synthesis_service.task_finished.connect(self.on_synthesis_finished)
+        self.synthesis_service.task_cancelled.connect(self.on_synthesis_cancelled)
+        self.synthesis_service.task_preempted.connect(self.on_synthesis_preempted)
+        self.destroyed.connect(self.synthesis_service.cancel_all)
+        self.batch_task_ids = set()
         self.segment_audio_states = {}
         self.player = QMediaPlayer()
         self.audio_output = QAudioOutput()
@@ -5519,7 +5598,7 @@ class SegmentProcessCard(Card):
                        status_label: QLabel, is_regenerate: bool = False):
         print(f"[LOG] generate_audio called, preset={preset_name}, emotion={emotion}")
         
-        """生成音频"""
+        """生成音频（提交到后台合成线程，完成后由 on_synthesis_finished 更新界面）"""
         try:
             # 获取文本内容并检查是否为空
             text = text_edit.toPlainText().strip()
@@ -5530,57 +5609,17 @@ class SegmentProcessCard(Card):
                 # 不再禁用试听按钮，让用户随时可以尝试试听
                 return
                 
-            # 更新状态为处理中
-            status_label.setText("⏳")  # 处理中
-            QApplication.processEvents()  # 立即更新UI
-            
             # 获取预设信息
-            preset_info = self.preset_manager.get_preset(preset_name)
-            if not preset_info:
-                status_label.setText("❌")  # 错误
-                return
-                
-            settings, audio_files = preset_info
-            
-            # 加载模型
-            gpt_path = settings.get('model_path', '') or settings.get('gpt_path', '')
-            if not self.gpt_sovits.load_models(gpt_path, settings['sovits_path']):
-                status_label.setText("❌")  # 错误
-                return
-                
-            # 设置预设参数，并添加情绪参数
-            settings['ref_emotion'] = emotion  # 确保使用用户选择的情绪
-            settings['preset_name'] = preset_name  # 添加预设名称
-            
-            # 确保设置包含gpt_sovits.py所需的所有必要字段
-            if 'gpt_path' not in settings and 'model_path' in settings:
-                settings['gpt_path'] = settings['model_path']
-            if 'ref_language' not in settings:
-                settings['ref_language'] = settings.get('text_lang', 'all_zh')
-            
-            if not self.gpt_sovits.set_preset(settings):
+            settings = self._synthesis_settings(preset_name, emotion)
+            if settings is None:
                 status_label.setText("❌")  # 错误
                 return
             
-            # 尝试从MainWindow获取当前处理的文件名
-            main_window = self.window()
-            source_filename = "unknown"
-            
-            if hasattr(main_window, 'current_file') and main_window.current_file:
-                # 从MainWindow获取当前文件路径
-                source_filename = os.path.splitext(os.path.basename(main_window.current_file))[0]
-            
-            # 创建音频目录
-            working_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Working")
-            processed_dir = os.path.join(working_dir, f"{source_filename}_processed")
-            audio_dir = os.path.join(processed_dir, "audio_segments")
-            os.makedirs(audio_dir, exist_ok=True)
-            
-            # 生成音频文件名，包含原文件名、段落和框序号
             text_edit_id = text_edit.objectName()
+            source_filename, audio_path = self._segment_audio_path(text_edit_id)
             segment_index, box_index = map(int, text_edit_id.split('_'))
-            audio_filename = f"{source_filename}_段落{segment_index+1:04d}_文本框{box_index+1:02d}.wav"
-            audio_path = os.path.join(audio_dir, audio_filename)
+            audio_dir = os.path.dirname(audio_path)
+            os.makedirs(audio_dir, exist_ok=True)
             
             # 重要：先停止播放器，确保不会阻止文件替换
             try:
@@ -5598,68 +5637,114 @@ class SegmentProcessCard(Card):
                     except Exception as e:
                         pass  # 无法删除旧文件
             
-            # 记录开始生成语音的信息（便于调试）
-            
-            
-            
-            # 生成音频（不显示进度对话框）并明确传递情绪参数
-            success = self.gpt_sovits.generate_audio(text, audio_path, emotion=emotion)
+            # 更新状态为处理中，生成期间禁用按钮防止重复提交
+            status_label.setText("⏳")  # 处理中
+            generate_btn.setEnabled(False)
+            regenerate_btn.setEnabled(False)
             
-            if success:
-                # 先检查文件是否确实存在
-                if os.path.exists(audio_path):
-        
-                    
-                    # 如果是重新生成，尝试重置播放器状态
-                    if is_regenerate:
-                        try:
-                            # 重置播放器以清除可能的缓存
-        
-                            self.player.stop()
-                            # 创建新的播放器实例
-                            del self.player
-                            del self.audio_output
-                            
-                            self.player = QMediaPlayer()
-                            self.audio_output = QAudioOutput()
-                            self.player.setAudioOutput(self.audio_output)
-                            
-                            # 恢复音量设置
-                            self.audio_output.setVolume(self.current_volume / 100.0)
-                        except Exception as e:
-                            pass  # 重置播放器时出错，不影响生成结果
-                    
-                    # 保存音频状态
-                    self.segment_audio_states[text_edit_id] = (True, audio_path)
-                    
-                    # 强制更新状态标签为成功
-                    status_label.setText("🌷")  # 成功
-                    QApplication.processEvents()  # 立即更新UI
-                    
-                    # 更新按钮状态
-                    generate_btn.setEnabled(False)
-                    regenerate_btn.setEnabled(True)
-                    preview_btn.setEnabled(True)
-                    
-                    # 如果是重新生成，更新状态emoji和按钮状态
-                    if is_regenerate:
-    
-                        status_label.setText("🥳")  # 确保状态为成功
-                        preview_btn.setEnabled(True)  # 确保试听按钮可用
-                    
-                else:
-                    pass  # 音频生成成功但文件不存在
-                    status_label.setText("⚠️")  # 警告
-                    QMessageBox.warning(self, "警告", "音频生成成功但文件不存在")
-            else:
-                # 更新状态为失败
-                status_label.setText("❌")  # 错误
-
+            # 首次生成使用固定 seed，与批量生成结果一致；重新生成使用随机 seed
+            seed = -1 if is_regenerate else segment_seed(source_filename, segment_index, text, box_index)
+            self.synthesis_service.submit(SynthesisTask(
+                text=text,
+                output_path=audio_path,
+                settings=settings,
+                emotion=emotion,
+                seed=seed,
+                tag=(text_edit_id, (generate_btn, regenerate_btn, preview_btn, status_label), is_regenerate),
+                priority=PRIORITY_INTERACTIVE,
+            ))
                 
         except Exception as e:
             # 更新状态为失败
             status_label.setText("❌")  # 错误
     
+    def _synthesis_settings(self, preset_name: str, emotion: str) -> Optional[dict]:
+        """读取预设并补齐 gpt_sovits.py 所需的字段，找不到预设时返回 None"""
+        preset_info = self.preset_manager.get_preset(preset_name)
+        if not preset_info:
+            return None
+        settings, _ = preset_info
+        return prepare_preset_settings(preset_name, settings, emotion)
+    
+    def _segment_audio_path(self, text_edit_id: str) -> Tuple[str, str]:
+        """返回 (原文件名, 文本框对应的音频路径)"""
+        main_window = self.window()
+        source_filename = "unknown"
+        if hasattr(main_window, 'current_file') and main_window.current_file:
+            source_filename = os.path.splitext(os.path.basename(main_window.current_file))[0]
+        working_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Working")
+        processed_dir = os.path.join(working_dir, f"{source_filename}_processed")
+        audio_dir = os.path.join(processed_dir, "audio_segments")
+        segment_index, box_index = map(int, text_edit_id.split('_'))
+        audio_filename = f"{source_filename}_段落{segment_index+1:04d}_文本框{box_index+1:02d}.wav"
+        return source_filename, os.path.join(audio_dir, audio_filename)
+    
+    def on_synthesis_started(self, task: SynthesisTask):
+        """后台开始合成某个文本框"""
+        if task.task_id in self.batch_task_ids:
+            self.progress_dialog.setLabelText(
+                f"正在处理第 {self.batch_done + 1}/{len(self.sorted_tasks)} 条音频..."
+            )
+    
+    def on_synthesis_finished(self, task: SynthesisTask, success: bool, error: str):
+        """后台合成结束，更新对应文本框的状态"""
+        text_edit_id, (generate_btn, regenerate_btn, preview_btn, status_label), is_regenerate = task.tag
+        try:
+            if success and os.path.exists(task.output_path):
+                # 如果是重新生成，尝试重置播放器状态
+                if is_regenerate:
+                    try:
+                        # 重置播放器以清除可能的缓存
+                        self.player.stop()
+                        # 创建新的播放器实例
+                        del self.player
+                        del self.audio_output
+                        
+                        self.player = QMediaPlayer()
+                        self.audio_output = QAudioOutput()
+                        self.player.setAudioOutput(self.audio_output)
+                        
+                        # 恢复音量设置
+                        self.audio_output.setVolume(self.current_volume / 100.0)
+                    except Exception as e:
+                        pass  # 重置播放器时出错，不影响生成结果
+                
+                # 保存音频状态
+                self.segment_audio_states[text_edit_id] = (True, task.output_path)
+                
+                # 如果是重新生成，状态emoji为🥳
+                status_label.setText("🥳" if is_regenerate else "🌷")  # 成功
+                generate_btn.setEnabled(False)
+                regenerate_btn.setEnabled(True)
+                preview_btn.setEnabled(True)
+            else:
+                if task.task_id in self.batch_task_ids:
+                    self.batch_failed += 1
+                if error:
+                    print(f"[LOG] 文本框 {text_edit_id} 生成失败: {error}")
+                status_label.setText("❌")  # 错误
+                generate_btn.setEnabled(True)
+        except RuntimeError:
+            pass  # 文本框所在的段落页面已被切换，控件已销毁
+        self._on_batch_task_done(task)
+    
+    def on_synthesis_preempted(self, task: SynthesisTask):
+        """批量任务让出给单个生成，稍后自动重新合成"""
+        print(f"--- [诊断] 文本框 {task.tag[0]} 的批量任务被单个生成中断，稍后重新合成")
+        if task.task_id in self.batch_task_ids:
+            self.progress_dialog.setLabelText("正在优先处理单个生成，完成后继续批量生成...")
+    
+    def on_synthesis_cancelled(self, task: SynthesisTask):
+        """任务被取消，恢复文本框的按钮状态"""
+        _, (generate_btn, regenerate_btn, preview_btn, status_label), _ = task.tag
+        try:
+            if status_label.text() == "⏳":
+                status_label.setText("🔄")
+            generate_btn.setEnabled(True)
+        except RuntimeError:
+            pass
+        self._on_batch_task_done(task)
+    
     def preview_audio(self, text_edit: QTextEdit):
         """预览音频（最终优化版）"""
         try:
@@ -6188,6 +6273,10 @@ class SegmentProcessCard(Card):
     def generate_all_audio(self):
         """一键生成所有音频（V4.0 带 print 诊断）"""
         
+        if self.batch_task_ids:
+            QMessageBox.information(self, "提示", "批量生成正在进行中")
+            return
+        
         print("\n--- [诊断] generate_all_audio: 开始收集任务 ---")
         tasks_by_composite_key = {}
         text_box_widgets = {}
@@ -6241,7 +6330,8 @@ class SegmentProcessCard(Card):
         self.text_box_widgets = text_box_widgets
         self.progress_dialog = QProgressDialog("正在批量生成音频...", "取消", 0, len(self.sorted_tasks), self)
         self.progress_dialog.setWindowTitle("批量生成")
-        self.progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        # 非模态：批量生成期间仍可单独生成文本框，单个生成会优先执行
+        self.progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
         self.progress_dialog.setMinimumWidth(350)
         self.progress_dialog.setPalette(QApplication.palette())
         self.progress_dialog.setStyleSheet("""
@@ -6263,96 +6353,70 @@ class SegmentProcessCard(Card):
             QProgressDialog QPushButton:hover { background-color: #B5C8DC; }
         """)
         
-        self.current_batch_index = 0
-        self.last_loaded_preset = None
-        self.last_emotion_used = None
+        self.batch_task_ids = set()
+        self.batch_done = 0
+        self.batch_failed = 0  # 生成失败或因找不到预设而跳过的任务数
+        self.progress_dialog.canceled.connect(self.synthesis_service.cancel_all)
         self.progress_dialog.show()
-        self._process_batch_item()
-
-    # 也请用这个带 print 的完整版本替换现有的 _process_batch_item 方法
-    def _process_batch_item(self):
-        """（V4.0 带 print 诊断）处理单个批量任务"""
-        if self.progress_dialog.wasCanceled() or self.current_batch_index >= len(self.sorted_tasks):
-            self.progress_dialog.close()
-            if not self.progress_dialog.wasCanceled():
-                 QMessageBox.information(self, "完成", "所有音频已生成完毕！")
-            return
-
-        preset_name, task_id, emotion = self.sorted_tasks[self.current_batch_index]
-        text_edit, generate_btn, regenerate_btn, preview_btn, status_label = self.text_box_widgets[task_id]
-        
-        print(f"==> [诊断] 开始处理任务 #{self.current_batch_index + 1}")
-        print(f"    - 任务要求: 配音员='{preset_name}', 情绪='{emotion}'")
-        
-        self.progress_dialog.setValue(self.current_batch_index)
-        self.progress_dialog.setLabelText(f"正在处理第 {self.current_batch_index + 1}/{len(self.sorted_tasks)} 条音频...")
-        QApplication.processEvents()
-        
-        try:
-            status_label.setText("⏳")
-            QApplication.processEvents()
+        self._submit_batch_tasks()
+
+    def _submit_batch_tasks(self):
+        """把批量任务一次性提交到后台合成线程，同一配音员与情绪的任务相邻，减少切换预设"""
+        settings_cache = {}
+        for task_index, (preset_name, task_id, emotion) in enumerate(self.sorted_tasks):
+            text_edit, generate_btn, regenerate_btn, preview_btn, status_label = self.text_box_widgets[task_id]
+            key = (preset_name, emotion)
+            if key not in settings_cache:
+                settings_cache[key] = self._synthesis_settings(preset_name, emotion)
+            settings = settings_cache[key]
+            if settings is None:
+                print(f"--- [诊断] 任务 #{task_index + 1}: 找不到预设 {preset_name}，跳过")
+                status_label.setText("❌")
+                self.batch_done += 1
+                self.batch_failed += 1
+                continue
             
-            last_preset = getattr(self, 'last_loaded_preset', None)
-            last_emotion = getattr(self, 'last_emotion_used', None)
-            print(f"    - 程序记忆: 上次配音员='{last_preset}', 上次情绪='{last_emotion}'")
-
-            if preset_name != last_preset or emotion != last_emotion:
-                print(f"    - 决策: 检测到状态变化，需要更新。")
-                if preset_name != last_preset:
-                    print(f"      - 原因: 配音员发生变化 ('{last_preset}' -> '{preset_name}')")
-                if emotion != last_emotion:
-                    print(f"      - 原因: 情绪发生变化 ('{last_emotion}' -> '{emotion}')")
-
-                preset_info = self.preset_manager.get_preset(preset_name)
-                if not preset_info: raise Exception(f"找不到预设 {preset_name}")
-                settings, _ = preset_info
-
-                if preset_name != last_preset:
-                    print(f"    - 执行: 正在调用 load_models...")
-                    gpt_path = settings.get('model_path', '') or settings.get('gpt_path', '')
-                    sovits_path = settings.get('sovits_path', '')
-                    if not self.gpt_sovits.load_models(gpt_path, sovits_path):
-                        raise Exception(f"加载模型失败: {preset_name}")
-                
-                print(f"    - 执行: 正在调用 set_preset, 使用情绪='{emotion}'...")
-                settings['ref_emotion'] = emotion
-                if not self.gpt_sovits.set_preset(settings):
-                    raise Exception(f"设置预设失败: {preset_name}")
-                
-                self.last_loaded_preset = preset_name
-                self.last_emotion_used = emotion
-                print(f"    - 更新记忆: 最新配音员='{self.last_loaded_preset}', 最新情绪='{self.last_emotion_used}'")
-            else:
-                print(f"    - 决策: 状态未变化，跳过所有准备工作。")
-
             text_edit_id = text_edit.objectName()
-            main_window = self.window()
-            source_filename = "unknown"
-            if hasattr(main_window, 'current_file') and main_window.current_file:
-                source_filename = os.path.splitext(os.path.basename(main_window.current_file))[0]
-            working_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Working")
-            processed_dir = os.path.join(working_dir, f"{source_filename}_processed")
-            audio_dir = os.path.join(processed_dir, "audio_segments")
+            source_filename, audio_path = self._segment_audio_path(text_edit_id)
             segment_index, box_index = map(int, text_edit_id.split('_'))
-            audio_filename = f"{source_filename}_段落{segment_index+1:04d}_文本框{box_index+1:02d}.wav"
-            audio_path = os.path.join(audio_dir, audio_filename)
             text_to_generate = text_edit.toPlainText().strip()
-            success = self.gpt_sovits.generate_audio(text_to_generate, audio_path, emotion=emotion)
-
-            if success:
-                self.segment_audio_states[text_edit_id] = (True, audio_path)
-                status_label.setText("🌷")
-                if generate_btn: generate_btn.setEnabled(False)
-                if regenerate_btn: regenerate_btn.setEnabled(True)
-                if preview_btn: preview_btn.setEnabled(True)
-            else:
-                status_label.setText("❌")
-        except Exception as e:
-            status_label.setText("❌")
-
-        print(f"<== [诊断] 任务 #{self.current_batch_index + 1} 处理结束\n")
-        self.current_batch_index += 1
-        QTimer.singleShot(0, self._process_batch_item)
+            status_label.setText("⏳")
+            submitted_id = self.synthesis_service.submit(SynthesisTask(
+                text=text_to_generate,
+                output_path=audio_path,
+                settings=settings,
+                emotion=emotion,
+                seed=segment_seed(source_filename, segment_index, text_to_generate, box_index),
+                tag=(text_edit_id, (generate_btn, regenerate_btn, preview_btn, status_label), False),
+            ))
+            self.batch_task_ids.add(submitted_id)
+        self.progress_dialog.setValue(self.batch_done)
+        if not self.batch_task_ids:
+            self._finish_batch()
+
+    def _on_batch_task_done(self, task: SynthesisTask):
+        """批量任务中的一个已完成或已取消"""
+        if task.task_id not in self.batch_task_ids:
+            return
+        self.batch_task_ids.discard(task.task_id)
+        self.batch_done += 1
+        self.progress_dialog.setValue(self.batch_done)
+        if not self.batch_task_ids:
+            self._finish_batch()
+
+    def _finish_batch(self):
+        canceled = self.progress_dialog.wasCanceled()
+        self.progress_dialog.close()
+        if canceled:
+            return
+        if self.batch_failed:
+            QMessageBox.warning(
+                self, "完成",
+                f"已生成 {len(self.sorted_tasks) - self.batch_failed}/{len(self.sorted_tasks)} 条音频，"
+                f"{self.batch_failed} 条失败或被跳过（标记为 ❌），可单独重新生成。"
+            )
+        else:
+            QMessageBox.information(self, "完成", "所有音频已生成完毕！")
     
     def merge_segment_audio(self):
         """合并当前段落所有音频"""